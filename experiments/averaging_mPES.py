@@ -1,7 +1,9 @@
 import argparse
-from subprocess import run
 
+from memristor_nengo.experiment import MPESConfig
 from memristor_nengo.extras import *
+from memristor_nengo.store import ResultsStore
+from memristor_nengo.sweep import run_sweep, save_records, sweep_seed
 
 parser = argparse.ArgumentParser()
 parser.add_argument( "-a", "--averaging", type=int, required=True )
@@ -14,6 +16,17 @@ parser.add_argument( "-l", "--learning_rule", default="mPES", choices=[ "mPES",
 parser.add_argument( "--directory", default="../data/" )
 parser.add_argument( "-lt", "--learn_time", default=3 / 4, type=float )
 parser.add_argument( "-d", "--device", default="/cpu:0" )
+parser.add_argument( "-S", "--simulation_time", type=float, default=30 )
+parser.add_argument( "-w", "--workers", type=int,
+                     help="The number of runs at the same time.  Default is the number of CPUs" )
+parser.add_argument( "-t", "--timeout", type=float, help="The seconds after which a run is stopped" )
+parser.add_argument( "-r", "--retries", type=int, default=1,
+                     help="The number of times a failed run is started again.  Default is 1" )
+parser.add_argument( "-s", "--seed", type=int, default=0,
+                     help="The seed the seeds of the runs are derived from.  Default is 0" )
+parser.add_argument( "--store",
+                     help="The file where the runs are saved as they end, and where the completed ones are looked up "
+                          "to skip them.  Default is runs.jsonl next to the timestamped folders" )
 args = parser.parse_args()
 
 learning_rule = args.learning_rule
@@ -27,53 +40,53 @@ directory = args.directory
 learn_time = args.learn_time
 device = args.device
 
-dir_name, dir_images, dir_data = make_timestamped_dir(
-        root=directory + "averaging/" + str( learning_rule ) + "/" + function + "_" + str( inputs ) + "_" + str(
-            neurons ) + "_"
-             + str( dimensions ) + "_" + str( gain ) + "/" )
+root = directory + "averaging/" + str( learning_rule ) + "/" + function + "_" + str( inputs ) + "_" + str( neurons ) \
+       + "_" + str( dimensions ) + "_" + str( gain ) + "/"
+dir_name, dir_images, dir_data = make_timestamped_dir( root=root )
+# the store is shared by all the averagings of these options, and its keys tell their runs apart
+store_path = args.store or root + "runs.jsonl"
 print( "Reserved folder", dir_name )
 
 print( "Evaluation for", learning_rule )
 print( "Averaging runs", num_averaging )
 
-res_mse = [ ]
-res_pearson = [ ]
-res_spearman = [ ]
-res_kendall = [ ]
+configs = [ MPESConfig( function=function, inputs=tuple( inputs * 2 )[ :2 ], dimensions=dimensions,
+                        neurons=(neurons,) * 3, gain=gain, learning_rule=learning_rule, learn_time=learn_time,
+                        device=device, simulation_time=args.simulation_time, seed=sweep_seed( args.seed, avg ) )
+            for avg in range( num_averaging ) ]
+
 counter = 0
-for avg in range( num_averaging ):
+
+
+def print_record( record ):
+    global counter
     counter += 1
-    print( f"[{counter}/{num_averaging}] Averaging #{avg + 1}" )
-    result = run(
-            [ "python", "mPES.py", "-v", "-D", str( dimensions ), "-l", str( learning_rule ), "-N", str( neurons ),
-              "-f", str( function ), "-lt", str( learn_time ), "-g", str( gain ), "-d",
-              str( device ) ]
-            + [ "-i" ] + inputs,
-            capture_output=True,
-            universal_newlines=True )
-    
-    # save statistics
-    try:
-        mse = np.mean( [ float( i ) for i in result.stdout.split( "\n" )[ 0 ][ 1:-1 ].split( "," ) ] )
-        print( "MSE", mse )
-        res_mse.append( mse )
-        pearson = np.mean( [ float( i ) for i in result.stdout.split( "\n" )[ 1 ][ 1:-1 ].split( "," ) ] )
-        print( "Pearson", pearson )
-        res_pearson.append( pearson )
-        spearman = np.mean( [ float( i ) for i in result.stdout.split( "\n" )[ 2 ][ 1:-1 ].split( "," ) ] )
-        print( "Spearman", spearman )
-        res_spearman.append( spearman )
-        kendall = np.mean( [ float( i ) for i in result.stdout.split( "\n" )[ 3 ][ 1:-1 ].split( "," ) ] )
-        print( "Kendall", kendall )
-        res_kendall.append( kendall )
-    except:
-        print( "Ret", result.returncode )
-        print( "Out", result.stdout )
-        print( "Err", result.stderr )
-mse_means = np.mean( res_mse )
-pearson_means = np.mean( res_pearson )
-spearman_means = np.mean( res_spearman )
-kendall_means = np.mean( res_kendall )
+    print( f"[{counter}/{num_averaging}] Averaging #{record.index + 1}: {record.status} "
+           + ("from the store" if record.stored
+              else f"after {record.attempts} attempt(s) in {record.elapsed:.1f} s") )
+    if record.status == "ok":
+        for name, value in record.summary().items():
+            print( name.capitalize() if name != "mse" else "MSE", value )
+    else:
+        print( record.error )
+
+
+store = ResultsStore( store_path )
+print( f"Saving the runs in {store_path}, which holds {len( store )} already" )
+records = run_sweep( configs, workers=args.workers, timeout=args.timeout, retries=args.retries,
+                     on_record=print_record, store=store )
+failed = [ record for record in records if record.status != "ok" ]
+if failed:
+    print( f"{len( failed )} of {len( records )} runs failed and are left out of the averages" )
+
+# the failed runs are NaN, which are left out of the averages
+summaries = [ record.summary() for record in records ]
+res_mse, res_pearson, res_spearman, res_kendall = [ [ summary[ name ] for summary in summaries ]
+                                                    for name in ("mse", "pearson", "spearman", "kendall") ]
+mse_means = np.nanmean( res_mse )
+pearson_means = np.nanmean( res_pearson )
+spearman_means = np.nanmean( res_spearman )
+kendall_means = np.nanmean( res_kendall )
 print( "Average MSE:", mse_means )
 print( "Average Pearson:", pearson_means )
 print( "Average Spearman:", spearman_means )
@@ -106,4 +119,7 @@ with open( dir_data + "parameters.txt", "w" ) as f:
     f.write( f"Neurons: {neurons}\n" )
     f.write( f"Dimensions: {dimensions}\n" )
     f.write( f"Number of runs for averaging: {num_averaging}\n" )
+    f.write( f"Seed: {args.seed}\n" )
+    f.write( f"Failed runs: {len( failed )}\n" )
+save_records( records, dir_data + "runs.csv" )
 print( f"Saved data in {dir_data}" )
@@ -0,0 +1,71 @@
+import argparse
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from scipy.stats import truncnorm
+
+from memristor_nengo.learning_rules import draw_devices
+
+parser = argparse.ArgumentParser()
+parser.add_argument( "-N", "--neurons", nargs="*", default=[ 100, 500, 1000, 2000 ], type=int,
+                     help="The crossbar sizes (post = pre) to benchmark.  Default is 100 500 1000 2000" )
+parser.add_argument( "-n", "--noise", nargs="*", default=[ 0.15, 0.5 ], type=float,
+                     help="The noise levels of the device parameters to benchmark; above about 0.25 some samples of the "
+                          "minimum resistance are rejected and redrawn.  Default is 0.15 0.5" )
+parser.add_argument( "-t", "--threads", default=1, type=int,
+                     help="The number of threads drawing blocks of the crossbar.  Default is 1" )
+parser.add_argument( "--seed", default=0, type=int )
+args = parser.parse_args()
+
+mpes = SimpleNamespace( r_min=200, r_max=2.3e8, exponent=-0.146 )
+
+
+def reference_draw( shape, seed ):
+    """The original initialisation, reseeding the global NumPy RNG and sampling with `scipy.stats.truncnorm`."""
+    
+    def get_truncated_normal( mean, sd, low, upp ):
+        return truncnorm( (low - mean) / sd, (upp - mean) / sd, loc=mean, scale=sd ) \
+            .rvs( np.prod( shape ) ) \
+            .reshape( shape )
+    
+    np.random.seed( seed )
+    r_min_noisy = get_truncated_normal( mpes.r_min, mpes.r_min * mpes.noise_percentage[ 0 ], 0, np.inf )
+    np.random.seed( seed )
+    r_max_noisy = get_truncated_normal( mpes.r_max, mpes.r_max * mpes.noise_percentage[ 1 ], np.max( r_min_noisy ),
+                                        np.inf )
+    np.random.seed( seed )
+    exponent_noisy = np.random.normal( mpes.exponent, np.abs( mpes.exponent ) * mpes.noise_percentage[ 2 ], shape )
+    np.random.seed( seed )
+    pos_mem_initial = np.random.normal( 1e8, 1e8 * mpes.noise_percentage[ 3 ], shape )
+    np.random.seed( seed + 1 )
+    neg_mem_initial = np.random.normal( 1e8, 1e8 * mpes.noise_percentage[ 3 ], shape )
+    
+    return r_min_noisy, r_max_noisy, exponent_noisy, pos_mem_initial, neg_mem_initial
+
+
+print( "Benchmarking the initialisation of the devices" + (f" on {args.threads} threads" if args.threads > 1 else "") )
+print( "Noise", "Neurons", "Reference (s)", "Generator (s)", "Speedup", "Max relative mean difference", sep="\t" )
+for noise, n_neurons in [ (noise, n_neurons) for noise in args.noise for n_neurons in args.neurons ]:
+    mpes.noise_percentage = [ noise ] * 4
+    shape = (n_neurons, n_neurons)
+    
+    start_time = time.perf_counter()
+    reference = reference_draw( shape, args.seed )
+    reference_time = time.perf_counter() - start_time
+    
+    start_time = time.perf_counter()
+    devices = draw_devices( mpes, shape, args.seed, threads=args.threads )
+    generator_time = time.perf_counter() - start_time
+    
+    # the draw must not depend on the global NumPy RNG nor on the number of threads
+    np.random.seed( None )
+    assert all( np.array_equal( x, y ) for x, y in zip( devices, draw_devices( mpes, shape, args.seed ) ) )
+    print( noise,
+           n_neurons,
+           f"{reference_time:.3f}",
+           f"{generator_time:.3f}",
+           f"{reference_time / generator_time:.2f}x",
+           # the draws come from different streams, so only their statistics can be compared
+           max( np.abs( np.mean( x ) - np.mean( y ) ) / np.abs( np.mean( x ) ) for x, y in zip( reference, devices ) ),
+           sep="\t" )
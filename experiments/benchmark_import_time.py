@@ -0,0 +1,55 @@
+import argparse
+import json
+import sys
+from subprocess import run
+
+import numpy as np
+
+parser = argparse.ArgumentParser()
+parser.add_argument( "-m", "--modules", nargs="*",
+                     default=[ "memristor_nengo.learning_rules", "memristor_nengo.extras" ],
+                     help="The modules to import.  Default is memristor_nengo.learning_rules memristor_nengo.extras" )
+parser.add_argument( "-r", "--repeats", default=5, type=int,
+                     help="The number of fresh interpreters each module is imported in.  Default is 5" )
+parser.add_argument( "-b", "--budget", default=2.0, type=float,
+                     help="The median import time, in seconds, above which the benchmark fails.  Default is 2" )
+args = parser.parse_args()
+
+# each import is timed in a new interpreter, as the modules it loads are cached by the first one
+child = """
+import json, sys, time
+start_time = time.perf_counter()
+import {module}
+print( json.dumps( {{ "time"      : time.perf_counter() - start_time,
+                     "tensorflow": "tensorflow" in sys.modules,
+                     "nengo_dl"  : "nengo_dl" in sys.modules }} ) )
+"""
+
+print( f"Benchmarking the import time of {len( args.modules )} modules over {args.repeats} fresh interpreters" )
+print( "Module", "Median (s)", "Min (s)", "Imports TensorFlow", "Imports NengoDL", sep="\t" )
+over_budget = [ ]
+for module in args.modules:
+    results = [ ]
+    for _ in range( args.repeats ):
+        result = run( [ sys.executable, "-c", child.format( module=module ) ], capture_output=True,
+                      universal_newlines=True )
+        if result.returncode != 0:
+            print( "Ret", result.returncode )
+            print( "Err", result.stderr )
+            sys.exit( 1 )
+        results.append( json.loads( result.stdout.splitlines()[ -1 ] ) )
+    
+    times = [ r[ "time" ] for r in results ]
+    # neither TensorFlow nor NengoDL should be paid for by the runs on Nengo
+    if np.median( times ) > args.budget or results[ 0 ][ "tensorflow" ] or results[ 0 ][ "nengo_dl" ]:
+        over_budget.append( module )
+    print( module,
+           f"{np.median( times ):.3f}",
+           f"{np.min( times ):.3f}",
+           results[ 0 ][ "tensorflow" ],
+           results[ 0 ][ "nengo_dl" ],
+           sep="\t" )
+
+if over_budget:
+    print( f"Over the {args.budget} s budget or importing TensorFlow: {' '.join( over_budget )}" )
+    sys.exit( 1 )
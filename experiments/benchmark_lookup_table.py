@@ -0,0 +1,47 @@
+import argparse
+import time
+
+import numpy as np
+
+from memristor_nengo.lookup_tables import PowerLawTable
+
+parser = argparse.ArgumentParser()
+parser.add_argument( "-s", "--sizes", nargs="*", default=[ 8, 16, 32, 64, 128 ], type=int,
+                     help="The numbers of samples per octave to benchmark.  Default is 8 16 32 64 128" )
+parser.add_argument( "-b", "--buckets", default=64, type=int,
+                     help="The number of exponent buckets.  Default is 64" )
+parser.add_argument( "-N", "--neurons", default=1000, type=int,
+                     help="The crossbar size (post = pre).  Default is 1000" )
+parser.add_argument( "-e", "--exponent", default=-0.146, type=float )
+parser.add_argument( "-n", "--noise", default=0.15, type=float )
+parser.add_argument( "--seed", default=0, type=int )
+args = parser.parse_args()
+
+rng = np.random.RandomState( args.seed )
+shape = (args.neurons, args.neurons)
+exponent = rng.normal( args.exponent, np.abs( args.exponent ) * args.noise, shape )
+pulses = np.exp( rng.uniform( 0, 24 * np.log( 2 ), shape ) )
+
+start_time = time.perf_counter()
+analytical = np.power( pulses, exponent )
+power_time = time.perf_counter() - start_time
+
+print( f"Power law n^c on {args.neurons}x{args.neurons} devices with n in [1, 2^24] and {args.buckets} buckets" )
+print( f"np.power: {power_time * 1e3:.3f} ms" )
+print( "Size", "Entries", "Lookup (ms)", "Speedup", "Max relative error", "Error bound", sep="\t" )
+for size in args.sizes:
+    table = PowerLawTable( exponent, size=size, buckets=args.buckets )
+
+    start_time = time.perf_counter()
+    interpolated = table( pulses, table.position )
+    lookup_time = time.perf_counter() - start_time
+
+    error = np.max( np.abs( interpolated - analytical ) / analytical )
+    assert error <= table.error_bound
+    print( size,
+           table.table.size,
+           f"{lookup_time * 1e3:.3f}",
+           f"{power_time / lookup_time:.2f}x",
+           f"{error:.2e}",
+           f"{table.error_bound:.2e}",
+           sep="\t" )
@@ -0,0 +1,90 @@
+import argparse
+import time
+
+import numpy as np
+from nengo.builder import Signal
+
+from memristor_nengo.learning_rules import SimmPES
+
+parser = argparse.ArgumentParser()
+parser.add_argument( "-N", "--neurons", default=1000, type=int,
+                     help="The crossbar size (post = pre) to benchmark.  Default is 1000" )
+parser.add_argument( "-r", "--rates", nargs="*", default=[ 5, 10, 20, 50, 100, 200 ], type=float,
+                     help="The firing rates of the pre neurons (Hz) to benchmark.  Default is 5 10 20 50 100 200" )
+parser.add_argument( "-s", "--steps", default=100, type=int,
+                     help="The number of timesteps to run for each firing rate.  Default is 100" )
+parser.add_argument( "--seed", default=0, type=int )
+args = parser.parse_args()
+
+dt = 0.001
+r_min = 200
+r_max = 2.3e8
+exponent = -0.146
+gain = 1e4
+noise = 0.15
+
+
+shape = (args.neurons, args.neurons)
+rng = np.random.RandomState( args.seed )
+r_min_noisy = rng.normal( r_min, r_min * noise, shape )
+r_max_noisy = rng.normal( r_max, r_max * noise, shape )
+exponent_noisy = rng.normal( exponent, np.abs( exponent ) * noise, shape )
+pos_initial = rng.normal( 1e8, 1e8 * noise, shape )
+neg_initial = rng.normal( 1e8, 1e8 * noise, shape )
+
+
+def run_operator( errors, activities, spikes, event_driven ):
+    """Time the dense or the event-driven `SimmPES` update over the given inputs."""
+    pre_filtered = Signal( shape=(args.neurons,), name="pre_filtered" )
+    pre_spikes = Signal( shape=(args.neurons,), name="pre_spikes" )
+    local_error = Signal( shape=(args.neurons,), name="local_error" )
+    pos_memristors = Signal( shape=shape, name="pos_memristors" )
+    neg_memristors = Signal( shape=shape, name="neg_memristors" )
+    weights = Signal( shape=shape, name="weights" )
+    signals = {
+            pre_filtered  : np.zeros( args.neurons ),
+            pre_spikes    : np.zeros( args.neurons ),
+            local_error   : np.zeros( args.neurons ),
+            pos_memristors: pos_initial.copy(),
+            neg_memristors: neg_initial.copy(),
+            weights       : np.zeros( shape )
+            }
+    op = SimmPES( pre_filtered, local_error, None, pos_memristors, neg_memristors, weights, noise, gain,
+                  r_min_noisy, r_max_noisy, exponent_noisy, pre_spikes=pre_spikes if event_driven else None )
+    step = op.make_step( signals, dt, None )
+    start_time = time.perf_counter()
+    for error, activity, spike in zip( errors, activities, spikes ):
+        signals[ local_error ][ ... ] = error
+        signals[ pre_filtered ][ ... ] = activity
+        signals[ pre_spikes ][ ... ] = spike
+        step()
+    
+    return (time.perf_counter() - start_time) / args.steps, signals[ pos_memristors ], signals[ neg_memristors ]
+
+
+print( f"Benchmarking the dense and event-driven mPES step on a {args.neurons}x{args.neurons} crossbar for "
+       f"{args.steps} steps" )
+print( "Rate (Hz)", "Spiking columns", "Dense (ms/step)", "Event-driven (ms/step)", "Speedup", sep="\t" )
+for rate in args.rates:
+    rng = np.random.RandomState( args.seed )
+    errors = rng.normal( 0, 1, (args.steps, args.neurons) )
+    # Poisson spike trains of amplitude 1/dt, as Nengo's, and their activity filtered as by the default pre synapse
+    spikes = (rng.uniform( 0, 1, (args.steps, args.neurons) ) < rate * dt) / dt
+    activities = np.zeros_like( spikes )
+    for i in range( args.steps ):
+        activities[ i ] = (activities[ i - 1 ] if i > 0 else rate) * np.exp( -dt / 0.005 ) \
+                          + spikes[ i ] * (1 - np.exp( -dt / 0.005 ))
+    
+    dense_time, *_ = run_operator( errors, activities, spikes, event_driven=False )
+    event_time, pos_event, neg_event = run_operator( errors, activities, spikes, event_driven=True )
+    
+    # the devices of the pre neurons that never spiked are never pulsed
+    silent = ~np.any( spikes, axis=0 )
+    assert np.array_equal( pos_event[ :, silent ], pos_initial[ :, silent ] ) \
+           and np.array_equal( neg_event[ :, silent ], neg_initial[ :, silent ] )
+    print( rate,
+           f"{np.mean( spikes > 0 ) * 100:.1f}%",
+           f"{dense_time * 1e3:.3f}",
+           f"{event_time * 1e3:.3f}",
+           f"{dense_time / event_time:.2f}x",
+           sep="\t" )
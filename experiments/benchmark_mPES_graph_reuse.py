@@ -0,0 +1,54 @@
+import argparse
+import time
+
+import nengo_dl
+import numpy as np
+
+from memristor_nengo.extras import build_sine_network, setup
+from memristor_nengo.learning_rules_dl import reinitialise_mpes
+
+setup()
+
+parser = argparse.ArgumentParser()
+parser.add_argument( "-g", "--gains", nargs="*", default=[ 1e3, 1e4, 1e5, 1e6 ], type=float,
+                     help="The gains swept by the benchmark.  Default is 1e3 1e4 1e5 1e6" )
+parser.add_argument( "-N", "--neurons", default=100, type=int,
+                     help="The number of neurons in the pre, post and error ensembles.  Default is 100" )
+parser.add_argument( "-s", "--steps", default=1000, type=int,
+                     help="The number of timesteps to run for each sweep point.  Default is 1000" )
+parser.add_argument( "-d", "--device", default="/cpu:0" )
+parser.add_argument( "--seed", default=0, type=int )
+args = parser.parse_args()
+
+
+print( f"Benchmarking a sweep over {len( args.gains )} gains of a {args.neurons} neurons mPES network on NengoDL "
+       f"({args.device}) for {args.steps} steps each" )
+print( "Gain", "Rebuilt (s)", "Reused (s)", "Speedup", "Max weight difference", sep="\t" )
+
+# the simulator reused across the sweep is built once, outside of the timings
+model, probes = build_sine_network( args.neurons, seed=args.seed, weights_every=args.steps * 1e-3,
+                                    gain=args.gains[ 0 ] )
+reused_probe = probes[ "weights" ]
+reused_sim = nengo_dl.Simulator( model, seed=args.seed, device=args.device, progress_bar=False )
+for gain in args.gains:
+    start_time = time.perf_counter()
+    model, probes = build_sine_network( args.neurons, seed=args.seed, weights_every=args.steps * 1e-3, gain=gain )
+    with nengo_dl.Simulator( model, seed=args.seed, device=args.device, progress_bar=False ) as sim:
+        sim.run_steps( args.steps )
+        rebuilt_weights = sim.data[ probes[ "weights" ] ][ -1 ]
+    rebuilt_time = time.perf_counter() - start_time
+    
+    start_time = time.perf_counter()
+    reinitialise_mpes( reused_sim, gain=gain )
+    reused_sim.run_steps( args.steps )
+    reused_weights = reused_sim.data[ reused_probe ][ -1 ]
+    reused_time = time.perf_counter() - start_time
+    
+    # both simulators start from the same devices, so they should learn the same weights
+    print( gain,
+           f"{rebuilt_time:.3f}",
+           f"{reused_time:.3f}",
+           f"{rebuilt_time / reused_time:.2f}x",
+           np.max( np.abs( rebuilt_weights - reused_weights ) ),
+           sep="\t" )
+reused_sim.close()
@@ -0,0 +1,69 @@
+import argparse
+import time
+
+import nengo
+import numpy as np
+
+from memristor_nengo.learning_rules import SimmPES, mPES
+
+parser = argparse.ArgumentParser()
+parser.add_argument( "-C", "--connections", nargs="*", default=[ 1, 2, 4, 8, 16 ], type=int,
+                     help="The numbers of learned connections to benchmark.  Default is 1 2 4 8 16" )
+parser.add_argument( "-N", "--neurons", default=100, type=int,
+                     help="The number of neurons in the pre and post ensembles of each connection.  Default is 100" )
+parser.add_argument( "-s", "--steps", default=500, type=int,
+                     help="The number of timesteps to run for each network.  Default is 500" )
+parser.add_argument( "-p", "--pulse_state", action="store_true",
+                     help="Keep the pulse number of each device as state" )
+parser.add_argument( "--seed", default=0, type=int )
+args = parser.parse_args()
+
+
+def build_network( n_connections ):
+    """Learn the identity on ``n_connections`` independent neuron-to-neuron connections, as in ``mPES.py``."""
+    with nengo.Network( seed=args.seed ) as model:
+        input_node = nengo.Node( lambda t: [ np.sin( 2 * np.pi * t ), np.cos( 2 * np.pi * t ) ] )
+        weight_probes = [ ]
+        for i in range( n_connections ):
+            pre = nengo.Ensemble( args.neurons, 2 )
+            post = nengo.Ensemble( args.neurons, 2 )
+            error = nengo.Ensemble( args.neurons, 2 )
+            nengo.Connection( input_node, pre )
+            conn = nengo.Connection( pre.neurons, post.neurons, transform=np.zeros( (args.neurons, args.neurons) ),
+                                     learning_rule_type=mPES( noisy=[ 0.15 ] * 4, gain=1e4, seed=args.seed + i,
+                                                              pulse_state=args.pulse_state ) )
+            nengo.Connection( error, conn.learning_rule )
+            nengo.Connection( post, error )
+            nengo.Connection( pre, error, transform=-1 )
+            weight_probes.append( nengo.Probe( conn, "weights", synapse=None, sample_every=args.steps * 1e-3 ) )
+    
+    return model, weight_probes
+
+
+def run( n_connections, optimize ):
+    model, weight_probes = build_network( n_connections )
+    with nengo.Simulator( model, optimize=optimize, progress_bar=False ) as sim:
+        n_operators = sum( isinstance( op, SimmPES ) for op in sim._step_order )
+        start_time = time.perf_counter()
+        sim.run_steps( args.steps )
+        step_time = (time.perf_counter() - start_time) / args.steps
+    
+    return step_time, n_operators, [ sim.data[ p ] for p in weight_probes ]
+
+
+print( f"Benchmarking a {args.neurons} neurons mPES network for {args.steps} steps with and without operator merging"
+       + (", with pulse numbers as state" if args.pulse_state else "") )
+print( "Connections", "SimmPES ops", "Separate (ms/step)", "SimmPES ops", "Merged (ms/step)", "Speedup", sep="\t" )
+for n_connections in args.connections:
+    separate_time, separate_operators, separate_weights = run( n_connections, optimize=False )
+    merged_time, merged_operators, merged_weights = run( n_connections, optimize=True )
+    
+    # merging changes how the update is vectorised but not a single floating point operation
+    assert all( np.array_equal( s, m ) for s, m in zip( separate_weights, merged_weights ) )
+    print( n_connections,
+           separate_operators,
+           f"{separate_time * 1e3:.3f}",
+           merged_operators,
+           f"{merged_time * 1e3:.3f}",
+           f"{separate_time / merged_time:.2f}x",
+           sep="\t" )
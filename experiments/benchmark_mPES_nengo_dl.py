@@ -0,0 +1,68 @@
+import argparse
+import time
+
+import nengo
+import nengo_dl
+import numpy as np
+
+from memristor_nengo.extras import build_sine_network, setup
+
+setup()
+
+parser = argparse.ArgumentParser()
+parser.add_argument( "-N", "--neurons", nargs="*", default=[ 100, 300, 1000 ], type=int,
+                     help="The crossbar sizes (post = pre) to benchmark.  Default is 100 300 1000" )
+parser.add_argument( "-s", "--steps", default=1000, type=int,
+                     help="The number of timesteps to run for each crossbar size.  Default is 1000" )
+parser.add_argument( "-u", "--unroll", default=10, type=int,
+                     help="The number of timesteps NengoDL unrolls in its graph.  Default is 10" )
+parser.add_argument( "-m", "--minibatch_size", default=1, type=int,
+                     help="The number of independent realisations of the devices simulated together.  Default is 1" )
+parser.add_argument( "-p", "--pulse_state", action="store_true",
+                     help="Keep the pulse number of each device as state" )
+parser.add_argument( "-d", "--device", default="/cpu:0" )
+parser.add_argument( "--seed", default=0, type=int )
+args = parser.parse_args()
+
+
+print( f"Benchmarking mPES on NengoDL ({args.device}) for {args.steps} steps, unrolling {args.unroll} steps"
+       + (f", with {args.minibatch_size} device realisations" if args.minibatch_size > 1 else "")
+       + (", with pulse numbers as state" if args.pulse_state else "") )
+print( "Neurons", "Nengo (ms/step)", "NengoDL first run (ms/step)", "NengoDL (ms/step/realisation)",
+       "Max weight difference", sep="\t" )
+for n_neurons in args.neurons:
+    model, probes = build_sine_network( n_neurons, seed=args.seed, weights_every=args.steps * 1e-3,
+                                        pulse_state=args.pulse_state )
+    weight_probe = probes[ "weights" ]
+    with model:
+        # NengoDL runs in float32 by default, while the results are compared against the float64 NumPy operator
+        nengo_dl.configure_settings( dtype="float64" )
+    
+    with nengo.Simulator( model, seed=args.seed, progress_bar=False ) as sim:
+        start_time = time.perf_counter()
+        sim.run_steps( args.steps )
+        nengo_time = (time.perf_counter() - start_time) / args.steps
+        nengo_weights = sim.data[ weight_probe ][ -1 ]
+    
+    with nengo_dl.Simulator( model, seed=args.seed, device=args.device, unroll_simulation=args.unroll,
+                             minibatch_size=args.minibatch_size, progress_bar=False ) as sim:
+        # the first run also traces the graph, the second one is the steady state
+        start_time = time.perf_counter()
+        sim.run_steps( args.steps )
+        first_time = (time.perf_counter() - start_time) / args.steps
+        # the first element of the minibatch simulates the same devices as Nengo, and only with a minibatch does the
+        # probe data have a leading minibatch axis
+        nengo_dl_weights = sim.data[ weight_probe ][ 0, -1 ] if args.minibatch_size > 1 \
+            else sim.data[ weight_probe ][ -1 ]
+        
+        start_time = time.perf_counter()
+        sim.run_steps( args.steps )
+        nengo_dl_time = (time.perf_counter() - start_time) / args.steps / args.minibatch_size
+    
+    # the two backends learn from the same spikes, so they should only differ by the rounding of the power law
+    print( n_neurons,
+           f"{nengo_time * 1e3:.3f}",
+           f"{first_time * 1e3:.3f}",
+           f"{nengo_dl_time * 1e3:.3f}",
+           np.max( np.abs( nengo_weights - nengo_dl_weights ) ),
+           sep="\t" )
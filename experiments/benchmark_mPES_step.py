@@ -0,0 +1,204 @@
+import argparse
+import copy
+import time
+
+import numpy as np
+from nengo.builder import Signal
+
+from memristor_nengo.learning_rules import SimmPES, resistance2pulses
+from memristor_nengo.lookup_tables import PowerLawTable
+
+parser = argparse.ArgumentParser()
+parser.add_argument( "-N", "--neurons", nargs="*", default=[ 10, 100, 1000 ], type=int,
+                     help="The crossbar sizes (post = pre) to benchmark.  Default is 10 100 1000" )
+parser.add_argument( "-s", "--steps", default=100, type=int,
+                     help="The number of timesteps to run for each crossbar size.  Default is 100" )
+parser.add_argument( "-a", "--active", default=0.5, type=float,
+                     help="The fraction of pre neurons active at each step.  Default is 0.5" )
+parser.add_argument( "-c", "--converged", default=0.0, type=float,
+                     help="The fraction of post neurons whose error is inside the deadzone at each step.  Default is 0" )
+parser.add_argument( "-g", "--gated", default=0.5, type=float,
+                     help="The fraction of post neurons inside the deadzone in the gated run of the dense fused "
+                          "operator.  Default is 0.5" )
+parser.add_argument( "-p", "--pulse_state", action="store_true",
+                     help="Keep the pulse number of each device as state in the fused operators" )
+parser.add_argument( "-l", "--lut_size", default=None, type=int,
+                     help="Interpolate the power law from a lookup table with this many samples per octave "
+                          "(implies --pulse_state)" )
+parser.add_argument( "-d", "--dtype", default="float64", choices=[ "float64", "float32" ],
+                     help="The precision of the memristor state and device parameters in the fused operators" )
+parser.add_argument( "-t", "--threads", default=1, type=int,
+                     help="The number of threads updating blocks of rows of the crossbar in the fused operators" )
+parser.add_argument( "--seed", default=0, type=int )
+args = parser.parse_args()
+if args.lut_size is not None:
+    args.pulse_state = True
+
+r_min = 200
+r_max = 2.3e8
+exponent = -0.146
+gain = 1e4
+noise = 0.15
+error_threshold = 1e-5
+
+
+def reference_step( local_error, pre_filtered, pos_memristors, neg_memristors, weights, r_min, r_max, exponent ):
+    """The original `SimmPES` update, kept as the baseline the fused kernel is measured against."""
+    
+    def resistance2conductance( R, r_min, r_max ):
+        g_min = 1.0 / r_max
+        g_max = 1.0 / r_min
+        g_curr = 1.0 / R
+        
+        g_norm = (g_curr - g_min) / (g_max - g_min)
+        
+        return g_norm * gain
+    
+    def find_spikes( input_activities, shape, invert=False ):
+        output_size = shape[ 0 ]
+        spiked_pre = np.tile(
+                np.array( np.rint( input_activities ), dtype=bool ), (output_size, 1)
+                )
+        out = np.logical_and( spiked_pre, np.ones( (1, shape[ 1 ]) ) )
+        return out if not invert else np.logical_not( out )
+    
+    if np.any( np.absolute( local_error ) > error_threshold ):
+        pes_delta = np.outer( -local_error, pre_filtered )
+        
+        spiked_map = find_spikes( pre_filtered, weights.shape, invert=True )
+        pes_delta[ spiked_map ] = 0
+        
+        V = np.sign( pes_delta ) * 1e-1
+        
+        pos_memristors[ V > 0 ] = np.where( pos_memristors[ V > 0 ] > r_max[ V > 0 ],
+                                            r_max[ V > 0 ],
+                                            pos_memristors[ V > 0 ] )
+        pos_memristors[ V > 0 ] = np.where( pos_memristors[ V > 0 ] < r_min[ V > 0 ],
+                                            r_min[ V > 0 ],
+                                            pos_memristors[ V > 0 ] )
+        neg_memristors[ V < 0 ] = np.where( neg_memristors[ V < 0 ] > r_max[ V < 0 ],
+                                            r_max[ V < 0 ],
+                                            neg_memristors[ V < 0 ] )
+        neg_memristors[ V < 0 ] = np.where( neg_memristors[ V < 0 ] < r_min[ V < 0 ],
+                                            r_min[ V < 0 ],
+                                            neg_memristors[ V < 0 ] )
+        
+        pos_n = np.power( (pos_memristors[ V > 0 ] - r_min[ V > 0 ]) / r_max[ V > 0 ],
+                          1 / exponent[ V > 0 ] )
+        pos_memristors[ V > 0 ] = r_min[ V > 0 ] + r_max[ V > 0 ] * np.power( pos_n + 1, exponent[ V > 0 ] )
+        
+        neg_n = np.power( (neg_memristors[ V < 0 ] - r_min[ V < 0 ]) / r_max[ V < 0 ], 1 / exponent[ V < 0 ] )
+        neg_memristors[ V < 0 ] = r_min[ V < 0 ] + r_max[ V < 0 ] * np.power( neg_n + 1, exponent[ V < 0 ] )
+        
+        weights[ V > 0 ] = resistance2conductance( pos_memristors[ V > 0 ], r_min[ V > 0 ], r_max[ V > 0 ] ) \
+                           - resistance2conductance( neg_memristors[ V > 0 ], r_min[ V > 0 ], r_max[ V > 0 ] )
+        weights[ V < 0 ] = resistance2conductance( pos_memristors[ V < 0 ], r_min[ V < 0 ], r_max[ V < 0 ] ) \
+                           - resistance2conductance( neg_memristors[ V < 0 ], r_min[ V < 0 ], r_max[ V < 0 ] )
+
+
+def make_inputs( rng, n_neurons, n_steps ):
+    errors = rng.normal( 0, 1, (n_steps, n_neurons) ) \
+             * (rng.uniform( 0, 1, (n_steps, n_neurons) ) >= args.converged)
+    # the reference gates the whole crossbar, the fused operators each row, so no error is left inside the deadzone
+    errors[ np.abs( errors ) <= error_threshold ] = 0
+    activities = rng.uniform( 0.5, 200, (n_steps, n_neurons) ) \
+                 * (rng.uniform( 0, 1, (n_steps, n_neurons) ) < args.active)
+    
+    return errors, activities
+
+
+print( f"Benchmarking mPES step for {args.steps} steps with {args.active * 100}% of pre neurons active"
+       + (f" and {args.converged * 100}% of post neurons converged" if args.converged > 0 else "")
+       + (" and pulse numbers as state" if args.pulse_state else "")
+       + (f" interpolated from a {args.lut_size} samples per octave table" if args.lut_size is not None else "")
+       + f", in {args.dtype}"
+       + (f" on {args.threads} threads" if args.threads > 1 else "") )
+print( "Neurons", "Reference (ms/step)", "Fused (ms/step)", "Speedup", "Sparse (ms/step)", "Speedup",
+       f"Gated {args.gated * 100:.0f}% (ms/step)", "Speedup over fused", "Max weight difference",
+       "Max relative resistance difference", sep="\t" )
+for n_neurons in args.neurons:
+    rng = np.random.RandomState( args.seed )
+    shape = (n_neurons, n_neurons)
+    r_min_noisy = rng.normal( r_min, r_min * noise, shape )
+    r_max_noisy = rng.normal( r_max, r_max * noise, shape )
+    exponent_noisy = rng.normal( exponent, np.abs( exponent ) * noise, shape )
+    pos_initial = rng.normal( 1e8, 1e8 * noise, shape )
+    neg_initial = rng.normal( 1e8, 1e8 * noise, shape )
+    errors, activities = make_inputs( rng, n_neurons, args.steps )
+    # the same inputs with the errors of a further fraction of the post neurons inside the deadzone
+    gated_errors = errors * (rng.uniform( 0, 1, errors.shape ) >= args.gated)
+    
+    # baseline
+    pos_ref, neg_ref, weights_ref = copy.deepcopy( pos_initial ), copy.deepcopy( neg_initial ), np.zeros( shape )
+    start_time = time.perf_counter()
+    for error, activity in zip( errors, activities ):
+        reference_step( error, activity, pos_ref, neg_ref, weights_ref, r_min_noisy, r_max_noisy, exponent_noisy )
+    reference_time = (time.perf_counter() - start_time) / args.steps
+    
+    # fused operator, updating either the whole crossbar or only the active columns
+    def run_operator( sparse, threads=args.threads, errors=errors ):
+        dtype = np.dtype( args.dtype )
+        r_min_op, r_max_op, exponent_op = [ x.astype( dtype ) for x in (r_min_noisy, r_max_noisy, exponent_noisy) ]
+        
+        pre_filtered = Signal( shape=(n_neurons,), name="pre_filtered" )
+        local_error = Signal( shape=(n_neurons,), name="local_error" )
+        pos_memristors = Signal( shape=shape, name="pos_memristors" )
+        neg_memristors = Signal( shape=shape, name="neg_memristors" )
+        weights = Signal( shape=shape, name="weights" )
+        signals = {
+                pre_filtered  : np.zeros( n_neurons ),
+                local_error   : np.zeros( n_neurons ),
+                pos_memristors: pos_initial.astype( dtype ),
+                neg_memristors: neg_initial.astype( dtype ),
+                weights       : np.zeros( shape )
+                }
+        pos_pulses = neg_pulses = None
+        if args.pulse_state:
+            pos_pulses = Signal( shape=shape, name="pos_pulses" )
+            neg_pulses = Signal( shape=shape, name="neg_pulses" )
+            signals[ pos_pulses ] = resistance2pulses( signals[ pos_memristors ], r_min_op, r_max_op, exponent_op )
+            signals[ neg_pulses ] = resistance2pulses( signals[ neg_memristors ], r_min_op, r_max_op, exponent_op )
+        table = None
+        if args.lut_size is not None:
+            initial_pulses = np.concatenate( [ signals[ pos_pulses ].ravel(), signals[ neg_pulses ].ravel() ] )
+            table = PowerLawTable( exponent_op, size=args.lut_size, max_pulses=max( 2**24, 2 * np.max(
+                    initial_pulses[ np.isfinite( initial_pulses ) ] ) ) )
+        op = SimmPES( pre_filtered, local_error, None, pos_memristors, neg_memristors, weights, noise, gain,
+                      r_min_op, r_max_op, exponent_op, sparse=sparse,
+                      pos_pulses=pos_pulses, neg_pulses=neg_pulses, table=table, threads=threads )
+        step = op.make_step( signals, 0.001, None )
+        start_time = time.perf_counter()
+        for error, activity in zip( errors, activities ):
+            signals[ local_error ][ ... ] = error
+            signals[ pre_filtered ][ ... ] = activity
+            step()
+        
+        return (time.perf_counter() - start_time) / args.steps, \
+               signals[ pos_memristors ], signals[ neg_memristors ], signals[ weights ]
+    
+    fused_time, pos_fused, neg_fused, weights_fused = run_operator( sparse=False )
+    sparse_time, pos_sparse, neg_sparse, weights_sparse = run_operator( sparse=True )
+    # the rows in the deadzone are masked out of the dense update, so it must not be slower than updating them all
+    gated_time, *_ = run_operator( sparse=False, errors=gated_errors )
+    if args.threads > 1:
+        # splitting the rows across threads must not change a single bit of the result
+        _, pos_single, neg_single, weights_single = run_operator( sparse=False, threads=1 )
+        assert np.array_equal( pos_fused, pos_single ) and np.array_equal( neg_fused, neg_single ) \
+               and np.array_equal( weights_fused, weights_single )
+    
+    # the lookup table is only accurate up to its error bound, and float32 resistances drift from the float64 ones
+    # at each step unless the pulse numbers are kept as state
+    rtol = 1e-3 if args.lut_size is not None or (args.dtype == "float32" and not args.pulse_state) else 1e-5
+    assert np.allclose( pos_fused, pos_ref, rtol=rtol ) and np.allclose( neg_fused, neg_ref, rtol=rtol )
+    assert np.allclose( pos_sparse, pos_fused ) and np.allclose( neg_sparse, neg_fused )
+    print( n_neurons,
+           f"{reference_time * 1e3:.3f}",
+           f"{fused_time * 1e3:.3f}",
+           f"{reference_time / fused_time:.2f}x",
+           f"{sparse_time * 1e3:.3f}",
+           f"{reference_time / sparse_time:.2f}x",
+           f"{gated_time * 1e3:.3f}",
+           f"{fused_time / gated_time:.2f}x",
+           np.max( np.abs( weights_fused - weights_ref ) ),
+           np.max( np.abs( pos_fused - pos_ref ) / pos_ref ),
+           sep="\t" )
@@ -0,0 +1,66 @@
+import argparse
+import time
+
+import nengo
+import numpy as np
+
+from memristor_nengo.extras import build_sine_network
+from memristor_nengo.learning_rules import SimmPES
+
+parser = argparse.ArgumentParser()
+parser.add_argument( "-k", "--update_every", nargs="*", default=[ 1, 2, 5, 10, 20, 50 ], type=int,
+                     help="The numbers of steps between device updates to benchmark.  Default is 1 2 5 10 20 50" )
+parser.add_argument( "-N", "--neurons", default=300, type=int,
+                     help="The number of neurons in the pre and post ensembles.  Default is 300" )
+parser.add_argument( "-T", "--sim_time", default=10, type=float,
+                     help="The simulation time in seconds.  Default is 10" )
+parser.add_argument( "-p", "--pulse_state", action="store_true",
+                     help="Keep the pulse number of each device as state" )
+parser.add_argument( "--seed", default=0, type=int )
+args = parser.parse_args()
+
+
+def run( update_every ):
+    model, probes = build_sine_network( args.neurons, seed=args.seed, probe_output=True,
+                                        pulse_state=args.pulse_state, update_every=update_every )
+    input_probe, post_probe = probes[ "input" ], probes[ "post" ]
+    with nengo.Simulator( model, progress_bar=False ) as sim:
+        # time the learning operator on its own, as well as the whole simulation
+        learning_time = [ 0.0 ]
+        
+        def timed( step ):
+            def timed_step():
+                start_time = time.perf_counter()
+                step()
+                learning_time[ 0 ] += time.perf_counter() - start_time
+            
+            return timed_step
+        
+        sim._steps = [ timed( step ) if isinstance( op, SimmPES ) else step
+                       for op, step in zip( sim._step_order, sim._steps ) ]
+        
+        start_time = time.perf_counter()
+        sim.run( args.sim_time )
+        total_time = time.perf_counter() - start_time
+    
+    # accuracy over the last fifth of the run, when learning has converged
+    test = sim.trange() > 0.8 * args.sim_time
+    mse = np.mean( (sim.data[ post_probe ][ test ] - sim.data[ input_probe ][ test ])**2 )
+    
+    return total_time / sim.n_steps, learning_time[ 0 ] / sim.n_steps, mse
+
+
+print( f"Benchmarking a {args.neurons} neurons mPES network learning for {args.sim_time} s with decimated device updates"
+       + (", with pulse numbers as state" if args.pulse_state else "") )
+print( "Update every", "Total (ms/step)", "mPES (ms/step)", "mPES speedup", "MSE", "MSE increase", sep="\t" )
+for update_every in args.update_every:
+    total_time, learning_time, mse = run( update_every )
+    if update_every == args.update_every[ 0 ]:
+        baseline_learning_time, baseline_mse = learning_time, mse
+    print( update_every,
+           f"{total_time * 1e3:.3f}",
+           f"{learning_time * 1e3:.3f}",
+           f"{baseline_learning_time / learning_time:.2f}x",
+           f"{mse:.5f}",
+           f"{mse / baseline_mse:.2f}x",
+           sep="\t" )
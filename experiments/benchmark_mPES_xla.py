@@ -0,0 +1,36 @@
+import argparse
+import re
+from subprocess import run
+
+parser = argparse.ArgumentParser()
+parser.add_argument( "-N", "--neurons", nargs="*", default=[ 100, 200, 500, 1000, 2000 ], type=int,
+                     help="The numbers of neurons in each ensemble.  Default is 100 200 500 1000 2000" )
+parser.add_argument( "-x", "--execution", nargs="*", default=[ "eager", "graph", "xla" ],
+                     choices=[ "eager", "graph", "xla" ],
+                     help="The TensorFlow execution modes to compare.  Default is eager graph xla" )
+parser.add_argument( "-S", "--simulation_time", default=5, type=int,
+                     help="The simulation time in seconds.  Default is 5" )
+parser.add_argument( "-d", "--device", default="/cpu:0" )
+parser.add_argument( "--seed", default=0, type=int )
+args = parser.parse_args()
+
+print( f"Benchmarking mPES.py on NengoDL ({args.device}) for {args.simulation_time} s of simulation" )
+print( "Neurons", *[ f"{execution} (steps/s)" for execution in args.execution ], "XLA speedup", sep="\t" )
+for neurons in args.neurons:
+    speeds = { }
+    for execution in args.execution:
+        result = run( [ "python", "mPES.py", "-b", "nengo_dl", "-x", execution, "-N", str( neurons ),
+                        "-S", str( args.simulation_time ), "-d", args.device, "-s", str( args.seed ) ],
+                      capture_output=True,
+                      universal_newlines=True )
+        # the speed includes building the graph, as it would be paid by each run of mPES.py
+        speed = re.search( r"Simulation speed: ([0-9.]+) steps/s", result.stdout )
+        if speed is None:
+            print( "Ret", result.returncode )
+            print( "Err", result.stderr )
+        speeds[ execution ] = float( speed.group( 1 ) ) if speed is not None else float( "nan" )
+    
+    print( neurons,
+           *[ f"{speeds[ execution ]:.1f}" for execution in args.execution ],
+           f"{speeds[ 'xla' ] / speeds[ 'graph' ]:.2f}x" if "xla" in speeds and "graph" in speeds else "-",
+           sep="\t" )
@@ -1,14 +1,8 @@
 import argparse
 import time
 
-import nengo_dl
-from nengo.learning_rules import PES
-from nengo.params import Default
-from nengo.processes import WhiteSignal
-from sklearn.metrics import mean_squared_error
-
+from memristor_nengo.experiment import MPESConfig, run_mpes
 from memristor_nengo.extras import *
-from memristor_nengo.learning_rules import mPES
 
 setup()
 
@@ -31,9 +25,28 @@ parser.add_argument( "-n", "--noise", nargs="*", default=[ 0.15 ], action="store
                      help="The noise on the simulated memristors [R_0, R_1, c, R_init]  Default is 0.15" )
 parser.add_argument( "-g", "--gain", default=1e4, type=float )  # default chosen by parameter search experiments
 parser.add_argument( "-l", "--learning_rule", default="mPES", choices=[ "mPES", "PES" ] )
-parser.add_argument( "-P", "--parameters", default=Default, type=float,
+parser.add_argument( "-P", "--parameters", default=None, type=float,
                      help="The parametrs of simualted memristors.  For now only the exponent c" )
 parser.add_argument( "-b", "--backend", default="nengo_core", choices=[ "nengo_dl", "nengo_core" ] )
+parser.add_argument( "-x", "--execution", default="graph", choices=[ "eager", "graph", "xla" ],
+                     help="How TensorFlow runs the NengoDL simulation (xla compiles the mPES step).  Default is graph" )
+parser.add_argument( "-u", "--unroll", default="1",
+                     help="The number of timesteps NengoDL unrolls in its graph, or auto to pick the fastest for this "
+                          "network and cache the choice in the plots directory.  Default is 1" )
+parser.add_argument( "--profile", nargs=2, default=None, type=int, metavar=("START", "STEPS"),
+                     help="Trace STEPS timesteps from timestep START with the TensorFlow profiler (NengoDL only) and "
+                          "save a summary of the time spent in each kind of operator" )
+parser.add_argument( "--device_cache", default=None,
+                     help="A directory where the memristor parameters drawn for a seed are saved and reused by the "
+                          "later runs with the same seed and parameters" )
+parser.add_argument( "--checkpoint", default=None,
+                     help="Save the memristors, weights and time of the simulation to this file at the end of the run" )
+parser.add_argument( "--checkpoint_every", default=None, type=float,
+                     help="Also save the checkpoint every this many seconds of simulated time" )
+parser.add_argument( "--resume", default=None,
+                     help="Resume the simulation from a checkpoint and run it up to the simulation time" )
+parser.add_argument( "--warm_start", default=None,
+                     help="Start the memristors and weights from those saved in a checkpoint, at time 0" )
 parser.add_argument( "-o", "--optimisations", default="run", choices=[ "run", "build", "memory" ] )
 parser.add_argument( "-s", "--seed", default=None, type=int )
 parser.add_argument( "--plot", default=0, choices=[ 0, 1, 2, 3 ], type=int,
@@ -50,62 +63,13 @@ parser.add_argument( '--probe', default=1, choices=[ 0, 1, 2 ], type=int,
 
 # TODO read parameters from conf file https://docs.python.org/3/library/configparser.html
 args = parser.parse_args()
-seed = args.seed
-tf.random.set_seed( seed )
-np.random.seed( seed )
-function_string = "lambda x: " + args.function
-function_to_learn = eval( function_string )
+
 if len( args.inputs ) not in (1, 2):
     parser.error( 'Either give no values for action, or two, not {}.'.format( len( args.inputs ) ) )
-if len( args.inputs ) == 1:
-    if args.inputs[ 0 ] == "sine":
-        input_function_train = input_function_test = Sines( period=4 )
-    if args.inputs[ 0 ] == "white":
-        input_function_train = input_function_test = WhiteSignal( period=60, high=5, seed=seed )
-if len( args.inputs ) == 2:
-    if args.inputs[ 0 ] == "sine":
-        input_function_train = Sines( period=4 )
-    if args.inputs[ 0 ] == "white":
-        input_function_train = WhiteSignal( period=60, high=5, seed=seed )
-    if args.inputs[ 1 ] == "sine":
-        input_function_test = Sines( period=4 )
-    if args.inputs[ 1 ] == "white":
-        input_function_test = WhiteSignal( period=60, high=5, seed=seed )
-timestep = args.timestep
-sim_time = args.simulation_time
 if len( args.neurons ) not in range( 1, 3 ):
     parser.error( 'Either give no values for action, or one, or three, not {}.'.format( len( args.neurons ) ) )
-if len( args.neurons ) == 1:
-    pre_n_neurons = post_n_neurons = error_n_neurons = args.neurons[ 0 ]
-if len( args.neurons ) == 2:
-    pre_n_neurons = error_n_neurons = args.neurons[ 0 ]
-    post_n_neurons = args.neurons[ 1 ]
-if len( args.neurons ) == 3:
-    pre_n_neurons = args.neurons[ 0 ]
-    post_n_neurons = args.neurons[ 1 ]
-    error_n_neurons = args.neurons[ 2 ]
-dimensions = args.dimensions
-noise_percent = args.noise
 if len( args.noise ) not in (1, 4):
     parser.error( 'Either give no values for action, or one, or four, not {}.'.format( len( args.noise ) ) )
-if len( args.noise ) == 1:
-    noise_percent = [ args.noise[ 0 ] ] * 4
-if len( args.noise ) == 4:
-    noise_percent = [ args.noise[ 0 ] ] + [ args.noise[ 1 ] ] + [ args.noise[ 2 ] ] + [ args.noise[ 3 ] ]
-gain = args.gain
-exponent = args.parameters
-learning_rule = args.learning_rule
-backend = args.backend
-optimisations = args.optimisations
-progress_bar = False
-printlv1 = printlv2 = lambda *a, **k: None
-if args.verbosity >= 1:
-    printlv1 = print
-if args.verbosity >= 2:
-    printlv2 = print
-    progress_bar = True
-plots_directory = args.plots_directory
-device = args.device
 probe = args.probe
 generate_plots = show_plots = save_plots = save_data = False
 if args.plot >= 1:
@@ -116,195 +80,131 @@ if args.plot >= 2:
     save_plots = True
 if args.plot >= 3:
     save_data = True
+printlv1 = printlv2 = lambda *a, **k: None
+if args.verbosity >= 1:
+    printlv1 = print
+if args.verbosity >= 2:
+    printlv2 = print
 
 # TODO give better names to folders or make hierarchy
-if save_plots or save_data:
-    dir_name, dir_images, dir_data = make_timestamped_dir( root=plots_directory + learning_rule + "/" )
-
-learn_time = int( sim_time * args.learn_time )
-n_neurons = np.amax( [ pre_n_neurons, post_n_neurons ] )
-if optimisations == "build":
-    optimize = False
-    sample_every = timestep
-    simulation_discretisation = 1
-elif optimisations == "run":
-    optimize = True
-    sample_every = timestep
-    simulation_discretisation = 1
-elif optimisations == "memory":
-    optimize = False
-    sample_every = timestep * 100
-    simulation_discretisation = n_neurons
-printlv2( f"Using {optimisations} optimisation" )
-
-model = nengo.Network( seed=seed )
-with model:
-    # Create an input node
-    input_node = nengo.Node(
-            output=SwitchInputs( input_function_train,
-                                 input_function_test,
-                                 switch_time=learn_time ),
-            size_out=dimensions
-            )
-    
-    # Shut off learning by inhibiting the error population
-    stop_learning = nengo.Node( output=lambda t: t >= learn_time )
-    
-    # Create the ensemble to represent the input, the learned output, and the error
-    pre = nengo.Ensemble( pre_n_neurons, dimensions=dimensions, seed=seed )
-    post = nengo.Ensemble( post_n_neurons, dimensions=dimensions, seed=seed )
-    error = nengo.Ensemble( error_n_neurons, dimensions=dimensions, radius=2, seed=seed )
-    
-    # Connect pre and post with a communication channel
-    # the matrix given to transform is the initial weights found in model.sig[conn]["weights"]
-    # the initial transform has not influence on learning because it is overwritten by mPES
-    # the only influence is on the very first timesteps, before the error becomes large enough
-    conn = nengo.Connection(
-            pre.neurons,
-            post.neurons,
-            transform=np.zeros( (post.n_neurons, pre.n_neurons) )
-            )
-    
-    # Apply the learning rule to conn
-    if learning_rule == "mPES":
-        conn.learning_rule_type = mPES(
-                noisy=noise_percent,
-                gain=gain,
-                seed=seed,
-                exponent=exponent )
-    if learning_rule == "PES":
-        conn.learning_rule_type = PES()
-    printlv2( "Simulating with", conn.learning_rule_type )
-    
-    # Provide an error signal to the learning rule
-    nengo.Connection( error, conn.learning_rule )
-    
-    # Compute the error signal (error = actual - target)
-    nengo.Connection( post, error )
-    
-    # Subtract the target (this would normally come from some external system)
-    nengo.Connection( pre, error, function=function_to_learn, transform=-1 )
-    
-    # Connect the input node to ensemble pre
-    nengo.Connection( input_node, pre )
-    
-    nengo.Connection(
-            stop_learning,
-            error.neurons,
-            transform=-20 * np.ones( (error.n_neurons, 1) ) )
-    
-    # essential ones are used to calculate the statistics
-    if probe > 0:
-        pre_probe = nengo.Probe( pre, synapse=0.01, sample_every=sample_every )
-        post_probe = nengo.Probe( post, synapse=0.01, sample_every=sample_every )
-    if probe > 1:
-        input_node_probe = nengo.Probe( input_node, sample_every=sample_every )
-        error_probe = nengo.Probe( error, synapse=0.01, sample_every=sample_every )
-        learn_probe = nengo.Probe( stop_learning, synapse=None, sample_every=sample_every )
-        weight_probe = nengo.Probe( conn, "weights", synapse=None, sample_every=sample_every )
-        post_spikes_probe = nengo.Probe( post.neurons, sample_every=sample_every )
-        if isinstance( conn.learning_rule_type, mPES ):
-            pos_memr_probe = nengo.Probe( conn.learning_rule, "pos_memristors", synapse=None,
-                                          sample_every=sample_every )
-            neg_memr_probe = nengo.Probe( conn.learning_rule, "neg_memristors", synapse=None,
-                                          sample_every=sample_every )
-
-# Create the Simulator and run it
-printlv2( f"Backend is {backend}, running on ", end="" )
-if backend == "nengo_core":
-    printlv2( "CPU" )
-    cm = nengo.Simulator( model, seed=seed, dt=timestep, optimize=optimize, progress_bar=progress_bar )
-if backend == "nengo_dl":
-    printlv2( device )
-    cm = nengo_dl.Simulator( model, seed=seed, dt=timestep, progress_bar=progress_bar, device=device )
-start_time = time.time()
-with cm as sim:
-    for i in range( simulation_discretisation ):
-        printlv2( f"\nRunning discretised step {i + 1} of {simulation_discretisation}" )
-        sim.run( sim_time / simulation_discretisation )
-printlv2( f"\nTotal time for simulation: {time.strftime( '%H:%M:%S', time.gmtime( time.time() - start_time ) )} s" )
+if save_plots or save_data or args.profile is not None:
+    dir_name, dir_images, dir_data = make_timestamped_dir( root=args.plots_directory + args.learning_rule + "/" )
+
+config = MPESConfig(
+        function=args.function,
+        inputs=tuple( args.inputs * 2 )[ :2 ],
+        timestep=args.timestep,
+        simulation_time=args.simulation_time,
+        # [pre, post, error], [pre and error, post] or the same for all
+        neurons=tuple( args.neurons if len( args.neurons ) == 3
+                       else [ args.neurons[ 0 ], args.neurons[ -1 ], args.neurons[ 0 ] ] ),
+        dimensions=args.dimensions,
+        noise=tuple( args.noise * 4 )[ :4 ],
+        gain=args.gain,
+        learning_rule=args.learning_rule,
+        exponent=args.parameters,
+        backend=args.backend,
+        execution=args.execution,
+        unroll=args.unroll,
+        unroll_cache=args.plots_directory + "unroll_cache.json",
+        profile=args.profile,
+        profile_directory=dir_name + "profile/" if args.profile is not None else None,
+        device_cache=args.device_cache,
+        checkpoint=args.checkpoint,
+        checkpoint_every=args.checkpoint_every,
+        resume=args.resume,
+        warm_start=args.warm_start,
+        optimisations=args.optimisations,
+        seed=args.seed,
+        device=args.device,
+        learn_time=args.learn_time,
+        probe=probe,
+        verbosity=args.verbosity )
+try:
+    config.validate()
+except ValueError as e:
+    parser.error( str( e ) )
+
+result = run_mpes( config )
+total_time = result.simulation_time
+printlv2( f"\nTotal time for simulation: {time.strftime( '%H:%M:%S', time.gmtime( total_time ) )} s" )
+printlv2( f"Simulation speed: {result.steps_per_second:.1f} steps/s" )
+
+if result.profile is not None:
+    total_profile_time = sum( result.profile.values() )
+    printlv2( f"Time spent in the TensorFlow ops of the {args.profile[ 1 ]} profiled steps:" )
+    for category in [ "mPES", "neurons", "synapses", "DotInc", "other" ]:
+        category_time = sum( t for b, t in result.profile.items() if profile_categories.get( b, "other" ) == category )
+        printlv2( f"{category}: {category_time * 1e3:.3f} ms ({category_time / total_profile_time * 100:.1f}%)" )
+    print( f"Saved profiler trace and summary in {dir_name}" )
 
 if probe > 0:
-    # essential statistics
-    y_true = sim.data[ pre_probe ][ int( (learn_time / timestep) / (sample_every / timestep) ):, ... ]
-    y_pred = sim.data[ post_probe ][ int( (learn_time / timestep) / (sample_every / timestep) ):, ... ]
-    # MSE after learning
     printlv2( "MSE after learning [f(pre) vs. post]:" )
-    mse = mean_squared_error( function_to_learn( y_true ), y_pred, multioutput='raw_values' )
-    printlv1( mse.tolist() )
-    # Correlation coefficients after learning
-    correlation_coefficients = correlations( function_to_learn( y_true ), y_pred )
+    printlv1( result.mse.tolist() )
     printlv2( "Pearson correlation after learning [f(pre) vs. post]:" )
-    printlv1( correlation_coefficients[ 0 ] )
+    printlv1( result.pearson )
     printlv2( "Spearman correlation after learning [f(pre) vs. post]:" )
-    printlv1( correlation_coefficients[ 1 ] )
+    printlv1( result.spearman )
     printlv2( "Kendall correlation after learning [f(pre) vs. post]:" )
-    printlv1( correlation_coefficients[ 2 ] )
+    printlv1( result.kendall )
     printlv2( "MSE-to-rho after learning [f(pre) vs. post]:" )
-    printlv1( mse_to_rho_ratio( mse, correlation_coefficients[ 1 ] ) )
+    printlv1( result.mse_to_rho )
 
 if probe > 1:
     # Average
     printlv2( "Weights average after learning:" )
-    printlv1( np.average( sim.data[ weight_probe ][ -1, ... ] ) )
+    printlv1( result.weights_average )
     
     # Sparsity
     printlv2( "Weights sparsity at t=0 and after learning:" )
-    printlv1( gini( sim.data[ weight_probe ][ 0 ] ), end=" -> " )
-    printlv1( gini( sim.data[ weight_probe ][ -1 ] ) )
+    printlv1( result.weights_sparsity[ 0 ], end=" -> " )
+    printlv1( result.weights_sparsity[ 1 ] )
 
+function_to_learn = eval( "lambda x: " + args.function )
+data = result.arrays
 plots = { }
 if generate_plots and probe > 1:
-    plotter = Plotter( sim.trange( sample_every=sample_every ), post_n_neurons, pre_n_neurons, dimensions,
-                       learn_time,
+    sample_every = config.timestep * 100 if config.optimisations == "memory" else config.timestep
+    plotter = Plotter( data[ "trange" ], config.neurons[ 1 ], config.neurons[ 0 ], config.dimensions,
+                       int( config.simulation_time * config.learn_time ),
                        sample_every,
                        plot_size=(13, 7),
                        dpi=300,
                        pre_alpha=0.3
                        )
-    plots[ "results_smooth" ] = plotter.plot_results( sim.data[ input_node_probe ], sim.data[ pre_probe ],
-                                                      sim.data[ post_probe ],
-                                                      error=
-                                                      sim.data[ post_probe ] -
-                                                      function_to_learn( sim.data[ pre_probe ] ),
+    plots[ "results_smooth" ] = plotter.plot_results( data[ "input" ], data[ "pre" ], data[ "post" ],
+                                                      error=data[ "post" ] - function_to_learn( data[ "pre" ] ),
                                                       smooth=True )
-    plots[ "results" ] = plotter.plot_results( sim.data[ input_node_probe ], sim.data[ pre_probe ],
-                                               sim.data[ post_probe ],
-                                               error=
-                                               sim.data[ post_probe ] -
-                                               function_to_learn( sim.data[ pre_probe ] ),
+    plots[ "results" ] = plotter.plot_results( data[ "input" ], data[ "pre" ], data[ "post" ],
+                                               error=data[ "post" ] - function_to_learn( data[ "pre" ] ),
                                                smooth=False )
-    plots[ "post_spikes" ] = plotter.plot_ensemble_spikes( "Post", sim.data[ post_spikes_probe ],
-                                                           sim.data[ post_probe ] )
-    plots[ "weights" ] = plotter.plot_weight_matrices_over_time( sim.data[ weight_probe ], sample_every=sample_every )
+    plots[ "post_spikes" ] = plotter.plot_ensemble_spikes( "Post", data[ "post_spikes" ], data[ "post" ] )
+    plots[ "weights" ] = plotter.plot_weight_matrices_over_time( data[ "weights" ], sample_every=sample_every )
     
-    plots[ "testing_smooth" ] = plotter.plot_testing( function_to_learn( sim.data[ pre_probe ] ),
-                                                      sim.data[ post_probe ],
+    plots[ "testing_smooth" ] = plotter.plot_testing( function_to_learn( data[ "pre" ] ), data[ "post" ],
                                                       smooth=True )
-    plots[ "testing" ] = plotter.plot_testing( function_to_learn( sim.data[ pre_probe ] ), sim.data[ post_probe ],
-                                               smooth=False )
-    if n_neurons <= 10 and learning_rule == "mPES":
-        plots[ "weights_mpes" ] = plotter.plot_weights_over_time( sim.data[ pos_memr_probe ],
-                                                                  sim.data[ neg_memr_probe ] )
-        plots[ "memristors" ] = plotter.plot_values_over_time( sim.data[ pos_memr_probe ], sim.data[ neg_memr_probe ],
+    plots[ "testing" ] = plotter.plot_testing( function_to_learn( data[ "pre" ] ), data[ "post" ], smooth=False )
+    if max( config.neurons[ :2 ] ) <= 10 and config.learning_rule == "mPES":
+        plots[ "weights_mpes" ] = plotter.plot_weights_over_time( data[ "pos_memristors" ], data[ "neg_memristors" ] )
+        plots[ "memristors" ] = plotter.plot_values_over_time( data[ "pos_memristors" ], data[ "neg_memristors" ],
                                                                value="resistance" )
 
 if save_plots:
     assert generate_plots and probe > 1
     
-    for fig in plots.values():
+    for i, fig in enumerate( plots.values() ):
         fig.savefig( dir_images + str( i ) + ".pdf" )
         # fig.savefig( dir_images + str( i ) + ".png" )
     
     print( f"Saved plots in {dir_images}" )
 
 if save_data:
-    save_weights( dir_data, sim.data[ weight_probe ] )
+    save_weights( dir_data, data[ "weights" ] )
     print( f"Saved NumPy weights in {dir_data}" )
     
-    save_results_to_csv( dir_data, sim.data[ input_node_probe ], sim.data[ pre_probe ], sim.data[ post_probe ],
-                         sim.data[ post_probe ] - function_to_learn( sim.data[ pre_probe ] ) )
-    save_memristors_to_csv( dir_data, sim.data[ pos_memr_probe ], sim.data[ neg_memr_probe ] )
+    save_results_to_csv( dir_data, data[ "input" ], data[ "pre" ], data[ "post" ],
+                         data[ "post" ] - function_to_learn( data[ "pre" ] ) )
+    save_memristors_to_csv( dir_data, data[ "pos_memristors" ], data[ "neg_memristors" ] )
     print( f"Saved data in {dir_data}" )
 
 #     TODO save output txt with metrics
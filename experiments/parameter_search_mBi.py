@@ -3,6 +3,7 @@ from functools import partial
 import os
 import xarray as xr
 from memristor_learning.Networks import *
+from memristor_nengo.store import ResultsStore, config_key
 
 # parameters to search
 start_a = -0.001
@@ -24,23 +25,34 @@ coords[ dims[ 1 ] ] = c_list
 
 data = [ ]
 results_dict = nested_dict( len( dims ), dict )
+# each run is saved as soon as it is over, so a search that was stopped can be started again from where it was
+store = ResultsStore( "../data/parameter_search/mBi/runs.jsonl" )
+print( "Runs already in the store:", len( store ) )
 
 start_time = time.time()
 curr_iteration = 0
 for i, a in enumerate( a_list ):
     data.append( [ ] )
     for j, c in enumerate( c_list ):
-        net = SupervisedLearning( memristor_controller=MemristorArray,
-                                  memristor_model=
-                                  partial( BidirectionalPowerlawMemristor, a=a, c=c, r_0=1e2, r_1=2.5e8 ),
-                                  seed=0,
-                                  neurons=4,
-                                  verbose=False,
-                                  generate_figures=False )
-        res = net()
-        print( res[ "mse" ] )
-        data[ i ].append( res[ "mse" ] )
-        results_dict[ a ][ c ] = res
+        run_config = dict( memristor_model="BidirectionalPowerlawMemristor", a=a, c=c, r_0=1e2, r_1=2.5e8, seed=0,
+                           neurons=4 )
+        key = config_key( run_config )
+        if store.completed( key ):
+            mse = store.get( key )[ "mse" ]
+        else:
+            net = SupervisedLearning( memristor_controller=MemristorArray,
+                                      memristor_model=
+                                      partial( BidirectionalPowerlawMemristor, a=a, c=c, r_0=1e2, r_1=2.5e8 ),
+                                      seed=0,
+                                      neurons=4,
+                                      verbose=False,
+                                      generate_figures=False )
+            res = net()
+            mse = res[ "mse" ]
+            store.add( key, { "config": run_config, "status": "ok", "mse": mse } )
+            results_dict[ a ][ c ] = res
+        print( mse )
+        data[ i ].append( mse )
         curr_iteration += 1
         print( f"{curr_iteration}/{total_iterations}: {a}, {c}\n" )
 
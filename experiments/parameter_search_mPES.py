@@ -1,18 +1,36 @@
 import argparse
-from subprocess import run
 
+from memristor_nengo.experiment import MPESConfig
 from memristor_nengo.extras import *
+from memristor_nengo.store import ResultsStore
+from memristor_nengo.sweep import run_sweep, save_records, sweep_seed
 
 parser = argparse.ArgumentParser()
-parser.add_argument( "-p", "--parameter", choices=[ "exponent", "noise", "neurons", "gain" ], required=True )
+parser.add_argument( "-p", "--parameter", choices=[ "exponent", "noise", "neurons", "gain" ], required=True,
+                     help="The parameter to search.  neurons searches the size of the post ensemble between pre and "
+                          "error ensembles of 100 neurons; before the runs were made in process, -N overrode these "
+                          "sizes and every point of the search ran the same network" )
 parser.add_argument( "-f", "--function", default="x" )
 parser.add_argument( "-D", "--dimensions", default=3, type=int )
-parser.add_argument( "-N", "--neurons", type=int, default=10 )
+parser.add_argument( "-N", "--neurons", type=int, default=10,
+                     help="The number of neurons in the pre, post and error ensembles, unused when searching the "
+                          "neurons or the gain.  Default is 10" )
 parser.add_argument( "-i", "--inputs", default=[ "sine", "sine" ], nargs="*", choices=[ "sine", "white" ] )
 parser.add_argument( "-l", "--limits", nargs=2, type=float, required=True )
 parser.add_argument( "-n", "--number", type=int )
 parser.add_argument( "-a", "--averaging", type=int, required=True )
 parser.add_argument( "-d", "--directory", default="../data/" )
+parser.add_argument( "-S", "--simulation_time", type=float, default=30 )
+parser.add_argument( "-w", "--workers", type=int,
+                     help="The number of runs at the same time.  Default is the number of CPUs" )
+parser.add_argument( "-t", "--timeout", type=float, help="The seconds after which a run is stopped" )
+parser.add_argument( "-r", "--retries", type=int, default=1,
+                     help="The number of times a failed run is started again.  Default is 1" )
+parser.add_argument( "-s", "--seed", type=int, default=0,
+                     help="The seed the seeds of the runs are derived from.  Default is 0" )
+parser.add_argument( "--store",
+                     help="The file where the runs are saved as they end, and where the completed ones are looked up "
+                          "to skip them.  Default is runs.jsonl next to the timestamped folders" )
 args = parser.parse_args()
 # parameters to search
 function = args.function
@@ -28,86 +46,75 @@ directory = args.directory
 
 dir_name, dir_images, dir_data = make_timestamped_dir( root=directory + "parameter_search/" + str( parameter ) + "/" )
 print( "Reserved folder", dir_name )
+# the store is shared by all the searches of the parameter, and its keys tell their runs apart
+store_path = args.store or directory + "parameter_search/" + str( parameter ) + "/runs.jsonl"
 
 res_list = np.linspace( start_par, end_par, num=num_par ) if args.parameter in [ "exponent", "noise", "neurons" ] \
     else np.logspace( np.rint( start_par ).astype( int ), np.rint( end_par ).astype( int ),
                       num=np.rint( num_par ).astype( int ) )
 num_parameters = len( res_list )
-print( "Evaluation for", parameter, "with", neurons, "neurons" )
+if parameter in [ "neurons", "gain" ]:
+    print( "Evaluation for", parameter )
+else:
+    print( "Evaluation for", parameter, "with", neurons, "neurons" )
 print( f"Search limits of parameters: [{start_par},{end_par}]" )
 print( "Number of parameters:", num_parameters )
 print( "Averaging per parameter", num_averaging )
 print( "Total iterations", num_parameters * num_averaging )
 
-mse_list = [ ]
-pearson_list = [ ]
-spearman_list = [ ]
-kendall_list = [ ]
-counter = 0
+configs = [ ]
 for k, par in enumerate( res_list ):
-    print( f"Parameter #{k} ({par})" )
-    it_res_mse = [ ]
-    it_res_pearson = [ ]
-    it_res_spearman = [ ]
-    it_res_kendall = [ ]
     for avg in range( num_averaging ):
-        counter += 1
-        print( f"[{counter}/{num_parameters * num_averaging}] Averaging #{avg + 1}" )
+        config = MPESConfig( function=function, inputs=tuple( inputs * 2 )[ :2 ], dimensions=dimensions,
+                             neurons=(neurons,) * 3, simulation_time=args.simulation_time,
+                             seed=sweep_seed( args.seed, k, avg ) )
         if parameter == "exponent":
-            result = run(
-                    [ "python", "mPES.py", "-v", "-P", str( par ), "-N", str( neurons ), "-f",
-                      str( function ), "-D", str( dimensions ) ]
-                    + [ "-i" ] + inputs,
-                    capture_output=True,
-                    universal_newlines=True )
+            config.exponent = par
         if parameter == "noise":
-            result = run(
-                    [ "python", "mPES.py", "-v", "-n", str( par ), "-N", str( neurons ), "-f", str( function ),
-                      "-D", str( dimensions ) ]
-                    + [ "-i" ] + inputs,
-                    capture_output=True,
-                    universal_newlines=True )
+            config.noise = (par,) * 4
         if parameter == "neurons":
-            rounded_neurons = str( np.rint( par ).astype( int ) )
-            result = run(
-                    [ "python", "mPES.py", "-v", "-N", str( 100 ), rounded_neurons, str( 100 ), "-N", str( neurons ),
-                      "-f", str( function ), "-D", str( dimensions ) ]
-                    + [ "-i" ] + inputs,
-                    capture_output=True,
-                    universal_newlines=True )
+            config.neurons = (100, int( np.rint( par ) ), 100)
         if parameter == "gain":
-            result = run(
-                    [ "python", "mPES.py", "-v", "-g", str( par ), "-f", str( function ), "-D", str( dimensions ) ]
-                    + [ "-i" ] + inputs,
-                    capture_output=True,
-                    universal_newlines=True )
-        # save statistics
-        try:
-            mse = np.mean( [ float( i ) for i in result.stdout.split( "\n" )[ 0 ][ 1:-1 ].split( "," ) ] )
-            print( "MSE", mse )
-            it_res_mse.append( mse )
-            pearson = np.mean( [ float( i ) for i in result.stdout.split( "\n" )[ 1 ][ 1:-1 ].split( "," ) ] )
-            print( "Pearson", pearson )
-            it_res_pearson.append( pearson )
-            spearman = np.mean( [ float( i ) for i in result.stdout.split( "\n" )[ 2 ][ 1:-1 ].split( "," ) ] )
-            print( "Spearman", spearman )
-            it_res_spearman.append( spearman )
-            kendall = np.mean( [ float( i ) for i in result.stdout.split( "\n" )[ 3 ][ 1:-1 ].split( "," ) ] )
-            print( "Kendall", kendall )
-            it_res_kendall.append( kendall )
-        except:
-            print( "Ret", result.returncode )
-            print( "Out", result.stdout )
-            print( "Err", result.stderr )
-    mse_list.append( it_res_mse )
-    pearson_list.append( it_res_pearson )
-    spearman_list.append( it_res_spearman )
-    kendall_list.append( it_res_kendall )
-
-mse_means = np.mean( mse_list, axis=1 )
-pearson_means = np.mean( pearson_list, axis=1 )
-spearman_means = np.mean( spearman_list, axis=1 )
-kendall_means = np.mean( kendall_list, axis=1 )
+            # the gain is searched with the default ensembles of mPES.py
+            config.gain = par
+            config.neurons = MPESConfig.neurons
+        configs.append( config )
+
+counter = 0
+
+
+def print_record( record ):
+    global counter
+    counter += 1
+    k, avg = divmod( record.index, num_averaging )
+    print( f"[{counter}/{len( configs )}] Parameter #{k} ({res_list[ k ]}) averaging #{avg + 1}: {record.status} "
+           + ("from the store" if record.stored
+              else f"after {record.attempts} attempt(s) in {record.elapsed:.1f} s") )
+    if record.status == "ok":
+        for name, value in record.summary().items():
+            print( name.capitalize() if name != "mse" else "MSE", value )
+    else:
+        print( record.error )
+
+
+store = ResultsStore( store_path )
+print( f"Saving the runs in {store_path}, which holds {len( store )} already" )
+records = run_sweep( configs, workers=args.workers, timeout=args.timeout, retries=args.retries,
+                     on_record=print_record, store=store )
+failed = [ record for record in records if record.status != "ok" ]
+if failed:
+    print( f"{len( failed )} of {len( records )} runs failed, so their parameters are averaged over fewer runs" )
+
+# the failed runs are NaN, which are left out of the averages
+summaries = [ record.summary() for record in records ]
+mse_list, pearson_list, spearman_list, kendall_list = [
+    np.reshape( [ summary[ name ] for summary in summaries ], (num_parameters, num_averaging) )
+    for name in ("mse", "pearson", "spearman", "kendall") ]
+
+mse_means = np.nanmean( mse_list, axis=1 )
+pearson_means = np.nanmean( pearson_list, axis=1 )
+spearman_means = np.nanmean( spearman_list, axis=1 )
+kendall_means = np.nanmean( kendall_list, axis=1 )
 print( "Average MSE for each parameter:", mse_means )
 print( "Average Pearson for each parameter:", pearson_means )
 print( "Average Spearman for each parameter:", spearman_means )
@@ -141,4 +148,7 @@ with open( dir_data + "parameters.txt", "w" ) as f:
     f.write( f"Limits: [{start_par},{end_par}]\n" )
     f.write( f"Number of searched parameters: {num_par}\n" )
     f.write( f"Number of runs for averaging: {num_averaging}\n" )
+    f.write( f"Seed: {args.seed}\n" )
+    f.write( f"Failed runs: {len( failed )}\n" )
+save_records( records, dir_data + "runs.csv" )
 print( f"Saved data in {dir_data}" )
@@ -0,0 +1,337 @@
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple, Union
+
+import nengo
+import numpy as np
+from nengo.learning_rules import PES
+from nengo.params import Default
+from nengo.processes import WhiteSignal
+
+from memristor_nengo.extras import Sines, SwitchInputs, correlations, gini, mse_to_rho_ratio, summarise_profile, \
+    tune_unroll
+from memristor_nengo.learning_rules import load_checkpoint, load_crossbar, mPES, save_checkpoint
+
+
+@dataclass
+class MPESConfig:
+    """The parameters of an experiment learning a function with `mPES`, as the options of ``experiments/mPES.py``.
+    
+    The function to learn is given as the body of a lambda of ``x``, so that the configuration can be pickled and sent
+    to other processes.
+    """
+    function: str = "x"
+    # the input signals while learning and while testing, either sine or white
+    inputs: Tuple[ str, str ] = ("sine", "sine")
+    timestep: float = 0.001
+    simulation_time: float = 30
+    # the neurons in the pre, post and error ensembles
+    neurons: Tuple[ int, int, int ] = (10, 10, 10)
+    dimensions: int = 3
+    # the noise on R_0, R_1, c and R_init of the simulated memristors
+    noise: Tuple[ float, float, float, float ] = (0.15, 0.15, 0.15, 0.15)
+    gain: float = 1e4
+    learning_rule: str = "mPES"
+    # the exponent c of the simulated memristors, otherwise the default one of `mPES`
+    exponent: Optional[ float ] = None
+    backend: str = "nengo_core"
+    execution: str = "graph"
+    # the timesteps NengoDL unrolls, or auto to pick the fastest and cache the choice in unroll_cache
+    unroll: Union[ int, str ] = 1
+    unroll_cache: Optional[ str ] = None
+    # trace (START, STEPS) timesteps with the TensorFlow profiler into profile_directory
+    profile: Optional[ Tuple[ int, int ] ] = None
+    profile_directory: Optional[ str ] = None
+    device_cache: Optional[ str ] = None
+    checkpoint: Optional[ str ] = None
+    checkpoint_every: Optional[ float ] = None
+    resume: Optional[ str ] = None
+    warm_start: Optional[ str ] = None
+    optimisations: str = "run"
+    seed: Optional[ int ] = None
+    device: str = "/cpu:0"
+    # the fraction of the simulation time spent learning
+    learn_time: float = 3 / 4
+    # 0: no probes, 1: only the probes of the statistics, 2: all the probes, whose data is kept in the result
+    probe: int = 1
+    # 0: no textual output, 2: progress of the simulation
+    verbosity: int = 0
+    
+    def validate( self ):
+        """Raise a `ValueError` if the options cannot be used together."""
+        if self.backend not in ("nengo_core", "nengo_dl"):
+            raise ValueError( f"Unknown backend {self.backend}" )
+        if self.learning_rule not in ("mPES", "PES"):
+            raise ValueError( f"Unknown learning rule {self.learning_rule}" )
+        if self.optimisations not in ("run", "build", "memory"):
+            raise ValueError( f"Unknown optimisations {self.optimisations}" )
+        if any( x not in ("sine", "white") for x in self.inputs ):
+            raise ValueError( f"The inputs must be sine or white, not {self.inputs}" )
+        if self.unroll != "auto" and not str( self.unroll ).isdigit():
+            raise ValueError( f"unroll must be a positive integer or auto, not {self.unroll}" )
+        if self.checkpoint_every is not None and self.checkpoint is None:
+            raise ValueError( "checkpoint_every needs a checkpoint file" )
+        if self.profile is not None and (self.checkpoint is not None or self.resume is not None):
+            raise ValueError( "Profiling cannot be combined with checkpoints" )
+        if self.profile is not None and (self.backend != "nengo_dl" or self.profile_directory is None):
+            raise ValueError( "Profiling is only supported by the nengo_dl backend and needs a profile_directory" )
+
+
+@dataclass
+class MPESResult:
+    """The outcome of `run_mpes`.
+    
+    The statistics compare the learned function and the output of the post ensemble after learning, with one value
+    per dimension; they are None without probes.
+    """
+    mse: Optional[ np.ndarray ] = None
+    pearson: Optional[ list ] = None
+    spearman: Optional[ list ] = None
+    kendall: Optional[ list ] = None
+    mse_to_rho: Optional[ np.ndarray ] = None
+    # the average and the sparsity, at t=0 and after learning, of the weights, with all the probes
+    weights_average: Optional[ float ] = None
+    weights_sparsity: Optional[ Tuple[ float, float ] ] = None
+    # the wall-clock time of the build and of the simulation, in seconds
+    build_time: float = 0.0
+    simulation_time: float = 0.0
+    n_steps: int = 0
+    steps_per_second: float = 0.0
+    # the seconds spent in the ops of each NengoDL operator builder while profiling, and in the other ops as "other"
+    profile: Optional[ Dict[ str, float ] ] = None
+    # the data of all the probes, from the step the simulation started or resumed from, and their times
+    arrays: Dict[ str, np.ndarray ] = field( default_factory=dict )
+
+
+def run_mpes( config ):
+    """Learn ``config.function`` with `mPES`, or `nengo.PES`, and measure how well it was learned.
+    
+    Parameters
+    ----------
+    config : `MPESConfig`
+        The parameters of the experiment.
+    
+    Returns
+    -------
+    result : `MPESResult`
+        The statistics after learning, the timings and, with ``config.probe == 2``, the data of the probes.
+    """
+    config.validate()
+    printlv2 = print if config.verbosity >= 2 else lambda *a, **k: None
+    progress_bar = config.verbosity >= 2
+    
+    seed = config.seed
+    np.random.seed( seed )
+    if config.backend == "nengo_dl":
+        # TensorFlow takes seconds to import, so the NengoDL runs are the only ones paying for it
+        import nengo_dl
+        import tensorflow as tf
+        
+        tf.random.set_seed( seed )
+        if config.execution == "eager":
+            tf.config.run_functions_eagerly( True )
+    
+    function_to_learn = eval( "lambda x: " + config.function )
+    input_function_train, input_function_test = [ Sines( period=4 ) if inputs == "sine"
+                                                  else WhiteSignal( period=60, high=5, seed=seed )
+                                                  for inputs in config.inputs ]
+    timestep = config.timestep
+    sim_time = config.simulation_time
+    pre_n_neurons, post_n_neurons, error_n_neurons = config.neurons
+    dimensions = config.dimensions
+    learn_time = int( sim_time * config.learn_time )
+    n_neurons = np.amax( [ pre_n_neurons, post_n_neurons ] )
+    probe = config.probe
+    if config.optimisations == "build":
+        optimize = False
+        sample_every = timestep
+        simulation_discretisation = 1
+    elif config.optimisations == "run":
+        optimize = True
+        sample_every = timestep
+        simulation_discretisation = 1
+    elif config.optimisations == "memory":
+        optimize = False
+        sample_every = timestep * 100
+        simulation_discretisation = n_neurons
+    printlv2( f"Using {config.optimisations} optimisation" )
+    
+    result = MPESResult()
+    start_time = time.time()
+    model = nengo.Network( seed=seed )
+    with model:
+        # Create an input node
+        input_node = nengo.Node(
+                output=SwitchInputs( input_function_train,
+                                     input_function_test,
+                                     switch_time=learn_time ),
+                size_out=dimensions
+                )
+        
+        # Shut off learning by inhibiting the error population
+        stop_learning = nengo.Node( output=lambda t: t >= learn_time )
+        
+        # Create the ensemble to represent the input, the learned output, and the error
+        pre = nengo.Ensemble( pre_n_neurons, dimensions=dimensions, seed=seed )
+        post = nengo.Ensemble( post_n_neurons, dimensions=dimensions, seed=seed )
+        error = nengo.Ensemble( error_n_neurons, dimensions=dimensions, radius=2, seed=seed )
+        
+        # Connect pre and post with a communication channel
+        # the matrix given to transform is the initial weights found in model.sig[conn]["weights"]
+        # the initial transform has not influence on learning because it is overwritten by mPES
+        # the only influence is on the very first timesteps, before the error becomes large enough
+        # a warm start continues from the saved weights instead
+        initial_crossbar = load_crossbar( config.warm_start ) if config.warm_start is not None else None
+        conn = nengo.Connection(
+                pre.neurons,
+                post.neurons,
+                transform=np.zeros( (post.n_neurons, pre.n_neurons) ) if initial_crossbar is None
+                else initial_crossbar[ "weights" ][ 0 ]
+                )
+        
+        # Apply the learning rule to conn
+        if config.learning_rule == "mPES":
+            conn.learning_rule_type = mPES(
+                    noisy=list( config.noise ),
+                    gain=config.gain,
+                    seed=seed,
+                    exponent=Default if config.exponent is None else config.exponent,
+                    jit_compile=config.execution == "xla",
+                    device_cache=config.device_cache,
+                    initial_state=initial_crossbar )
+        if config.learning_rule == "PES":
+            conn.learning_rule_type = PES()
+        printlv2( "Simulating with", conn.learning_rule_type )
+        
+        # Provide an error signal to the learning rule
+        nengo.Connection( error, conn.learning_rule )
+        
+        # Compute the error signal (error = actual - target)
+        nengo.Connection( post, error )
+        
+        # Subtract the target (this would normally come from some external system)
+        nengo.Connection( pre, error, function=function_to_learn, transform=-1 )
+        
+        # Connect the input node to ensemble pre
+        nengo.Connection( input_node, pre )
+        
+        nengo.Connection(
+                stop_learning,
+                error.neurons,
+                transform=-20 * np.ones( (error.n_neurons, 1) ) )
+        
+        # essential ones are used to calculate the statistics
+        probes = { }
+        if probe > 0:
+            probes[ "pre" ] = nengo.Probe( pre, synapse=0.01, sample_every=sample_every )
+            probes[ "post" ] = nengo.Probe( post, synapse=0.01, sample_every=sample_every )
+        if probe > 1:
+            probes[ "input" ] = nengo.Probe( input_node, sample_every=sample_every )
+            probes[ "error" ] = nengo.Probe( error, synapse=0.01, sample_every=sample_every )
+            probes[ "learn" ] = nengo.Probe( stop_learning, synapse=None, sample_every=sample_every )
+            probes[ "weights" ] = nengo.Probe( conn, "weights", synapse=None, sample_every=sample_every )
+            probes[ "post_spikes" ] = nengo.Probe( post.neurons, sample_every=sample_every )
+            if isinstance( conn.learning_rule_type, mPES ):
+                probes[ "pos_memristors" ] = nengo.Probe( conn.learning_rule, "pos_memristors", synapse=None,
+                                                          sample_every=sample_every )
+                probes[ "neg_memristors" ] = nengo.Probe( conn.learning_rule, "neg_memristors", synapse=None,
+                                                          sample_every=sample_every )
+    
+    # the simulation is run until each of these times, split at each checkpoint too, or in three parts around the window
+    # traced by the profiler
+    n_steps = int( round( sim_time / timestep ) )
+    if config.profile is not None:
+        profile_start, profile_steps = config.profile
+        profile_end = profile_start + profile_steps
+        run_steps = np.diff( [ 0, profile_start, profile_end, max( n_steps, profile_end ) ] )
+    else:
+        run_until = np.linspace( 0, sim_time, simulation_discretisation + 1 )[ 1: ]
+        if config.checkpoint_every is not None:
+            run_until = np.union1d( run_until, np.arange( config.checkpoint_every, sim_time,
+                                                          config.checkpoint_every ) )
+        run_steps = np.diff( np.round( np.concatenate( ([ 0 ], run_until) ) / timestep ).astype( int ) )
+    
+    # Create the Simulator and run it
+    printlv2( f"Backend is {config.backend}, running on ", end="" )
+    if config.backend == "nengo_core":
+        printlv2( "CPU" )
+        cm = nengo.Simulator( model, seed=seed, dt=timestep, optimize=optimize, progress_bar=progress_bar )
+    if config.backend == "nengo_dl":
+        printlv2( config.device, f"in {config.execution} mode" )
+        unroll = config.unroll
+        if unroll == "auto":
+            # the steps of each run have to be a multiple of the unrolled steps, so they all have to divide their
+            # greatest common divisor, and the graph is traced again for each of their lengths
+            unroll_steps = int( np.gcd.reduce( run_steps ) )
+            total_steps = int( np.sum( run_steps ) )
+            traces = len( np.unique( run_steps[ run_steps > 0 ] ) )
+            unroll, steps_per_second = tune_unroll(
+                    model,
+                    unroll_steps,
+                    total_steps=total_steps,
+                    traces=traces,
+                    cache=config.unroll_cache,
+                    key=f"{pre_n_neurons}_{post_n_neurons}_{error_n_neurons}_{dimensions}_{config.learning_rule}_"
+                        f"{config.backend}_{config.device}_{config.execution}_{unroll_steps}_"
+                        f"{total_steps}_{traces}",
+                    seed=seed, dt=timestep, device=config.device )
+            printlv2( f"Unrolling {unroll} timesteps, which ran at {steps_per_second:.1f} steps/s" )
+        cm = nengo_dl.Simulator( model, seed=seed, dt=timestep, progress_bar=progress_bar, device=config.device,
+                                 unroll_simulation=int( unroll ) )
+    result.build_time = time.time() - start_time
+    
+    start_time = time.time()
+    # the probes only hold the data of the steps run after resuming
+    first_step = 0
+    with cm as sim:
+        if config.profile is not None:
+            # only the window is traced, the steps before and after it are run as usual
+            if run_steps[ 0 ] > 0:
+                sim.run_steps( int( run_steps[ 0 ] ) )
+            tf.profiler.experimental.start( config.profile_directory )
+            sim.run_steps( int( run_steps[ 1 ] ) )
+            tf.profiler.experimental.stop()
+            if run_steps[ 2 ] > 0:
+                sim.run_steps( int( run_steps[ 2 ] ) )
+        else:
+            if config.resume is not None:
+                load_checkpoint( sim, config.resume )
+                first_step = sim.n_steps
+                printlv2( f"Resuming from {config.resume} at {sim.time:.3f} s" )
+            # the steps already run are skipped when resuming
+            for i, t in enumerate( run_until ):
+                if t - sim.time < timestep / 2:
+                    continue
+                printlv2( f"\nRunning discretised step {i + 1} of {len( run_until )}" )
+                sim.run( t - sim.time )
+                if config.checkpoint is not None:
+                    save_checkpoint( sim, config.checkpoint )
+                    printlv2( f"Saved checkpoint at {sim.time:.3f} s in {config.checkpoint}" )
+    result.simulation_time = time.time() - start_time
+    result.n_steps = sim.n_steps - first_step
+    result.steps_per_second = result.n_steps / result.simulation_time
+    first_sample = int( round( first_step * timestep / sample_every ) )
+    
+    if config.profile is not None:
+        result.profile = summarise_profile( config.profile_directory,
+                                            config.profile_directory.rstrip( "/" ) + "_summary.csv" )
+    
+    if probe > 0:
+        # essential statistics
+        learn_sample = max( 0, int( (learn_time / timestep) / (sample_every / timestep) ) - first_sample )
+        y_true = function_to_learn( sim.data[ probes[ "pre" ] ][ learn_sample:, ... ] )
+        y_pred = sim.data[ probes[ "post" ] ][ learn_sample:, ... ]
+        # MSE after learning
+        result.mse = np.mean( (y_true - y_pred)**2, axis=0 )
+        # Correlation coefficients after learning
+        result.pearson, result.spearman, result.kendall = correlations( y_true, y_pred )
+        result.mse_to_rho = mse_to_rho_ratio( result.mse, result.spearman )
+    
+    if probe > 1:
+        weights = sim.data[ probes[ "weights" ] ]
+        result.weights_average = np.average( weights[ -1, ... ] )
+        result.weights_sparsity = (gini( weights[ 0 ] ), gini( weights[ -1 ] ))
+        result.arrays = { name: sim.data[ p ] for name, p in probes.items() }
+        result.arrays[ "trange" ] = sim.trange( sample_every=sample_every )[ first_sample: ]
+    
+    return result
@@ -4,12 +4,14 @@ import os
 import matplotlib.pyplot as plt
 import nengo
 import numpy as np
-import tensorflow as tf
 from nengo.processes import Process
 from nengo.utils.matplotlib import rasterplot
 
+from memristor_nengo.learning_rules import mPES
+
 
 def setup():
+    import logging
     import sys
     
     os.environ[ "CUDA_DEVICE_ORDER" ] = "PCI_BUS_ID"
@@ -20,7 +22,8 @@ def setup():
     # for rosa
     sys.path.append( ".." )
     
-    tf.compat.v1.logging.set_verbosity( tf.compat.v1.logging.ERROR )
+    # the logger TensorFlow will use, so that it does not have to be imported when NengoDL is not
+    logging.getLogger( "tensorflow" ).setLevel( logging.ERROR )
 
 
 class Sines( Process ):
@@ -337,7 +340,7 @@ def mse_to_rho_ratio( mse, rho ):
 
 
 def correlations( X, Y ):
-    import scipy
+    import scipy.stats
     
     pearson_correlations = [ ]
     spearman_correlations = [ ]
@@ -414,3 +417,176 @@ def nested_dict( n, type ):
         return defaultdict( type )
     else:
         return defaultdict( lambda: nested_dict( n - 1, type ) )
+
+
+def build_sine_network( n_neurons, seed=None, weights_every=None, probe_output=False, transform=None, **mpes_params ):
+    """Learn the identity of a 2D sine wave on a neuron-to-neuron connection with `mPES`, as in ``mPES.py``.
+    
+    Parameters
+    ----------
+    n_neurons : int
+        The number of neurons in the pre, post and error ensembles.
+    seed : int, optional
+        The seed of the network and of the memristors.
+    weights_every : float, optional
+        Probe the weights of the learned connection every ``weights_every`` seconds.
+    probe_output : bool
+        Probe the input and the filtered output of the post ensemble.
+    transform : ndarray, optional
+        The initial weights of the learned connection, zero by default.
+    mpes_params
+        Passed to `mPES`, whose noise and gain are otherwise those of ``mPES.py``.
+    
+    Returns
+    -------
+    model : `nengo.Network`
+        The network.
+    probes : dict
+        Its ``weights``, ``input`` and ``post`` probes, when requested.
+    """
+    mpes_params = { "noisy": [ 0.15 ] * 4, "gain": 1e4, **mpes_params }
+    probes = { }
+    with nengo.Network( seed=seed ) as model:
+        input_node = nengo.Node( lambda t: [ np.sin( 2 * np.pi * t ), np.cos( 2 * np.pi * t ) ] )
+        pre = nengo.Ensemble( n_neurons, 2 )
+        post = nengo.Ensemble( n_neurons, 2 )
+        error = nengo.Ensemble( n_neurons, 2 )
+        nengo.Connection( input_node, pre )
+        conn = nengo.Connection( pre.neurons, post.neurons,
+                                 transform=np.zeros( (n_neurons, n_neurons) ) if transform is None else transform,
+                                 learning_rule_type=mPES( seed=seed, **mpes_params ) )
+        nengo.Connection( error, conn.learning_rule )
+        nengo.Connection( post, error )
+        nengo.Connection( pre, error, transform=-1 )
+        if weights_every is not None:
+            probes[ "weights" ] = nengo.Probe( conn, "weights", synapse=None, sample_every=weights_every )
+        if probe_output:
+            probes[ "input" ] = nengo.Probe( input_node )
+            probes[ "post" ] = nengo.Probe( post, synapse=0.01 )
+    
+    return model, probes
+
+
+def tune_unroll( model, n_steps, total_steps=None, traces=1, candidates=(1, 5, 10, 20, 50, 100), trial_steps=200,
+                 cache=None, key=None, **simulator_kwargs ):
+    """Find the ``unroll_simulation`` of NengoDL that runs ``model`` the fastest.
+    
+    Each candidate dividing ``n_steps``, the steps of every run of the simulator, is run twice for ``trial_steps``
+    steps: the first run also traces the graph, the second one times the steps alone.  NengoDL traces the graph again
+    for every new number of steps, which takes longer the more steps are unrolled, so with the ``total_steps`` to run
+    in ``traces`` different lengths the candidate taking the least time for all of them is chosen, otherwise the one
+    running the steps the fastest.  The choice is saved under ``key`` in the JSON file ``cache`` and read from it on
+    the next runs, unless it does not divide ``n_steps``.
+    
+    Returns
+    -------
+    unroll : int
+        The chosen number of steps unrolled in the graph.
+    steps_per_second : float
+        The speed of its steps, once the graph is traced.
+    """
+    import json
+    import tempfile
+    import time
+    
+    import nengo_dl
+    
+    if cache is not None and os.path.isfile( cache ):
+        with open( cache ) as f:
+            tuned = json.load( f )
+        # NengoDL would run extra steps with an unroll that doesn't divide those of each run
+        if key in tuned and n_steps % tuned[ key ][ "unroll" ] == 0:
+            return tuned[ key ][ "unroll" ], tuned[ key ][ "steps_per_second" ]
+    
+    trace_times, speeds = { }, { }
+    for unroll in [ c for c in candidates if n_steps % c == 0 ] or [ 1 ]:
+        with nengo_dl.Simulator( model, unroll_simulation=unroll, progress_bar=False, **simulator_kwargs ) as sim:
+            steps = unroll * max( 1, trial_steps // unroll )
+            start_time = time.perf_counter()
+            sim.run_steps( steps )
+            first_time = time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            sim.run_steps( steps )
+            speeds[ unroll ] = steps / (time.perf_counter() - start_time)
+            trace_times[ unroll ] = max( 0.0, first_time - steps / speeds[ unroll ] )
+    if total_steps is None:
+        unroll = max( speeds, key=speeds.get )
+    else:
+        unroll = min( speeds, key=lambda u: traces * trace_times[ u ] + total_steps / speeds[ u ] )
+    
+    if cache is not None:
+        tuned = { }
+        if os.path.isfile( cache ):
+            with open( cache ) as f:
+                tuned = json.load( f )
+        tuned[ key ] = { "unroll": unroll, "steps_per_second": speeds[ unroll ] }
+        cache_dir = os.path.dirname( os.path.abspath( cache ) )
+        os.makedirs( cache_dir, exist_ok=True )
+        # concurrent runs could be reading the cache, so it is only replaced once complete; a choice written by another
+        # run in the meantime can be lost, and is then tuned again
+        fd, temp_path = tempfile.mkstemp( dir=cache_dir, suffix=".json" )
+        with os.fdopen( fd, "w" ) as f:
+            json.dump( tuned, f, indent=4 )
+        os.replace( temp_path, cache )
+    
+    return unroll, speeds[ unroll ]
+
+
+# the NengoDL builders whose ops are of interest when profiling mPES, everything else is counted as other
+profile_categories = {
+        "SimmPESBuilder"       : "mPES",
+        "SimNeuronsBuilder"    : "neurons",
+        "SimProcessBuilder"    : "synapses",
+        "DotIncBuilder"        : "DotInc",
+        "SparseDotIncBuilder"  : "DotInc",
+        "ElementwiseIncBuilder": "DotInc",
+        }
+
+
+def summarise_profile( logdir, path=None ):
+    """Sum the time spent in the TensorFlow ops built by each NengoDL builder in the profiler traces in ``logdir``.
+    
+    NengoDL builds the ops of each group of operators inside a name scope named after its builder, so the time of
+    each op executed in the trace is attributed to the builder found in its name; the ops outside of any builder, such
+    as those of the while loop, of the probes and of the copies between steps, are counted as ``other``.  The ops are
+    the events TensorFlow tags with ``is_eager``.  The summary is also saved to the CSV file ``path``, if given, with
+    the fraction of the time of all the traced ops spent in each builder.
+    
+    Returns
+    -------
+    times : dict
+        Seconds spent in the ops of each builder, and in the other ops.
+    """
+    import glob
+    import re
+    from collections import defaultdict
+    
+    try:
+        from tensorflow.tsl.profiler.protobuf import xplane_pb2
+    except ImportError:
+        from tensorflow.core.profiler.protobuf import xplane_pb2
+    
+    times = defaultdict( float )
+    for trace in glob.glob( os.path.join( logdir, "**", "*.xplane.pb" ), recursive=True ):
+        space = xplane_pb2.XSpace()
+        with open( trace, "rb" ) as f:
+            space.ParseFromString( f.read() )
+        for plane in space.planes:
+            is_eager = [ i for i, stat in plane.stat_metadata.items() if stat.name == "is_eager" ]
+            for line in plane.lines:
+                for event in line.events:
+                    # the other events are the bookkeeping of the executors and of the Python client around the ops
+                    if not any( stat.metadata_id in is_eager for stat in event.stats ):
+                        continue
+                    # the scopes of the later groups built by a builder are numbered, as in DotIncBuilder_1
+                    builder = re.search( r"(\w+?Builder)(?:_\d+)?\b", plane.event_metadata[ event.metadata_id ].name )
+                    times[ builder.group( 1 ) if builder is not None else "other" ] += event.duration_ps * 1e-12
+    
+    if path is not None:
+        total = sum( times.values() )
+        with open( path, "w" ) as f:
+            f.write( "builder,category,seconds,fraction\n" )
+            for builder, seconds in sorted( times.items(), key=lambda x: -x[ 1 ] ):
+                f.write( f"{builder},{profile_categories.get( builder, 'other' )},{seconds},{seconds / total}\n" )
+    
+    return dict( times )
@@ -1,21 +1,57 @@
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
 import numpy as np
 
-from nengo.builder import Operator
+from nengo.builder import Builder, Operator, Signal
 from nengo.builder.learning_rules import build_or_passthrough, get_post_ens
+from nengo.builder.operator import Copy, DotInc, Reset
+from nengo.builder.optimizer import Merger, OpMerger, SigMerger
+from nengo.ensemble import Neurons
+from nengo.exceptions import ValidationError
 from nengo.learning_rules import LearningRuleType
-from nengo.params import Default, NumberParam
+from nengo.neurons import Izhikevich, LIF, SpikingRectifiedLinear
+from nengo.params import BoolParam, Default, EnumParam, IntParam, NumberParam, Parameter, StringParam
 from nengo.synapses import Lowpass, SynapseParam
 
+from memristor_nengo.lookup_tables import PowerLawTable
+
 
 class mPES( LearningRuleType ):
     modifies = "weights"
-    probeable = ("error", "activities", "delta", "pos_memristors", "neg_memristors")
+    probeable = ("error", "activities", "delta", "pos_memristors", "neg_memristors", "pos_pulses", "neg_pulses")
     
     pre_synapse = SynapseParam( "pre_synapse", default=Lowpass( tau=0.005 ), readonly=True )
     r_max = NumberParam( "r_max", readonly=True, default=2.3e8 )
     r_min = NumberParam( "r_min", readonly=True, default=200 )
     exponent = NumberParam( "exponent", readonly=True, default=-0.146 )
     gain = NumberParam( "gain", readonly=True, default=1e3 )
+    sparse = BoolParam( "sparse", readonly=True, default=False )
+    pulse_state = BoolParam( "pulse_state", readonly=True, default=False )
+    # a lookup table of the power law is only usable with pulse numbers as state, so it implies pulse_state
+    lut_size = IntParam( "lut_size", low=1, optional=True, readonly=True, default=None )
+    lut_buckets = IntParam( "lut_buckets", low=2, readonly=True, default=64 )
+    # float32 halves the memory of the memristor state and device parameters; it implies pulse_state as the rounding of
+    # the resistances would otherwise accumulate at every update (a relative 3e-5 from the float64 ones after 1000
+    # steps), while with the pulse numbers they stay within a relative 3e-7 after 100 steps and 1.5e-6 after 1000 on a
+    # 1000x1000 crossbar, as measured by experiments/benchmark_mPES_step.py --dtype float32 --pulse_state
+    dtype = EnumParam( "dtype", values=("float64", "float32"), readonly=True, default="float64" )
+    # the update of each device only depends on its own state, so blocks of rows can be updated by concurrent threads
+    threads = IntParam( "threads", low=1, readonly=True, default=1 )
+    # the pulses are counted at every step but only applied to the devices, and seen by the weights, every update_every
+    # steps, trading the accuracy of the learning for speed (see experiments/benchmark_mPES_update_every.py)
+    update_every = IntParam( "update_every", low=1, readonly=True, default=1 )
+    # on NengoDL the update is compiled by XLA into a single kernel (see experiments/benchmark_mPES_xla.py); the NumPy
+    # operator ignores it
+    jit_compile = BoolParam( "jit_compile", readonly=True, default=False )
+    # the devices drawn for a seed are saved in this directory and memory-mapped by the later builds, see
+    # `cached_draw_devices`
+    device_cache = StringParam( "device_cache", optional=True, readonly=True, default=None )
+    # the memristors start from a crossbar saved by `save_checkpoint`, as returned by `load_crossbar`, instead of their
+    # drawn resistances; Nengo does not let the learning rule set the initial weights, so the transform of the
+    # connection has to be the saved weights
+    initial_state = Parameter( "initial_state", optional=True, readonly=True, default=None )
     
     def __init__( self,
                   pre_synapse=Default,
@@ -24,7 +60,17 @@ class mPES( LearningRuleType ):
                   exponent=Default,
                   noisy=False,
                   gain=Default,
-                  seed=None ):
+                  seed=None,
+                  sparse=Default,
+                  pulse_state=Default,
+                  lut_size=Default,
+                  lut_buckets=Default,
+                  dtype=Default,
+                  threads=Default,
+                  update_every=Default,
+                  jit_compile=Default,
+                  device_cache=Default,
+                  initial_state=Default ):
         super().__init__( size_in="post_state" )
         
         self.pre_synapse = pre_synapse
@@ -34,6 +80,16 @@ class mPES( LearningRuleType ):
         self.noise_percentage = 0 if not noisy else noisy
         self.gain = gain
         self.seed = seed
+        self.sparse = sparse
+        self.pulse_state = pulse_state
+        self.lut_size = lut_size
+        self.lut_buckets = lut_buckets
+        self.dtype = dtype
+        self.threads = threads
+        self.update_every = update_every
+        self.jit_compile = jit_compile
+        self.device_cache = device_cache
+        self.initial_state = initial_state
     
     @property
     def _argdefaults( self ):
@@ -46,6 +102,16 @@ class mPES( LearningRuleType ):
                 )
 
 
+class EventmPES( mPES ):
+    """`mPES` pulsing the devices of a pre neuron only on the timesteps when it spikes.
+    
+    `mPES` lets the devices of a pre neuron learn whenever its filtered activity rounds to non-zero, which includes the
+    steps between its spikes; this variant reads the spikes of the pre neurons instead and only updates the columns of
+    the ones that spiked, so the cost of learning is proportional to their firing rate.  The filtered activities are
+    still computed, for the sign of the update and for the ``activities`` probe.
+    """
+
+
 class SimmPES( Operator ):
     def __init__(
             self,
@@ -60,6 +126,19 @@ class SimmPES( Operator ):
             r_min,
             r_max,
             exponent,
+            sparse=False,
+            pos_pulses=None,
+            neg_pulses=None,
+            table=None,
+            blocks=None,
+            threads=1,
+            update_every=1,
+            jit_compile=False,
+            realise=None,
+            step=None,
+            pos_count=None,
+            neg_count=None,
+            pre_spikes=None,
             states=None,
             tag=None
             ):
@@ -72,11 +151,29 @@ class SimmPES( Operator ):
         self.r_min = r_min
         self.r_max = r_max
         self.exponent = exponent
+        self.sparse = sparse
+        self.table = table
+        # the number of post neurons of each of the operators merged into this one, whose pre activities are stacked
+        self.blocks = (weights.shape[ 0 ],) if blocks is None else tuple( blocks )
+        self.threads = threads
+        # with update_every > 1 the pulses are counted at every step and only applied to the devices every
+        # update_every steps of the simulation
+        self.update_every = update_every
+        self.jit_compile = jit_compile
+        # draws the devices of another NengoDL minibatch element, so that each element simulates its own crossbar
+        self.realise = realise
+        self.has_step = step is not None
+        self.has_pulses = pos_pulses is not None
+        # with the spikes of the pre neurons only the columns of the ones that spiked are updated, as when sparse
+        self.event_driven = pre_spikes is not None
         
         self.sets = [ ] + ([ ] if states is None else [ states ])
         self.incs = [ ]
-        self.reads = [ pre_filtered, error ]
-        self.updates = [ weights, pos_memristors, neg_memristors ]
+        self.reads = [ pre_filtered, error ] + ([ pre_spikes ] if self.event_driven else [ ]) \
+                     + ([ step ] if self.has_step else [ ])
+        self.updates = [ weights, pos_memristors, neg_memristors ] \
+                       + ([ pos_pulses, neg_pulses ] if self.has_pulses else [ ]) \
+                       + ([ pos_count, neg_count ] if update_every > 1 else [ ])
     
     @property
     def pre_filtered( self ):
@@ -98,115 +195,501 @@ class SimmPES( Operator ):
     def neg_memristors( self ):
         return self.updates[ 2 ]
     
+    @property
+    def pre_spikes( self ):
+        return self.reads[ 2 ] if self.event_driven else None
+    
+    @property
+    def step( self ):
+        return self.reads[ -1 ] if self.has_step else None
+    
+    @property
+    def pos_pulses( self ):
+        return self.updates[ 3 ] if self.has_pulses else None
+    
+    @property
+    def neg_pulses( self ):
+        return self.updates[ 4 ] if self.has_pulses else None
+    
+    @property
+    def pos_count( self ):
+        return self.updates[ -2 ] if self.update_every > 1 else None
+    
+    @property
+    def neg_count( self ):
+        return self.updates[ -1 ] if self.update_every > 1 else None
+    
     def _descstr( self ):
         return "pre=%s, error=%s -> %s" % (self.pre_filtered, self.error, self.weights)
     
     def make_step( self, signals, dt, rng ):
         pre_filtered = signals[ self.pre_filtered ]
         local_error = signals[ self.error ]
+        event_driven = self.event_driven
+        pre_spikes = signals[ self.pre_spikes ] if event_driven else None
         
         pos_memristors = signals[ self.pos_memristors ]
         neg_memristors = signals[ self.neg_memristors ]
         weights = signals[ self.weights ]
+        # with pulse numbers as state the resistances are only derived from them when the weights need updating
+        pulse_state = self.pos_pulses is not None
+        pos_pulses = signals[ self.pos_pulses ] if pulse_state else None
+        neg_pulses = signals[ self.neg_pulses ] if pulse_state else None
+        update_every = self.update_every
+        step = signals[ self.step ] if update_every > 1 else None
+        pos_count = signals[ self.pos_count ] if update_every > 1 else None
+        neg_count = signals[ self.neg_count ] if update_every > 1 else None
         
-        gain = self.gain
         error_threshold = self.error_threshold
         r_min = self.r_min
         r_max = self.r_max
         exponent = self.exponent
+        table = self.table
+        table_position = table.position if table is not None else None
+        
+        # the device parameters never change during a simulation so the derived per-device constants are computed
+        # only once, here, instead of at every timestep
+        inv_exponent = 1.0 / exponent
+        g_min = 1.0 / r_max
+        g_max = 1.0 / r_min
+        g_scale = self.gain / (g_max - g_min)
+        
+        # buffers are allocated once and reused by every step so that the update does not create any temporaries
+        # they are flat so that the update can take views of the size of the learning rows and active columns
+        def buffer( dtype ):
+            return np.empty( weights.size, dtype=dtype )
+        
+        pes_delta = buffer( local_error.dtype )
+        pos_mask = buffer( bool )
+        neg_mask = buffer( bool )
+        update_mask = buffer( bool )
+        pos_buffer = buffer( pos_memristors.dtype )
+        neg_buffer = buffer( neg_memristors.dtype )
+        
+        def apply( pos_memristors, neg_memristors, weights, pos_pulses, neg_pulses, pos_n, neg_n,
+                   r_min, r_max, exponent, inv_exponent, g_scale, table_position, view ):
+            pos = view( pos_mask )
+            neg = view( neg_mask )
+            changed = view( update_mask )
+            
+            # update the two memristor pairs separately
+            if pulse_state:
+                apply_pulses( pos_pulses, pos_memristors, pos, view( pos_buffer ), r_min, r_max, exponent,
+                              table, table_position, pos_n )
+                apply_pulses( neg_pulses, neg_memristors, neg, view( neg_buffer ), r_min, r_max, exponent,
+                              table, table_position, neg_n )
+            else:
+                update_memristors( pos_memristors, pos, view( pos_buffer ), r_min, r_max, exponent, inv_exponent,
+                                   pos_n )
+                update_memristors( neg_memristors, neg, view( neg_buffer ), r_min, r_max, exponent, inv_exponent,
+                                   neg_n )
+            
+            # update network weights
+            update_weights( weights, pos_memristors, neg_memristors, changed, view( pos_buffer ),
+                            view( neg_buffer ), g_scale )
+        
+        def update( pos_memristors, neg_memristors, weights, pos_pulses, neg_pulses, pos_count, neg_count,
+                    pes_delta, spiked_pre, r_min, r_max, exponent, inv_exponent, g_scale, table_position, view ):
+            pos = view( pos_mask )
+            neg = view( neg_mask )
+            changed = view( update_mask )
+            
+            # the update direction is computed only once and shared by all the following passes
+            np.greater( pes_delta, 0, out=pos )
+            np.logical_and( pos, spiked_pre, out=pos )
+            np.less( pes_delta, 0, out=neg )
+            np.logical_and( neg, spiked_pre, out=neg )
+            
+            if update_every > 1:
+                # the pulses are only counted here, and flush applies them all at once
+                np.add( pos_count, pos, out=pos_count )
+                np.add( neg_count, neg, out=neg_count )
+            else:
+                np.logical_or( pos, neg, out=changed )
+                apply( pos_memristors, neg_memristors, weights, pos_pulses, neg_pulses, 1, 1,
+                       r_min, r_max, exponent, inv_exponent, g_scale, table_position, view )
+        
+        def flush( pos_memristors, neg_memristors, weights, pos_pulses, neg_pulses, pos_count, neg_count,
+                   r_min, r_max, exponent, inv_exponent, g_scale, table_position, view ):
+            pos = view( pos_mask )
+            neg = view( neg_mask )
+            changed = view( update_mask )
+            
+            # n pulses in a row take the pulse number from n_0 to n_0 + n, so they are applied in closed form
+            np.greater( pos_count, 0, out=pos )
+            np.greater( neg_count, 0, out=neg )
+            np.logical_or( pos, neg, out=changed )
+            apply( pos_memristors, neg_memristors, weights, pos_pulses, neg_pulses, pos_count, neg_count,
+                   r_min, r_max, exponent, inv_exponent, g_scale, table_position, view )
+            pos_count.fill( 0 )
+            neg_count.fill( 0 )
+        
+        if self.threads > 1:
+            update = shard_rows( update, self.threads )
+            flush = shard_rows( flush, self.threads )
+        
+        def flush_every():
+            if step % update_every == 0:
+                flush( pos_memristors, neg_memristors, weights, pos_pulses, neg_pulses, pos_count, neg_count,
+                       r_min, r_max, exponent, inv_exponent, g_scale, table_position,
+                       lambda b: b.reshape( weights.shape ) )
+        
+        # merged operators stack the pre activities of their blocks, so every row gets the ones of its own block
+        n_rows, n_columns = weights.shape
+        merged = len( self.blocks ) > 1
+        pre_blocks = pre_filtered.reshape( (len( self.blocks ), -1) )
+        row_block = np.repeat( np.arange( len( self.blocks ) ), self.blocks )
+        
+        # gathered copies of the learning rows and active columns of the state and of the device parameters
+        state = [ pos_memristors, neg_memristors, weights, pos_pulses, neg_pulses, pos_count, neg_count ]
+        parameters = [ r_min, r_max, exponent, inv_exponent, g_scale, table_position ]
+        active_state = [ buffer( x.dtype ) if x is not None else None for x in state ]
+        active_parameters = [ buffer( x.dtype ) if x is not None else None for x in parameters ]
+        absolute_error = np.empty_like( local_error )
+        gated_error = np.empty_like( local_error )
+        learning = np.empty( local_error.shape, dtype=bool )
+        all_rows = np.arange( n_rows )
+        spiked_rows = buffer( bool ) if merged else None
         
         def step_simmpes():
-            def resistance2conductance( R, r_min, r_max ):
-                g_min = 1.0 / r_max
-                g_max = 1.0 / r_min
-                g_curr = 1.0 / R
-                
-                g_norm = (g_curr - g_min) / (g_max - g_min)
-                
-                return g_norm * gain
+            # post neurons whose error is inside the deadzone don't learn, so their rows are left out of the update
+            np.absolute( local_error, out=absolute_error )
+            np.greater( absolute_error, error_threshold, out=learning )
+            rows = np.flatnonzero( learning )
             
-            def find_spikes( input_activities, shape, output_activities=None, invert=False ):
-                output_size = shape[ 0 ]
-                input_size = shape[ 1 ]
-                spiked_pre = np.tile(
-                        np.array( np.rint( input_activities ), dtype=bool ), (output_size, 1)
-                        )
-                spiked_post = np.tile(
-                        np.expand_dims(
-                                np.array( np.rint( output_activities ), dtype=bool ), axis=1 ), (1, input_size)
-                        ) \
-                    if output_activities is not None \
-                    else np.ones( (1, input_size) )
-                
-                out = np.logical_and( spiked_pre, spiked_post )
-                return out if not invert else np.logical_not( out )
+            # only the columns whose filtered pre activity rounds to non-zero can change, so the sparse update is
+            # restricted to them and scales with post x active pre instead of with post x pre
+            if event_driven:
+                columns = np.flatnonzero( pre_spikes )
+            elif self.sparse:
+                columns = np.flatnonzero( np.rint( pre_filtered ) )
+            else:
+                columns = None
             
-            # set update to zero if error is small or adjustments go on for ever
-            # if error is small return zero delta
-            if np.any( np.absolute( local_error ) > error_threshold ):
+            if rows.size > 0 and (columns is None or columns.size > 0):
+                if columns is None:
+                    # the dense update works on the crossbar in place, the rows in the deadzone getting a zero error so
+                    # that the masks leave all their devices untouched; gathering and scattering the learning rows
+                    # would cost more passes over the crossbar than the gated rows save
+                    view = lambda b: b.reshape( weights.shape )
+                    state_active = state
+                    parameters_active = parameters
+                    if rows.size == n_rows:
+                        error_active = local_error
+                    else:
+                        error_active = np.multiply( local_error, learning, out=gated_error )
+                    rows = all_rows
+                else:
+                    indices = rows[ :, np.newaxis ] * n_columns + columns
+                    view = lambda b: b[ :indices.size ].reshape( indices.shape )
+                    state_active = [ np.take( x, indices, out=view( b ) ) if x is not None else None
+                                     for x, b in zip( state, active_state ) ]
+                    parameters_active = [ np.take( x, indices, out=view( b ) ) if x is not None else None
+                                          for x, b in zip( parameters, active_parameters ) ]
+                    error_active = local_error[ rows ]
+                
                 # calculate the magnitude of the update based on PES learning rule
                 # local_error = -np.dot( encoders, error )
                 # I can use NengoDL build function like this, as dot(encoders, error) has been done there already
                 # i.e., error already contains the PES local error
-                pes_delta = np.outer( -local_error, pre_filtered )
-                
-                # some memristors are adjusted erroneously if we don't filter
-                spiked_map = find_spikes( pre_filtered, weights.shape, invert=True )
-                pes_delta[ spiked_map ] = 0
-                
-                # set update direction and magnitude (unused with powerlaw memristor equations)
-                V = np.sign( pes_delta ) * 1e-1
-                
-                # clip values outside [R_0,R_1]
-                pos_memristors[ V > 0 ] = np.where( pos_memristors[ V > 0 ] > r_max[ V > 0 ],
-                                                    r_max[ V > 0 ],
-                                                    pos_memristors[ V > 0 ] )
-                pos_memristors[ V > 0 ] = np.where( pos_memristors[ V > 0 ] < r_min[ V > 0 ],
-                                                    r_min[ V > 0 ],
-                                                    pos_memristors[ V > 0 ] )
-                neg_memristors[ V < 0 ] = np.where( neg_memristors[ V < 0 ] > r_max[ V < 0 ],
-                                                    r_max[ V < 0 ],
-                                                    neg_memristors[ V < 0 ] )
-                neg_memristors[ V < 0 ] = np.where( neg_memristors[ V < 0 ] < r_min[ V < 0 ],
-                                                    r_min[ V < 0 ],
-                                                    neg_memristors[ V < 0 ] )
-                
-                # update the two memristor pairs separately
-                pos_n = np.power( (pos_memristors[ V > 0 ] - r_min[ V > 0 ]) / r_max[ V > 0 ],
-                                  1 / exponent[ V > 0 ] )
-                pos_memristors[ V > 0 ] = r_min[ V > 0 ] + r_max[ V > 0 ] * np.power( pos_n + 1, exponent[ V > 0 ] )
+                if merged:
+                    np.take( pre_blocks, row_block[ rows ], axis=0, out=view( pes_delta ) )
+                    np.multiply( view( pes_delta ), -error_active[ :, np.newaxis ], out=view( pes_delta ) )
+                    spiked_pre = view( spiked_rows )
+                    np.take( np.rint( pre_blocks ).astype( bool ), row_block[ rows ], axis=0, out=spiked_pre )
+                elif columns is None:
+                    np.outer( -error_active, pre_filtered, out=view( pes_delta ) )
+                    # some memristors are adjusted erroneously if we don't filter
+                    spiked_pre = np.rint( pre_filtered ).astype( bool )
+                else:
+                    np.outer( -error_active, pre_filtered[ columns ], out=view( pes_delta ) )
+                    spiked_pre = True
                 
-                neg_n = np.power( (neg_memristors[ V < 0 ] - r_min[ V < 0 ]) / r_max[ V < 0 ], 1 / exponent[ V < 0 ] )
-                neg_memristors[ V < 0 ] = r_min[ V < 0 ] + r_max[ V < 0 ] * np.power( neg_n + 1, exponent[ V < 0 ] )
+                update( *state_active, view( pes_delta ), spiked_pre, *parameters_active, view )
                 
-                # update network weights
-                weights[ V > 0 ] = resistance2conductance( pos_memristors[ V > 0 ], r_min[ V > 0 ],
-                                                           r_max[ V > 0 ] ) \
-                                   - resistance2conductance( neg_memristors[ V > 0 ], r_min[ V > 0 ],
-                                                             r_max[ V > 0 ] )
-                weights[ V < 0 ] = resistance2conductance( pos_memristors[ V < 0 ], r_min[ V < 0 ],
-                                                           r_max[ V < 0 ] ) \
-                                   - resistance2conductance( neg_memristors[ V < 0 ], r_min[ V < 0 ],
-                                                             r_max[ V < 0 ] )
+                if state_active is not state:
+                    for x, x_active in zip( state, state_active ):
+                        if x is not None:
+                            np.put( x, indices, x_active )
+            
+            if update_every > 1:
+                flush_every()
         
         return step_simmpes
 
 
-################ NENGO DL #####################
+@OpMerger.register( SimmPES )
+class SimmPESMerger( Merger ):
+    """Merge `SimmPES` operators with the same number of pre neurons into a single one over stacked state.
+    
+    Operators using a lookup table are never merged, as a table shared by all the devices would span a wider range of
+    exponents and be less accurate than the ones it replaces.  Sparse and event-driven operators are not merged either,
+    as the union of the active columns of all the blocks would be updated and lose most of the benefit of their
+    sparsity.
+    """
+    
+    @staticmethod
+    def check_signals( op, tomerge ):
+        # the step counter is read by all the operators
+        return len( tomerge.all_signals.intersection( op.all_signals ) - { op.step } ) == 0
+    
+    @staticmethod
+    def is_mergeable( op1, op2 ):
+        return op1.weights.shape[ 1 ] == op2.weights.shape[ 1 ] \
+               and op1.gain == op2.gain \
+               and op1.threads == op2.threads \
+               and op1.update_every == op2.update_every \
+               and op1.jit_compile == op2.jit_compile \
+               and not op1.sparse and not op2.sparse \
+               and not op1.event_driven and not op2.event_driven \
+               and op1.table is None and op2.table is None \
+               and op1.has_pulses == op2.has_pulses \
+               and all( SigMerger.check( s ) for s in zip( op1.all_signals, op2.all_signals )
+                        if s[ 0 ] is not op1.step )
+    
+    @staticmethod
+    def merge( ops ):
+        def gather( ops, key ):
+            return [ getattr( o, key ) for o in ops ]
+        
+        signals = { }
+        replacements = [ ]
+        for key in [ "pre_filtered", "error", "pos_memristors", "neg_memristors", "weights" ] \
+                   + ([ "pos_pulses", "neg_pulses" ] if ops[ 0 ].has_pulses else [ ]) \
+                   + ([ "pos_count", "neg_count" ] if ops[ 0 ].update_every > 1 else [ ]):
+            signals[ key ], sigr = SigMerger.merge( gather( ops, key ) )
+            replacements.append( sigr )
+        
+        return (SimmPES( signals[ "pre_filtered" ],
+                         signals[ "error" ],
+                         ops[ 0 ].learning_rate,
+                         signals[ "pos_memristors" ],
+                         signals[ "neg_memristors" ],
+                         signals[ "weights" ],
+                         ops[ 0 ].noise_percentage,
+                         ops[ 0 ].gain,
+                         np.concatenate( gather( ops, "r_min" ) ),
+                         np.concatenate( gather( ops, "r_max" ) ),
+                         np.concatenate( gather( ops, "exponent" ) ),
+                         pos_pulses=signals.get( "pos_pulses" ),
+                         neg_pulses=signals.get( "neg_pulses" ),
+                         blocks=sum( gather( ops, "blocks" ), () ),
+                         threads=ops[ 0 ].threads,
+                         update_every=ops[ 0 ].update_every,
+                         jit_compile=ops[ 0 ].jit_compile,
+                         step=ops[ 0 ].step,
+                         pos_count=signals.get( "pos_count" ),
+                         neg_count=signals.get( "neg_count" ) ),
+                Merger.merge_dicts( *replacements ))
+
+
+_thread_pools = { }
+
+
+def thread_pool( threads ):
+    """Return the persistent pool of ``threads`` workers shared by all the operators using as many threads."""
+    if threads not in _thread_pools:
+        _thread_pools[ threads ] = ThreadPoolExecutor( max_workers=threads, thread_name_prefix="mPES" )
+    
+    return _thread_pools[ threads ]
 
-import tensorflow as tf
-from nengo.builder import Signal
-from nengo.builder.operator import Reset, DotInc, Copy
 
-from nengo_dl.builder import Builder, OpBuilder, NengoBuilder
-from nengo.builder import Builder as NengoCoreBuilder
+def shard_rows( update, threads ):
+    """Wrap the update of a crossbar so that it runs concurrently on ``threads`` blocks of its rows.
+    
+    Every device goes through the same NumPy operations whichever block it is in, and NumPy releases the GIL inside
+    them, so the result is bitwise identical to a single-threaded update.
+    """
+    pool = thread_pool( threads )
+    
+    def update_sharded( *arrays ):
+        *arrays, view = arrays
+        rows = arrays[ 0 ].shape[ 0 ]
+        bounds = np.linspace( 0, rows, min( threads, rows ) + 1 ).astype( int )
+        
+        # per-device arrays are split along the rows, while the pre activities are broadcast to all of them
+        futures = [
+                pool.submit( update,
+                             *[ x[ start:stop ] if np.ndim( x ) == 2 else x for x in arrays ],
+                             lambda b, start=start, stop=stop: view( b )[ start:stop ] )
+                for start, stop in zip( bounds[ :-1 ], bounds[ 1: ] )
+                ]
+        for future in futures:
+            future.result()
+    
+    return update_sharded
 
 
-@NengoBuilder.register( mPES )
-@NengoCoreBuilder.register( mPES )
+def update_memristors( memristors, mask, buffer, r_min, r_max, exponent, inv_exponent, n_pulses=1 ):
+    """Apply ``n_pulses`` pulses, in place, to the memristors selected by ``mask``."""
+    # clip values outside [R_0,R_1]
+    np.clip( memristors, r_min, r_max, out=memristors, where=mask )
+    
+    # invert the power law to find the current pulse number and then apply the new pulses
+    np.subtract( memristors, r_min, out=buffer, where=mask )
+    np.divide( buffer, r_max, out=buffer, where=mask )
+    np.power( buffer, inv_exponent, out=buffer, where=mask )
+    np.add( buffer, n_pulses, out=buffer, where=mask )
+    np.power( buffer, exponent, out=buffer, where=mask )
+    np.multiply( buffer, r_max, out=buffer, where=mask )
+    np.add( buffer, r_min, out=memristors, where=mask )
+
+
+def apply_pulses( pulses, memristors, mask, buffer, r_min, r_max, exponent, table=None, table_position=None,
+                  n_pulses=1 ):
+    """Apply ``n_pulses`` pulses, in place, to the pulse numbers selected by ``mask`` and derive their new resistances.
+    
+    If a `.PowerLawTable` is given the power law is interpolated from it instead of being evaluated.
+    """
+    np.add( pulses, n_pulses, out=pulses, where=mask )
+    if table is not None:
+        memristors[ mask ] = r_min[ mask ] + r_max[ mask ] * table( pulses[ mask ], table_position[ mask ] )
+        return
+    
+    np.power( pulses, exponent, out=buffer, where=mask )
+    np.multiply( buffer, r_max, out=buffer, where=mask )
+    np.add( buffer, r_min, out=memristors, where=mask )
+
+
+def resistance2pulses( R, r_min, r_max, exponent ):
+    """Invert the power law to find the pulse number corresponding to resistance ``R``, clipped in [R_0,R_1]."""
+    return np.power( (np.clip( R, r_min, r_max ) - r_min) / r_max, 1.0 / exponent )
+
+
+def update_weights( weights, pos_memristors, neg_memristors, mask, pos_buffer, neg_buffer, g_scale ):
+    """Recompute, in place, the weights selected by ``mask`` from the conductances of their memristor pair."""
+    # gain * (g_norm(R+) - g_norm(R-)) simplifies to gain * (1/R+ - 1/R-) / (g_max - g_min)
+    np.reciprocal( pos_memristors, out=pos_buffer, where=mask )
+    np.reciprocal( neg_memristors, out=neg_buffer, where=mask )
+    np.subtract( pos_buffer, neg_buffer, out=pos_buffer, where=mask )
+    np.multiply( pos_buffer, g_scale, out=weights, where=mask )
+
+
+def truncated_normal( rng, mean, sd, low, upp, size ):
+    """Draw ``size`` samples from a normal distribution truncated to [``low``, ``upp``] using generator ``rng``.
+    
+    Samples falling outside of the bounds are redrawn, which is much faster than inverting the CDF when the bounds
+    cut little of the distribution, as for the device parameters; otherwise the CDF is inverted.
+    """
+    if sd == 0:
+        return np.full( size, mean, dtype=float )
+    
+    from scipy.special import ndtr, ndtri
+    a, b = ndtr( (low - mean) / sd ), ndtr( (upp - mean) / sd )
+    if b - a < 0.5:
+        return mean + sd * ndtri( rng.uniform( a, b, size ) )
+    
+    samples = rng.normal( mean, sd, int( np.prod( size ) ) )
+    rejected = np.flatnonzero( (samples < low) | (samples > upp) )
+    while rejected.size > 0:
+        samples[ rejected ] = rng.normal( mean, sd, rejected.size )
+        rejected = rejected[ (samples[ rejected ] < low) | (samples[ rejected ] > upp) ]
+    
+    return samples.reshape( size )
+
+
+def draw_devices( mpes, shape, seed, threads=1, block_size=2**20 ):
+    """Draw the noisy parameters and initial resistances of a crossbar of ``shape`` devices from ``seed``.
+    
+    Each quantity is drawn by blocks of about ``block_size`` devices, each from its own `numpy.random.Generator`
+    spawned from ``seed``, so the blocks can be filled by ``threads`` concurrent threads and the draw does not depend
+    on the global NumPy RNG nor on the number of threads.
+    
+    Returns
+    -------
+    r_min, r_max, exponent, pos_initial, neg_initial : ndarray
+        The device parameters and the initial resistances of the positive and negative memristors.
+    """
+    rows = shape[ 0 ]
+    block_rows = max( 1, block_size // max( 1, shape[ 1 ] ) )
+    bounds = list( range( 0, rows, block_rows ) ) + [ rows ]
+    # the seeds of the NengoDL minibatch elements are sequences of integers, see `SimmPES.realise`
+    seeds = np.random.SeedSequence( seed ).spawn( 5 )
+    
+    def draw( seed_sequence, sample ):
+        out = np.empty( shape )
+        blocks = zip( bounds[ :-1 ], bounds[ 1: ], seed_sequence.spawn( len( bounds ) - 1 ) )
+        
+        def fill( start, stop, block_seed ):
+            out[ start:stop ] = sample( np.random.default_rng( block_seed ), (stop - start, shape[ 1 ]) )
+        
+        if threads > 1 and len( bounds ) > 2:
+            for future in [ thread_pool( threads ).submit( fill, *block ) for block in blocks ]:
+                future.result()
+        else:
+            for block in blocks:
+                fill( *block )
+        
+        return out
+    
+    r_min_noisy = draw( seeds[ 0 ], lambda rng, size: truncated_normal(
+            rng, mpes.r_min, mpes.r_min * mpes.noise_percentage[ 0 ], 0, np.inf, size ) )
+    r_max_low = np.max( r_min_noisy, initial=0 )
+    r_max_noisy = draw( seeds[ 1 ], lambda rng, size: truncated_normal(
+            rng, mpes.r_max, mpes.r_max * mpes.noise_percentage[ 1 ], r_max_low, np.inf, size ) )
+    exponent_noisy = draw( seeds[ 2 ], lambda rng, size: rng.normal(
+            mpes.exponent, np.abs( mpes.exponent ) * mpes.noise_percentage[ 2 ], size ) )
+    pos_mem_initial = draw( seeds[ 3 ], lambda rng, size: rng.normal( 1e8, 1e8 * mpes.noise_percentage[ 3 ], size ) )
+    neg_mem_initial = draw( seeds[ 4 ], lambda rng, size: rng.normal( 1e8, 1e8 * mpes.noise_percentage[ 3 ], size ) )
+    
+    return r_min_noisy, r_max_noisy, exponent_noisy, pos_mem_initial, neg_mem_initial
+
+
+def cached_draw_devices( mpes, shape, seed, cache_dir=None, threads=1 ):
+    """`draw_devices`, saving the devices as ``.npy`` files in ``cache_dir`` and memory-mapping them on later calls.
+    
+    The files are named after a hash of the device parameters of ``mpes``, ``seed`` and ``shape``, so concurrent
+    processes drawing the same devices share the pages of the same read-only files.  Nothing is cached without a
+    directory or a seed.
+    """
+    if cache_dir is None or seed is None:
+        return draw_devices( mpes, shape, seed, threads=threads )
+    
+    import hashlib
+    import json
+    import os
+    import tempfile
+    
+    names = ("r_min", "r_max", "exponent", "pos_initial", "neg_initial")
+    key = hashlib.sha256( json.dumps( { "r_min"           : float( mpes.r_min ),
+                                        "r_max"           : float( mpes.r_max ),
+                                        "exponent"        : float( mpes.exponent ),
+                                        "noise_percentage": np.ravel( mpes.noise_percentage ).tolist(),
+                                        "seed"            : np.ravel( seed ).tolist(),
+                                        "shape"           : list( shape ) },
+                                      sort_keys=True ).encode() ).hexdigest()
+    paths = [ os.path.join( cache_dir, f"{key}_{name}.npy" ) for name in names ]
+    if all( os.path.isfile( path ) for path in paths ):
+        return tuple( np.load( path, mmap_mode="r" ) for path in paths )
+    
+    devices = draw_devices( mpes, shape, seed, threads=threads )
+    os.makedirs( cache_dir, exist_ok=True )
+    for path, x in zip( paths, devices ):
+        # another process could be reading or writing the same file, so it is only replaced once complete
+        fd, temp_path = tempfile.mkstemp( dir=cache_dir, suffix=".npy" )
+        with os.fdopen( fd, "wb" ) as f:
+            np.save( f, x )
+        os.replace( temp_path, path )
+    
+    return devices
+
+
+@Builder.register( mPES )
 def build_mpes( model, mpes, rule ):
     conn = rule.connection
     
+    if type( model.builder ).__module__.startswith( "nengo_dl" ):
+        # NengoDL falls back on this build function, but its operator builder is only registered, and TensorFlow
+        # only imported, when the network is built by NengoDL
+        import memristor_nengo.learning_rules_dl
+    
+    # the output of anything but spiking neurons is no spike train, and Nengo 3.0 can only tell these by their type
+    if isinstance( mpes, EventmPES ) and not (
+            isinstance( conn.pre_obj, Neurons )
+            and isinstance( conn.pre_obj.ensemble.neuron_type, (LIF, SpikingRectifiedLinear, Izhikevich) )):
+        raise ValidationError( f"EventmPES learns on the spikes of the pre neurons, so {conn} has to start from the "
+                               f"neurons of an ensemble of spiking neurons", attr="learning_rule_type", obj=conn )
+    
     # Create input error signal
     error = Signal( shape=(rule.size_in,), name="PES:error" )
     model.add_op( Reset( error ) )
@@ -220,30 +703,30 @@ def build_mpes( model, mpes, rule ):
     out_size = encoders.shape[ 0 ]
     in_size = acts.shape[ 0 ]
     
-    from scipy.stats import truncnorm
-    def get_truncated_normal( mean, sd, low, upp ):
-        try:
-            return truncnorm( (low - mean) / sd, (upp - mean) / sd, loc=mean, scale=sd ) \
-                .rvs( out_size * in_size ) \
-                .reshape( (out_size, in_size) )
-        except ZeroDivisionError:
-            return np.full( (out_size, in_size), mean )
-    
-    np.random.seed( mpes.seed )
-    r_min_noisy = get_truncated_normal( mpes.r_min, mpes.r_min * mpes.noise_percentage[ 0 ],
-                                        0, np.inf )
-    np.random.seed( mpes.seed )
-    r_max_noisy = get_truncated_normal( mpes.r_max, mpes.r_max * mpes.noise_percentage[ 1 ],
-                                        np.max( r_min_noisy ), np.inf )
-    np.random.seed( mpes.seed )
-    exponent_noisy = np.random.normal( mpes.exponent, np.abs( mpes.exponent ) * mpes.noise_percentage[ 2 ],
-                                       (out_size, in_size) )
-    np.random.seed( mpes.seed )
-    pos_mem_initial = np.random.normal( 1e8, 1e8 * mpes.noise_percentage[ 3 ],
-                                        (out_size, in_size) )
-    np.random.seed( mpes.seed + 1 )
-    neg_mem_initial = np.random.normal( 1e8, 1e8 * mpes.noise_percentage[ 3 ],
-                                        (out_size, in_size) )
+    def warm_start( devices, element ):
+        # replace the drawn resistances with those saved for the element, or for the only one in the crossbar
+        if mpes.initial_state is None:
+            return devices
+        
+        initial = [ np.take( mpes.initial_state[ key ], element, axis=0, mode="wrap" )
+                    for key in ("pos_memristors", "neg_memristors") ]
+        if any( x.shape != (out_size, in_size) for x in initial ):
+            raise ValueError( f"The initial state of {conn} is not a crossbar of {out_size}x{in_size} memristors" )
+        
+        return tuple( devices[ :3 ] ) + tuple( initial )
+    
+    if mpes.initial_state is not None and mpes.seed is None:
+        warnings.warn( "The mPES devices are drawn without a seed, so they differ from those the initial state was "
+                       "saved with" )
+    r_min_noisy, r_max_noisy, exponent_noisy, pos_mem_initial, neg_mem_initial = warm_start(
+            cached_draw_devices( mpes, (out_size, in_size), mpes.seed, mpes.device_cache, threads=mpes.threads ), 0 )
+    
+    dtype = np.dtype( mpes.dtype )
+    r_min_noisy = r_min_noisy.astype( dtype, copy=False )
+    r_max_noisy = r_max_noisy.astype( dtype, copy=False )
+    exponent_noisy = exponent_noisy.astype( dtype, copy=False )
+    pos_mem_initial = pos_mem_initial.astype( dtype, copy=False )
+    neg_mem_initial = neg_mem_initial.astype( dtype, copy=False )
     
     pos_memristors = Signal( shape=(out_size, in_size), name="mPES:pos_memristors",
                              initial_value=pos_mem_initial )
@@ -253,6 +736,53 @@ def build_mpes( model, mpes, rule ):
     model.sig[ conn ][ "pos_memristors" ] = pos_memristors
     model.sig[ conn ][ "neg_memristors" ] = neg_memristors
     
+    pulse_state = mpes.pulse_state or mpes.lut_size is not None or dtype == np.float32
+    if pulse_state:
+        # keep the pulse number of each device as primary state, so that a pulse is just an increment; a warm start
+        # keeps the saved pulse numbers, which its resistances only give back up to rounding
+        pos_pulses_initial, neg_pulses_initial = [
+                np.take( mpes.initial_state[ key ], 0, axis=0, mode="wrap" ).astype( dtype, copy=False )
+                if mpes.initial_state is not None and key in mpes.initial_state
+                else resistance2pulses( memristors, r_min_noisy, r_max_noisy, exponent_noisy )
+                for key, memristors in (("pos_pulses", pos_mem_initial), ("neg_pulses", neg_mem_initial)) ]
+        pos_pulses = Signal( shape=(out_size, in_size), name="mPES:pos_pulses", initial_value=pos_pulses_initial )
+        neg_pulses = Signal( shape=(out_size, in_size), name="mPES:neg_pulses", initial_value=neg_pulses_initial )
+    else:
+        pos_pulses = neg_pulses = None
+    
+    if mpes.lut_size is not None:
+        # leave room for at least as many pulses as the devices start from
+        initial_pulses = np.concatenate( [ signal.initial_value.ravel() for signal in (pos_pulses, neg_pulses) ] )
+        max_pulses = max( 2**24, 2 * np.max( initial_pulses[ np.isfinite( initial_pulses ) ], initial=0 ) )
+        table = PowerLawTable( exponent_noisy, size=mpes.lut_size, buckets=mpes.lut_buckets, max_pulses=max_pulses )
+        if table.error_bound > 1e-3:
+            warnings.warn( f"The mPES lookup table can be up to {table.error_bound:.2e} away from the power law, "
+                           f"consider increasing lut_size or lut_buckets" )
+    else:
+        table = None
+    
+    if mpes.update_every > 1:
+        pos_count = Signal( shape=(out_size, in_size), name="mPES:pos_count",
+                            initial_value=np.zeros( (out_size, in_size), dtype=dtype ) )
+        neg_count = Signal( shape=(out_size, in_size), name="mPES:neg_count",
+                            initial_value=np.zeros( (out_size, in_size), dtype=dtype ) )
+    else:
+        pos_count = neg_count = None
+    
+    def realise( element, seed=mpes.seed, **params ):
+        # the first element draws the same devices as above, the others are drawn from a seed of their own; params
+        # override the r_min, r_max, exponent and noise_percentage of the learning rule
+        device_params = SimpleNamespace( **{ "r_min"           : mpes.r_min,
+                                             "r_max"           : mpes.r_max,
+                                             "exponent"        : mpes.exponent,
+                                             "noise_percentage": mpes.noise_percentage,
+                                             **params } )
+        devices = warm_start( cached_draw_devices( device_params, (out_size, in_size),
+                                                   seed if element == 0 or seed is None else [ seed, element ],
+                                                   mpes.device_cache, threads=mpes.threads ), element )
+        
+        return [ x.astype( dtype, copy=False ) for x in devices ]
+    
     if conn.post_obj is not conn.post:
         # in order to avoid slicing encoders along an axis > 0, we pad
         # `error` out to the full base dimensionality and then do the
@@ -279,7 +809,19 @@ def build_mpes( model, mpes, rule ):
                      mpes.gain,
                      r_min_noisy,
                      r_max_noisy,
-                     exponent_noisy )
+                     exponent_noisy,
+                     sparse=mpes.sparse,
+                     pos_pulses=pos_pulses,
+                     neg_pulses=neg_pulses,
+                     table=table,
+                     threads=mpes.threads,
+                     update_every=mpes.update_every,
+                     jit_compile=mpes.jit_compile,
+                     realise=realise,
+                     step=model.step,
+                     pos_count=pos_count,
+                     neg_count=neg_count,
+                     pre_spikes=model.sig[ conn.pre_obj ][ "out" ] if isinstance( mpes, EventmPES ) else None )
             )
     
     # expose these for probes
@@ -287,208 +829,100 @@ def build_mpes( model, mpes, rule ):
     model.sig[ rule ][ "activities" ] = acts
     model.sig[ rule ][ "pos_memristors" ] = pos_memristors
     model.sig[ rule ][ "neg_memristors" ] = neg_memristors
+    if pulse_state:
+        model.sig[ rule ][ "pos_pulses" ] = pos_pulses
+        model.sig[ rule ][ "neg_pulses" ] = neg_pulses
+    # and for checkpoints
+    if mpes.update_every > 1:
+        model.sig[ rule ][ "pos_count" ] = pos_count
+        model.sig[ rule ][ "neg_count" ] = neg_count
+
+
+checkpoint_keys = ("pos_memristors", "neg_memristors", "pos_pulses", "neg_pulses", "pos_count", "neg_count")
 
 
-@Builder.register( SimmPES )
-class SimmPESBuilder( OpBuilder ):
-    """Build exponent group of `~nengo.builder.learning_rules.SimmPES` operators."""
+def checkpoint_signals( model ):
+    """Return the signals of the state of each mPES connection of ``model``, in the order of the connections."""
+    return [ { "weights": model.sig[ conn ][ "weights" ],
+               **{ key: model.sig[ conn.learning_rule ][ key ] for key in checkpoint_keys
+                   if key in model.sig[ conn.learning_rule ] } }
+             for conn in model.toplevel.all_connections if isinstance( conn.learning_rule_type, mPES ) ]
+
+
+def save_checkpoint( sim, path ):
+    """Save the memristors, weights and time of all the mPES connections of a Nengo or NengoDL simulator to ``path``.
     
-    def build_pre( self, signals, config ):
-        super().build_pre( signals, config )
-        
-        self.output_size = self.ops[ 0 ].weights.shape[ 0 ]
-        self.input_size = self.ops[ 0 ].weights.shape[ 1 ]
-        
-        self.error_data = signals.combine( [ op.error for op in self.ops ] )
-        self.error_data = self.error_data.reshape( (len( self.ops ), self.ops[ 0 ].error.shape[ 0 ], 1) )
-        
-        self.pre_data = signals.combine( [ op.pre_filtered for op in self.ops ] )
-        self.pre_data = self.pre_data.reshape( (len( self.ops ), 1, self.ops[ 0 ].pre_filtered.shape[ 0 ]) )
-        
-        self.pos_memristors = signals.combine( [ op.pos_memristors for op in self.ops ] )
-        self.pos_memristors = self.pos_memristors.reshape(
-                (len( self.ops ), self.ops[ 0 ].pos_memristors.shape[ 0 ], self.ops[ 0 ].pos_memristors.shape[ 1 ])
-                )
-        
-        self.neg_memristors = signals.combine( [ op.neg_memristors for op in self.ops ] )
-        self.neg_memristors = self.neg_memristors.reshape(
-                (len( self.ops ), self.ops[ 0 ].neg_memristors.shape[ 0 ], self.ops[ 0 ].neg_memristors.shape[ 1 ])
-                )
-        # self.r_min = signals.combine( [ op.r_min for op in self.ops ] )
-        # self.r_min = self.r_min.reshape(
-        #         (len( self.ops ), self.ops[ 0 ].r_min.shape[ 0 ], self.ops[ 0 ].r_min.shape[ 1 ])
-        #         )
-        
-        self.output_data = signals.combine( [ op.weights for op in self.ops ] )
-        
-        self.gain = signals.op_constant( self.ops,
-                                         [ 1 for _ in self.ops ],
-                                         "gain",
-                                         signals.dtype,
-                                         shape=(1, -1, 1, 1) )
-        self.r_min = signals.op_constant( self.ops,
-                                          [ 1 for _ in self.ops ],
-                                          "r_min",
-                                          signals.dtype,
-                                          shape=(1, -1, 1, 1) )
-        self.r_min = tf.reshape( self.r_min,
-                                 (1,
-                                  len( self.ops ),
-                                  self.ops[ 0 ].r_min.shape[ 0 ],
-                                  self.ops[ 0 ].r_min.shape[ 1 ])
-                                 )
-        self.r_max = signals.op_constant( self.ops,
-                                          [ 1 for _ in self.ops ],
-                                          "r_max",
-                                          signals.dtype,
-                                          shape=(1, -1, 1, 1) )
-        self.r_max = tf.reshape( self.r_max,
-                                 (1,
-                                  len( self.ops ),
-                                  self.ops[ 0 ].r_max.shape[ 0 ],
-                                  self.ops[ 0 ].r_max.shape[ 1 ])
-                                 )
-        self.exponent = signals.op_constant( self.ops,
-                                             [ 1 for _ in self.ops ],
-                                             "exponent",
-                                             signals.dtype,
-                                             shape=(1, -1, 1, 1) )
-        self.exponent = tf.reshape( self.exponent,
-                                    (1,
-                                     len( self.ops ),
-                                     self.ops[ 0 ].exponent.shape[ 0 ],
-                                     self.ops[ 0 ].exponent.shape[ 1 ])
-        
-                                    )
-        self.error_threshold = signals.op_constant( self.ops,
-                                                    [ 1 for _ in self.ops ],
-                                                    "error_threshold",
-                                                    signals.dtype,
-                                                    shape=(1, -1, 1, 1) )
-        self.g_min = 1.0 / self.r_max
-        self.g_max = 1.0 / self.r_min
-    
-    def build_step( self, signals ):
-        pre_filtered = signals.gather( self.pre_data )
-        local_error = signals.gather( self.error_data )
-        pos_memristors = signals.gather( self.pos_memristors )
-        neg_memristors = signals.gather( self.neg_memristors )
-        
-        r_min = self.r_min
-        r_max = self.r_max
-        exponent = self.exponent
-        
-        def resistance2conductance( R ):
-            g_curr = 1.0 / R
-            g_norm = (g_curr - self.g_min) / (self.g_max - self.g_min)
-            
-            return g_norm * self.gain
-        
-        def find_spikes( input_activities, output_size, invert=False ):
-            spiked_pre = tf.cast(
-                    tf.tile( tf.math.rint( input_activities ), [ 1, 1, output_size, 1 ] ),
-                    tf.bool )
-            
-            out = spiked_pre
-            if invert:
-                out = tf.math.logical_not( out )
-            
-            return tf.cast( out, tf.float32 )
-        
-        # @tf.function
-        def update_resistances( pos_memristors, neg_memristors ):
-            pos_mask = tf.greater( V, 0 )
-            pos_indices = tf.where( pos_mask )
-            neg_mask = tf.less( V, 0 )
-            neg_indices = tf.where( neg_mask )
-            
-            # clip values outside [R_0,R_1]
-            pos_memristors = tf.tensor_scatter_nd_update( pos_memristors,
-                                                          pos_indices,
-                                                          tf.where(
-                                                                  tf.greater(
-                                                                          tf.boolean_mask( pos_memristors, pos_mask ),
-                                                                          tf.boolean_mask( r_max, pos_mask ) ),
-                                                                  tf.boolean_mask( r_max, pos_mask ),
-                                                                  tf.boolean_mask( pos_memristors, pos_mask ) ) )
-            pos_memristors = tf.tensor_scatter_nd_update( pos_memristors,
-                                                          pos_indices,
-                                                          tf.where(
-                                                                  tf.less( tf.boolean_mask( pos_memristors, pos_mask ),
-                                                                           tf.boolean_mask( r_min, pos_mask ) ),
-                                                                  tf.boolean_mask( r_min, pos_mask ),
-                                                                  tf.boolean_mask( pos_memristors, pos_mask ) ) )
-            neg_memristors = tf.tensor_scatter_nd_update( neg_memristors,
-                                                          neg_indices,
-                                                          tf.where(
-                                                                  tf.greater(
-                                                                          tf.boolean_mask( neg_memristors, neg_mask ),
-                                                                          tf.boolean_mask( r_max, neg_mask ) ),
-                                                                  tf.boolean_mask( r_max, neg_mask ),
-                                                                  tf.boolean_mask( neg_memristors, neg_mask ) ) )
-            neg_memristors = tf.tensor_scatter_nd_update( neg_memristors,
-                                                          neg_indices,
-                                                          tf.where(
-                                                                  tf.less( tf.boolean_mask( neg_memristors, neg_mask ),
-                                                                           tf.boolean_mask( r_min, neg_mask ) ),
-                                                                  tf.boolean_mask( r_min, neg_mask ),
-                                                                  tf.boolean_mask( neg_memristors, neg_mask ) ) )
-            
-            # positive memristors update
-            pos_n = tf.math.pow( (tf.boolean_mask( pos_memristors, pos_mask ) - tf.boolean_mask( r_min, pos_mask ))
-                                 / tf.boolean_mask( r_max, pos_mask ),
-                                 1 / tf.boolean_mask( exponent, pos_mask ) )
-            pos_update = tf.boolean_mask( r_min, pos_mask ) + tf.boolean_mask( r_max, pos_mask ) * \
-                         tf.math.pow( pos_n + 1, tf.boolean_mask( exponent, pos_mask ) )
-            pos_memristors = tf.tensor_scatter_nd_update( pos_memristors, pos_indices, pos_update )
-            
-            # negative memristors update
-            neg_n = tf.math.pow( (tf.boolean_mask( neg_memristors, neg_mask ) - tf.boolean_mask( r_min, neg_mask ))
-                                 / tf.boolean_mask( r_max, neg_mask ),
-                                 1 / tf.boolean_mask( exponent, neg_mask ) )
-            neg_update = tf.boolean_mask( r_min, neg_mask ) + tf.boolean_mask( r_max, neg_mask ) * \
-                         tf.math.pow( neg_n + 1, tf.boolean_mask( exponent, neg_mask ) )
-            neg_memristors = tf.tensor_scatter_nd_update( neg_memristors, neg_indices, neg_update )
-            
-            return pos_memristors, neg_memristors
-        
-        pes_delta = -local_error * pre_filtered
-        
-        spiked_map = find_spikes( pre_filtered, self.output_size )
-        pes_delta = pes_delta * spiked_map
-        
-        V = tf.sign( pes_delta ) * 1e-1
-        
-        # FIRST thing, check if the error is greater than the threshold
-        # if any errors is above threshold then pass decision to next tf.cond()
-        # if all errors are below threshold then do nothing
-        pos_memristors, neg_memristors = tf.cond(
-                tf.reduce_any( tf.greater( tf.abs( local_error ), self.error_threshold ) ),
-                true_fn=lambda: update_resistances( pos_memristors,
-                                                    neg_memristors ),
-                false_fn=lambda: (
-                        tf.identity( pos_memristors ),
-                        tf.identity( neg_memristors ))
-                )
-        
-        # update the memristor values
-        signals.scatter(
-                self.pos_memristors.reshape( (self.pos_memristors.shape[ -2 ], self.pos_memristors.shape[ -1 ]) ),
-                pos_memristors )
-        signals.scatter(
-                self.neg_memristors.reshape( (self.neg_memristors.shape[ -2 ], self.neg_memristors.shape[ -1 ]) ),
-                neg_memristors )
-        
-        new_weights = resistance2conductance( pos_memristors ) - resistance2conductance( neg_memristors )
-        
-        signals.scatter( self.output_data, new_weights )
+    The state of each connection is saved under ``<index>/<signal>`` in a ``.npz`` file, with a leading axis over the
+    minibatch elements of NengoDL (of size one on Nengo), so that it can be loaded on either backend.  The file is only
+    replaced once complete, so an interrupted run leaves the previous checkpoint.
+    """
+    import os
+    import tempfile
     
-    @staticmethod
-    def mergeable( x, y ):
-        # pre inputs must have the same dimensionality so that we can broadcast
-        # them when computing the outer product.
-        # the error signals also have to have the same shape.
-        return (
-                x.pre_filtered.shape[ 0 ] == y.pre_filtered.shape[ 0 ]
-                and x.local_error.shape[ 0 ] == y.local_error.shape[ 0 ]
-        )
+    dl = hasattr( sim, "tensor_graph" )
+    arrays = { "n_steps": sim.n_steps, "time": sim.time }
+    for i, signals in enumerate( checkpoint_signals( sim.model ) ):
+        for key, sig in signals.items():
+            if dl:
+                import tensorflow as tf
+                
+                arrays[ f"{i}/{key}" ] = tf.keras.backend.get_value( sim.tensor_graph.get_tensor( sig ) )
+            else:
+                arrays[ f"{i}/{key}" ] = np.array( sim.signals[ sig ] )[ np.newaxis ]
+    
+    fd, temp_path = tempfile.mkstemp( dir=os.path.dirname( os.path.abspath( path ) ), suffix=".npz" )
+    with os.fdopen( fd, "wb" ) as f:
+        np.savez( f, **arrays )
+    os.replace( temp_path, path )
+
+
+def load_checkpoint( sim, path ):
+    """Resume a Nengo or NengoDL simulator of the same network from a checkpoint saved by `save_checkpoint`.
+    
+    Only the state of the mPES connections and the time are restored, the rest of the network, as its neurons and
+    synapses, starts from its initial state.  The state saved for a single minibatch element is loaded in all the
+    elements.
+    """
+    with np.load( path ) as checkpoint:
+        state = dict( checkpoint )
+    
+    dl = hasattr( sim, "tensor_graph" )
+    if dl:
+        from memristor_nengo.learning_rules_dl import write_state
+    for i, signals in enumerate( checkpoint_signals( sim.model ) ):
+        for key, sig in signals.items():
+            if f"{i}/{key}" not in state:
+                raise ValueError( f"{path} has no {key} for mPES connection {i}" )
+            value = state[ f"{i}/{key}" ]
+            if dl:
+                write_state( sim.tensor_graph, sig, value if len( value ) > 1 else value[ 0 ] )
+            else:
+                sim.signals[ sig ][ ... ] = value[ 0 ]
+    
+    if dl:
+        # NengoDL doesn't keep the time between runs, it is derived from the step at the start of each of them
+        write_state( sim.tensor_graph, sim.model.step, state[ "n_steps" ] )
+        sim._update_steps()
+    else:
+        sim.signals[ sim.model.step ][ ... ] = state[ "n_steps" ]
+        sim.signals[ sim.model.time ][ ... ] = state[ "time" ]
+        sim._probe_step_time()
+
+
+def load_crossbar( path, connection=0 ):
+    """Load the state of mPES connection ``connection`` from a checkpoint, to warm-start a new simulation from it.
+    
+    Returns
+    -------
+    crossbar : dict
+        The saved ``weights``, ``pos_memristors`` and ``neg_memristors``, as well as the other state of the devices,
+        each with a leading axis over the saved minibatch elements.  Pass it as the ``initial_state`` of `mPES` and
+        its first ``weights`` as the transform of the connection.
+    """
+    prefix = f"{connection}/"
+    with np.load( path ) as checkpoint:
+        crossbar = { key[ len( prefix ): ]: checkpoint[ key ] for key in checkpoint.files if key.startswith( prefix ) }
+    if not crossbar:
+        raise ValueError( f"{path} has no mPES connection {connection}" )
+    
+    return crossbar
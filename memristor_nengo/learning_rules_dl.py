@@ -0,0 +1,414 @@
+import warnings
+
+import numpy as np
+import tensorflow as tf
+from nengo_dl.builder import Builder, OpBuilder
+
+from memristor_nengo.learning_rules import SimmPES, resistance2pulses
+
+
+@Builder.register( SimmPES )
+class SimmPESBuilder( OpBuilder ):
+    """Build exponent group of `~nengo.builder.learning_rules.SimmPES` operators.
+    
+    Ops with different numbers of post neurons are padded to the largest one and updated together.  NengoDL's default
+    ``tree_planner`` still schedules the ops of each size in a group of their own, as the errors they read are encoded
+    by ``DotInc`` ops that only merge for ensembles of the same size, so connections of different sizes are only merged
+    with ``nengo_dl.configure_settings( planner=nengo_dl.graph_optimizer.greedy_planner )``.
+    """
+    
+    def __init__( self, ops ):
+        super().__init__( ops )
+        
+        # the device parameters, which outlive the successive builds of the graph
+        self.variables = { }
+    
+    def build_pre( self, signals, config ):
+        super().build_pre( signals, config )
+        
+        post_sizes = [ op.weights.shape[ 0 ] for op in self.ops ]
+        self.output_size = max( post_sizes )
+        self.input_size = self.ops[ 0 ].weights.shape[ 1 ]
+        crossbar_shape = (len( self.ops ), self.output_size, self.input_size)
+        
+        # ops with fewer post neurons are padded with rows that are masked out of the update, so that a group of
+        # connections of different sizes is still updated as one (ops, post, pre) tensor
+        self.padded = len( set( post_sizes ) ) > 1
+        if self.padded:
+            valid = np.arange( self.output_size ) < np.reshape( post_sizes, (-1, 1) )
+            offsets = np.cumsum( [ 0 ] + post_sizes[ :-1 ] )
+            # the padding rows read the first row of their op, their results are never written back
+            rows = np.where( valid, offsets[ :, np.newaxis ] + np.arange( self.output_size ), offsets[ :, np.newaxis ] )
+            self.pad_rows = tf.constant( rows.ravel(), dtype=tf.int32 )
+            self.unpad_rows = tf.constant( np.flatnonzero( valid ), dtype=tf.int32 )
+            self.valid = tf.constant( valid[ np.newaxis, :, :, np.newaxis ] )
+        
+        self.error_data = signals.combine( [ op.error for op in self.ops ] )
+        
+        self.pre_data = signals.combine( [ op.pre_filtered for op in self.ops ] )
+        self.pre_data = self.pre_data.reshape( (len( self.ops ), 1, self.ops[ 0 ].pre_filtered.shape[ 0 ]) )
+        
+        self.event_driven = self.ops[ 0 ].event_driven
+        if self.event_driven:
+            self.spikes_data = signals.combine( [ op.pre_spikes for op in self.ops ] )
+            self.spikes_data = self.spikes_data.reshape( self.pre_data.shape )
+        
+        # the state is read as one (ops, post, pre) crossbar per op and written back through the stacked rows
+        self.pos_memristors = signals.combine( [ op.pos_memristors for op in self.ops ] )
+        self.neg_memristors = signals.combine( [ op.neg_memristors for op in self.ops ] )
+        self.output_data = signals.combine( [ op.weights for op in self.ops ] )
+        self.pulse_state = self.ops[ 0 ].pos_pulses is not None
+        if self.pulse_state:
+            self.pos_pulses = signals.combine( [ op.pos_pulses for op in self.ops ] )
+            self.neg_pulses = signals.combine( [ op.neg_pulses for op in self.ops ] )
+        self.crossbar_shape = crossbar_shape
+        
+        if self.ops[ 0 ].update_every > 1:
+            warnings.warn( "update_every is not supported by NengoDL, the mPES devices are updated at every step" )
+        
+        # with a minibatch each element simulates its own realisation of the devices, the first one being the same as
+        # the NumPy operator's
+        self.realisations = signals.minibatch_size > 1 and all( op.realise is not None for op in self.ops )
+        if self.realisations and self.ops[ 0 ].table is not None:
+            warnings.warn( "The mPES lookup table is built for a single realisation of the devices, so all the "
+                           "minibatch elements share it" )
+            self.realisations = False
+        
+        if self.realisations:
+            devices = [ [ (op.r_min, op.r_max, op.exponent,
+                           op.pos_memristors.initial_value, op.neg_memristors.initial_value) if element == 0
+                          else op.realise( element ) for op in self.ops ]
+                        for element in range( signals.minibatch_size ) ]
+            # (minibatch, ops, post, pre)
+            r_min, r_max, exponent, pos_initial, neg_initial = [
+                    np.array( [ self.stack_devices( [ d[ i ] for d in element ] ) for element in devices ] )
+                    for i in range( 5 ) ]
+        else:
+            r_min, r_max, exponent = [ self.stack_devices( [ getattr( op, key ) for op in self.ops ] )[ np.newaxis ]
+                                       for key in ("r_min", "r_max", "exponent") ]
+        gain = np.reshape( [ op.gain for op in self.ops ], (1, -1, 1, 1) )
+        
+        def device_variable( name, values ):
+            # non-trainable variables rather than constants, so that the graph doesn't embed the parameters of every
+            # device and they can be reassigned without rebuilding it (see `.assign_devices`)
+            if name not in self.variables:
+                with tf.init_scope():
+                    self.variables[ name ] = tf.Variable( values, dtype=signals.dtype, trainable=False,
+                                                          name=f"mPES/{name}" )
+            
+            return self.variables[ name ]
+        
+        # the same per-device parameters as the NumPy operator, so that both round in the same way
+        self.r_min = device_variable( "r_min", r_min )
+        self.r_max = device_variable( "r_max", r_max )
+        self.exponent = device_variable( "exponent", exponent )
+        self.inv_exponent = device_variable( "inv_exponent", 1.0 / exponent )
+        self.g_scale = device_variable( "g_scale", gain / (1.0 / r_min - 1.0 / r_max) )
+        if self.realisations:
+            # the state of all the elements starts from the initial value of the first one, so it is replaced by their
+            # own on the first step after each reset
+            self.step_data = signals.combine( [ self.ops[ 0 ].step ] )
+            self.pos_initial = device_variable( "pos_initial", pos_initial )
+            self.neg_initial = device_variable( "neg_initial", neg_initial )
+            if self.pulse_state:
+                self.pos_initial_pulses = device_variable( "pos_initial_pulses",
+                                                           resistance2pulses( pos_initial, r_min, r_max, exponent ) )
+                self.neg_initial_pulses = device_variable( "neg_initial_pulses",
+                                                           resistance2pulses( neg_initial, r_min, r_max, exponent ) )
+        self.error_threshold = device_variable( "error_threshold",
+                                                np.reshape( [ op.error_threshold for op in self.ops ], (1, -1, 1, 1) ) )
+        
+        self.table = None
+        if self.ops[ 0 ].table is not None:
+            # the tables of all the ops are concatenated and each op indexes its own part through an offset
+            tables = [ op.table for op in self.ops ]
+            op_shape = (1, len( self.ops ), 1, 1)
+            self.table = tf.constant( np.concatenate( [ t.table for t in tables ] ), dtype=signals.dtype )
+            self.table_size = tables[ 0 ].size
+            self.table_length = tf.constant( np.reshape( [ t.length for t in tables ], op_shape ), dtype=tf.int32 )
+            self.table_buckets = tf.constant( np.reshape( [ t.buckets for t in tables ], op_shape ), dtype=tf.int32 )
+            self.table_offset = tf.constant( np.reshape( np.cumsum( [ 0 ] + [ t.table.size for t in tables[ :-1 ] ] ),
+                                                         op_shape ), dtype=tf.int32 )
+            self.table_position = device_variable( "table_position",
+                                                   self.stack_devices( [ t.position for t in tables ] )[ np.newaxis ] )
+        
+        # the variables are captured by the compiled function, so it has to be created after them; TensorFlow 2.3 only
+        # knows jit_compile by its experimental name
+        self.update_step = tf.function( self.update, experimental_compile=True ) if self.ops[ 0 ].jit_compile \
+            else self.update
+    
+    def stack_devices( self, values ):
+        """Stack the ``(post, pre)`` arrays of the ops, padding them to the largest post ensemble."""
+        # repeating the last row keeps the parameters of the padding devices finite
+        return np.stack( [ np.pad( x, [ (0, self.output_size - x.shape[ 0 ]), (0, 0) ], mode="edge" )
+                           for x in values ] )
+    
+    def assign_devices( self, r_min, r_max, exponent, gain=None ):
+        """Replace the parameters of the devices without rebuilding the graph.
+        
+        A lookup table is not rebuilt, so with one the exponents are clamped to the range it was built for.
+        
+        Parameters
+        ----------
+        r_min, r_max, exponent : array_like
+            The new parameters, broadcastable to ``(minibatch, ops, post, pre)`` with the ops in the order of the group
+            and padded to the largest of their post ensembles.
+        gain : float, optional
+            The new gain of all the ops, otherwise they keep their own.
+        """
+        shape = self.r_min.shape
+        r_min, r_max, exponent = [ np.broadcast_to( x, shape ) for x in (r_min, r_max, exponent) ]
+        if gain is None:
+            gain = np.reshape( [ op.gain for op in self.ops ], (1, -1, 1, 1) )
+        
+        self.r_min.assign( r_min )
+        self.r_max.assign( r_max )
+        self.exponent.assign( exponent )
+        self.inv_exponent.assign( 1.0 / exponent )
+        self.g_scale.assign( np.broadcast_to( gain / (1.0 / r_min - 1.0 / r_max), shape ) )
+        if self.table is not None:
+            tables = [ op.table for op in self.ops ]
+            exponent_min = np.reshape( [ t.exponent_min for t in tables ], (1, -1, 1, 1) )
+            bucket_width = np.reshape( [ t.bucket_width for t in tables ], (1, -1, 1, 1) )
+            buckets = np.reshape( [ t.buckets for t in tables ], (1, -1, 1, 1) )
+            self.table_position.assign( np.clip( (exponent - exponent_min) / bucket_width, 0, buckets - 1 ) )
+    
+    def reinitialise( self, tensor_graph, seed=None, gain=None, **params ):
+        """Draw new devices for the group and write their initial state into the simulation.
+        
+        The simulator has to be reset first, as resetting it restores the state the graph was built with.
+        
+        Parameters
+        ----------
+        tensor_graph : `nengo_dl.tensor_graph.TensorGraph`
+            The graph of the simulator the group was built in.
+        seed : int, optional
+            The seed the devices are drawn from, otherwise the one of each learning rule.
+        gain : float, optional
+            The new gain of all the ops.
+        params
+            ``r_min``, ``r_max``, ``exponent`` or ``noise_percentage`` overriding those of the learning rules.
+        """
+        elements = tensor_graph.minibatch_size if self.realisations else 1
+        devices = [ [ op.realise( element, *([ ] if seed is None else [ seed ]), **params ) for op in self.ops ]
+                    for element in range( elements ) ]
+        r_min, r_max, exponent, pos_initial, neg_initial = [
+                np.array( [ self.stack_devices( [ d[ i ] for d in element ] ) for element in devices ] )
+                for i in range( 5 ) ]
+        self.assign_devices( r_min, r_max, exponent, gain )
+        
+        state = { "pos_memristors": pos_initial, "neg_memristors": neg_initial }
+        if self.pulse_state:
+            state[ "pos_pulses" ] = resistance2pulses( pos_initial, r_min, r_max, exponent )
+            state[ "neg_pulses" ] = resistance2pulses( neg_initial, r_min, r_max, exponent )
+        if self.realisations:
+            # otherwise the first step would go back to the initial state of the build
+            self.pos_initial.assign( pos_initial )
+            self.neg_initial.assign( neg_initial )
+            if self.pulse_state:
+                self.pos_initial_pulses.assign( state[ "pos_pulses" ] )
+                self.neg_initial_pulses.assign( state[ "neg_pulses" ] )
+        
+        for key, values in state.items():
+            for i, op in enumerate( self.ops ):
+                write_state( tensor_graph, getattr( op, key ), values[ :, i, :op.weights.shape[ 0 ] ] )
+    
+    def pad( self, x, shape ):
+        """Reshape the rows of all the ops, stacked along axis 1, to ``shape`` after padding them to the same size."""
+        if self.padded:
+            x = tf.gather( x, self.pad_rows, axis=1 )
+        
+        return tf.reshape( x, (-1,) + shape )
+    
+    def unpad( self, x ):
+        """Inverse of `.pad` for a crossbar, dropping the padding rows."""
+        x = tf.reshape( x, (-1, self.crossbar_shape[ 0 ] * self.output_size, self.input_size) )
+        if self.padded:
+            x = tf.gather( x, self.unpad_rows, axis=1 )
+        
+        return x
+    
+    def build_step( self, signals ):
+        pre_filtered = signals.gather( self.pre_data )
+        local_error = self.pad( signals.gather( self.error_data ), self.crossbar_shape[ :2 ] + (1,) )
+        pre_spikes = signals.gather( self.spikes_data ) if self.event_driven else None
+        pos_memristors = self.pad( signals.gather( self.pos_memristors ), self.crossbar_shape )
+        neg_memristors = self.pad( signals.gather( self.neg_memristors ), self.crossbar_shape )
+        weights = self.pad( signals.gather( self.output_data ), self.crossbar_shape )
+        pos_pulses = neg_pulses = None
+        if self.pulse_state:
+            pos_pulses = self.pad( signals.gather( self.pos_pulses ), self.crossbar_shape )
+            neg_pulses = self.pad( signals.gather( self.neg_pulses ), self.crossbar_shape )
+        if self.realisations:
+            first_step = tf.equal( tf.reshape( signals.gather( self.step_data ), () ), 1 )
+            pos_memristors = tf.where( first_step, self.pos_initial, pos_memristors )
+            neg_memristors = tf.where( first_step, self.neg_initial, neg_memristors )
+            if self.pulse_state:
+                pos_pulses = tf.where( first_step, self.pos_initial_pulses, pos_pulses )
+                neg_pulses = tf.where( first_step, self.neg_initial_pulses, neg_pulses )
+        
+        pos_memristors, neg_memristors, weights, pos_pulses, neg_pulses = self.update_step(
+                local_error, pre_filtered, pre_spikes, pos_memristors, neg_memristors, weights, pos_pulses, neg_pulses )
+        
+        # update the memristor values
+        signals.scatter( self.pos_memristors, self.unpad( pos_memristors ) )
+        signals.scatter( self.neg_memristors, self.unpad( neg_memristors ) )
+        if self.pulse_state:
+            signals.scatter( self.pos_pulses, self.unpad( pos_pulses ) )
+            signals.scatter( self.neg_pulses, self.unpad( neg_pulses ) )
+        signals.scatter( self.output_data, self.unpad( weights ) )
+    
+    def update( self, local_error, pre_filtered, pre_spikes, pos_memristors, neg_memristors, weights, pos_pulses,
+                neg_pulses ):
+        """Compute the new state of the crossbars from the gathered signals.
+        
+        The update is computed densely on the whole crossbars and the devices that don't change are selected away with
+        ``tf.where``, so that every tensor has a static shape and the step has no branches; this is what allows XLA to
+        compile it into a single kernel when ``jit_compile`` is set.
+        """
+        r_min = self.r_min
+        r_max = self.r_max
+        exponent = self.exponent
+        
+        def find_spikes( input_activities ):
+            # (..., 1, pre), which broadcasts over the post neurons
+            return tf.not_equal( tf.math.rint( input_activities ), 0 )
+        
+        def power_law( pulses ):
+            if self.table is None:
+                return tf.math.pow( pulses, exponent )
+            
+            # bilinear interpolation in the lookup table, see `.PowerLawTable`
+            mantissa, octave = frexp( pulses )
+            length = tf.cast( self.table_length, pulses.dtype )
+            x = self.table_size * (tf.cast( octave, pulses.dtype ) + 2 * mantissa - 1)
+            x = tf.clip_by_value( x, 0, length - 1 )
+            i = tf.minimum( tf.cast( x, tf.int32 ), self.table_length - 2 )
+            t = x - tf.cast( i, pulses.dtype )
+            
+            b = tf.minimum( tf.cast( self.table_position, tf.int32 ), self.table_buckets - 2 )
+            u = self.table_position - tf.cast( b, pulses.dtype )
+            
+            base = self.table_offset + b * self.table_length + i
+            low = tf.gather( self.table, base )
+            low += t * (tf.gather( self.table, base + 1 ) - low)
+            base += self.table_length
+            high = tf.gather( self.table, base )
+            high += t * (tf.gather( self.table, base + 1 ) - high)
+            
+            return low + u * (high - low)
+        
+        def update_resistances( memristors, mask ):
+            # clip values outside [R_0,R_1], invert the power law to find the current pulse number and apply one more
+            clipped = tf.clip_by_value( memristors, r_min, r_max )
+            n = tf.math.pow( (clipped - r_min) / r_max, self.inv_exponent )
+            
+            return tf.where( mask, tf.math.pow( n + 1, exponent ) * r_max + r_min, memristors )
+        
+        def update_pulses( memristors, pulses, mask ):
+            # a pulse is just an increment of the pulse number, from which the resistance is derived
+            pulses = pulses + tf.cast( mask, pulses.dtype )
+            
+            return tf.where( mask, power_law( pulses ) * r_max + r_min, memristors ), pulses
+        
+        # some memristors are adjusted erroneously if we don't filter
+        # event-driven ops only update the devices of the pre neurons that spiked on this step
+        spiked_pre = find_spikes( pre_spikes if self.event_driven else pre_filtered )
+        
+        # post neurons whose error is inside the deadzone don't learn, so their rows are left out of the update
+        learning = tf.logical_and( tf.greater( tf.abs( local_error ), self.error_threshold ), spiked_pre )
+        if self.padded:
+            learning = tf.logical_and( learning, self.valid )
+        
+        pes_delta = -local_error * pre_filtered
+        pos_mask = tf.logical_and( tf.greater( pes_delta, 0 ), learning )
+        neg_mask = tf.logical_and( tf.less( pes_delta, 0 ), learning )
+        
+        if self.pulse_state:
+            pos_memristors, pos_pulses = update_pulses( pos_memristors, pos_pulses, pos_mask )
+            neg_memristors, neg_pulses = update_pulses( neg_memristors, neg_pulses, neg_mask )
+        else:
+            pos_memristors = update_resistances( pos_memristors, pos_mask )
+            neg_memristors = update_resistances( neg_memristors, neg_mask )
+        
+        # gain * (g_norm(R+) - g_norm(R-)) simplifies to gain * (1/R+ - 1/R-) / (g_max - g_min)
+        new_weights = (tf.math.reciprocal( pos_memristors ) - tf.math.reciprocal( neg_memristors )) * self.g_scale
+        weights = tf.where( tf.logical_or( pos_mask, neg_mask ), new_weights, weights )
+        
+        return pos_memristors, neg_memristors, weights, pos_pulses, neg_pulses
+    
+    @staticmethod
+    def mergeable( x, y ):
+        # pre inputs must have the same dimensionality so that we can broadcast
+        # them when computing the outer product (NengoDL wouldn't combine the crossbars otherwise), while ops with
+        # different numbers of post neurons are padded to the largest one, which only the greedy_planner exploits
+        return (
+                x.pre_filtered.shape[ 0 ] == y.pre_filtered.shape[ 0 ]
+                and x.event_driven == y.event_driven
+                and x.jit_compile == y.jit_compile
+                and x.has_pulses == y.has_pulses
+                and (x.table is None) == (y.table is None)
+                and (x.table is None or x.table.size == y.table.size)
+                and (x.realise is None) == (y.realise is None)
+        )
+
+
+def write_state( tensor_graph, sig, value ):
+    """Overwrite the value of signal ``sig`` in all the minibatch elements of a NengoDL simulation."""
+    tensor_sig = tensor_graph.signals[ sig ]
+    if tensor_sig.key in tensor_graph.saved_state:
+        base = tensor_graph.saved_state[ tensor_sig.key ]
+    else:
+        base = tensor_graph.base_params[ tensor_sig.key ]
+    value = np.broadcast_to( value, tensor_sig.full_shape ).astype( base.dtype.as_numpy_dtype )
+    
+    # the rows of the signal are runs of rows of its base array, which follow the minibatch axis if it has one
+    offset = 0
+    for start, stop in tensor_sig.slices:
+        if tensor_sig.minibatched:
+            base[ :, start:stop ].assign( value[ :, offset:offset + stop - start ] )
+        else:
+            base[ start:stop ].assign( value[ offset:offset + stop - start ] )
+        offset += stop - start
+
+
+def reinitialise_mpes( sim, seed=None, gain=None, **params ):
+    """Reset a NengoDL simulator with new memristors on all its mPES connections, reusing its graph.
+    
+    The graph is built and compiled only once for all the points of a parameter sweep, while the devices are drawn
+    and initialised as they would be by building the network with the new parameters.
+    
+    Parameters
+    ----------
+    sim : `nengo_dl.Simulator`
+        The simulator to reset.
+    seed : int, optional
+        The seed the devices are drawn from, otherwise the one of each learning rule.
+    gain : float, optional
+        The new gain of all the learning rules.
+    params
+        ``r_min``, ``r_max``, ``exponent`` or ``noisy`` overriding those of the learning rules.
+    """
+    if "noisy" in params:
+        noisy = params.pop( "noisy" )
+        params[ "noise_percentage" ] = [ noisy ] * 4 if np.isscalar( noisy ) else noisy
+    
+    sim.reset()
+    for ops, builder in sim.tensor_graph.op_builder.op_builds.items():
+        if isinstance( builder, SimmPESBuilder ):
+            builder.reinitialise( sim.tensor_graph, seed=seed, gain=gain, **params )
+
+
+def frexp( x ):
+    """TensorFlow equivalent of ``np.frexp`` for positive normal numbers."""
+    if x.dtype == tf.float64:
+        int_type, mantissa_bits, bias = tf.int64, 52, 1022
+    else:
+        int_type, mantissa_bits, bias = tf.int32, 23, 126
+    
+    bits = tf.bitcast( x, int_type )
+    octave = tf.bitwise.right_shift( bits, mantissa_bits ) - bias
+    # setting the exponent field to the bias leaves the mantissa in [0.5,1)
+    mantissa = tf.bitcast( bits - tf.bitwise.left_shift( octave, mantissa_bits ), x.dtype )
+    
+    return mantissa, octave
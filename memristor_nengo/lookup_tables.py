@@ -0,0 +1,97 @@
+import numpy as np
+
+
+class PowerLawTable:
+    """Lookup table replacing the power law ``n**exponent`` of a crossbar of memristors.
+    
+    The resistance of a device after ``n`` pulses is ``r_min + r_max * n**exponent``; the table samples
+    ``n**exponent`` linearly inside each octave of ``n`` and at ``buckets`` evenly spaced values spanning the
+    exponents of the devices.  A lookup is a bilinear interpolation whose octave and position inside it come from
+    the floating point representation of ``n`` (as in ``np.frexp``), so no transcendental function is evaluated.
+    
+    Parameters
+    ----------
+    exponent : ndarray
+        The exponent of each device in the crossbar.
+    size : int
+        The number of samples in each octave of the pulse number.
+    buckets : int
+        The number of quantised exponent values.
+    max_pulses : float
+        Pulse numbers are tabulated in ``[0.5, max_pulses]``, rounded up to a power of two, and clamped outside.
+    """
+    
+    def __init__( self, exponent, size=64, buckets=64, max_pulses=2**24 ):
+        assert size >= 1 and buckets >= 2, "The table needs at least one sample per octave and two buckets"
+        
+        self.size = size
+        self.buckets = buckets
+        self.max_octave = int( np.ceil( np.log2( max_pulses ) ) )
+        self.length = (self.max_octave + 1) * size + 1
+        
+        self.exponent_min = np.min( exponent )
+        self.exponent_max = np.max( exponent )
+        self.bucket_width = (self.exponent_max - self.exponent_min) / (buckets - 1) \
+            if self.exponent_max > self.exponent_min else 1.0
+        
+        # sample i lies in octave i // size, at fraction (i % size) / size of the way to the next one
+        samples = np.arange( self.length )
+        pulses = np.ldexp( 1 + (samples % size) / size, samples // size - 1 )
+        exponents = self.exponent_min + np.arange( buckets ) * self.bucket_width
+        self.table = np.power( pulses[ np.newaxis, : ], exponents[ :, np.newaxis ] ).ravel() \
+            .astype( np.asarray( exponent ).dtype )
+        
+        # the position of each device between the exponent buckets is fixed, so it is computed only once
+        self.position = (exponent - self.exponent_min) / self.bucket_width
+    
+    @property
+    def error_bound( self ):
+        """Upper bound on the relative error of the table with respect to the analytical ``n**exponent``.
+        
+        It also bounds the relative error on ``r_min + r_max * n**exponent`` for tabulated pulse numbers, and sums
+        the linear interpolation error along the pulse number and along the exponent.
+        """
+        exponents = np.array( [ self.exponent_min, self.exponent_max ] )
+        
+        # |f''| h^2 / 8 with h the sample spacing, relative to the smallest value of f inside the interval
+        pulses_error = np.max( np.abs( exponents * (exponents - 1) ) * (1 + 1 / self.size)**np.abs( exponents ) ) \
+                       / (8 * self.size**2)
+        
+        if self.exponent_max == self.exponent_min:
+            return pulses_error
+        
+        # d^2/dc^2 n^c = ln(n)^2 n^c and n^c changes by at most n^w across a bucket of width w
+        log_pulses = self.max_octave * np.log( 2 )
+        exponent_error = self.bucket_width**2 * log_pulses**2 / 8 * np.exp( self.bucket_width * log_pulses )
+        
+        return pulses_error + exponent_error
+    
+    def __call__( self, pulses, position ):
+        """Look up ``pulses**exponent`` for devices at the given ``position`` between the exponent buckets."""
+        mantissa, octave = np.frexp( pulses )
+        
+        # position along the pulse number axis, split into sample index and fraction of the way to the next sample
+        x = octave + 2 * mantissa
+        x -= 1
+        x *= self.size
+        np.clip( x, 0, self.length - 1, out=x )
+        i = x.astype( np.int64 )
+        np.minimum( i, self.length - 2, out=i )
+        x -= i
+        
+        # same along the exponent axis
+        b = np.minimum( position.astype( np.int64 ), self.buckets - 2 )
+        u = position - b
+        
+        i += b * self.length
+        low = self.table[ i ]
+        low += x * (self.table[ i + 1 ] - low)
+        i += self.length
+        high = self.table[ i ]
+        high += x * (self.table[ i + 1 ] - high)
+        
+        high -= low
+        high *= u
+        low += high
+        
+        return low
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+from dataclasses import asdict, is_dataclass
+
+import numpy as np
+
+
+def to_json( value ):
+    """Turn the NumPy arrays and scalars in ``value`` into lists and numbers, so that it can be written as JSON."""
+    if isinstance( value, dict ):
+        return { str( k ): to_json( v ) for k, v in value.items() }
+    if isinstance( value, (list, tuple) ):
+        return [ to_json( v ) for v in value ]
+    if isinstance( value, np.ndarray ):
+        return value.tolist()
+    if isinstance( value, np.generic ):
+        return value.item()
+    return value
+
+
+def config_key( config ):
+    """The SHA-256 of a run configuration, a dataclass or a dict which should include the seed of the run.
+    
+    Equal configurations get the same key whatever the order of their fields, and tuples and lists are the same.
+    """
+    if is_dataclass( config ):
+        config = asdict( config )
+    return hashlib.sha256( json.dumps( to_json( config ), sort_keys=True ).encode() ).hexdigest()
+
+
+class ResultsStore:
+    """An append-only JSON Lines file with one record for each finished run, keyed by `config_key`.
+    
+    Each record is written and flushed to disk as soon as its run is over, so that an interrupted sweep keeps the runs
+    it completed, and running it again can skip them.  When a key was written more than once the last record wins,
+    which is how a failed run is replaced by its successful retry.
+    """
+    
+    def __init__( self, path ):
+        self.path = path
+        self.records = { }
+        if os.path.dirname( path ):
+            os.makedirs( os.path.dirname( path ), exist_ok=True )
+        if os.path.exists( path ):
+            with open( path ) as f:
+                lines = f.read().split( "\n" )
+            for line in lines:
+                try:
+                    record = json.loads( line )
+                except json.JSONDecodeError:
+                    # the last line is cut short if the sweep was killed while writing it
+                    continue
+                # a line cut where it still parses, as a lone number, is not a record either
+                if not isinstance( record, dict ) or "key" not in record:
+                    continue
+                self.records[ record[ "key" ] ] = record
+            # so that the next record does not end up on the same line as a cut one
+            if lines[ -1 ]:
+                with open( path, "a" ) as f:
+                    f.write( "\n" )
+    
+    def __len__( self ):
+        return len( self.records )
+    
+    def __contains__( self, key ):
+        return key in self.records
+    
+    def get( self, key, default=None ):
+        return self.records.get( key, default )
+    
+    def completed( self, key ):
+        """Whether the run with ``key`` finished successfully and does not need to be run again."""
+        return self.records.get( key, { } ).get( "status" ) == "ok"
+    
+    def add( self, key, record ):
+        """Append ``record``, a JSON-serialisable dict, under ``key`` and make sure it reached the disk."""
+        record = { "key": key, **to_json( record ) }
+        with open( self.path, "a" ) as f:
+            f.write( json.dumps( record ) + "\n" )
+            f.flush()
+            os.fsync( f.fileno() )
+        self.records[ key ] = record
@@ -0,0 +1,191 @@
+import csv
+import multiprocessing
+import os
+import time
+import traceback
+from collections import deque
+from dataclasses import asdict, dataclass, fields
+from multiprocessing.connection import wait
+from typing import Optional
+
+import numpy as np
+
+from memristor_nengo.experiment import MPESConfig, MPESResult, run_mpes
+from memristor_nengo.store import config_key
+
+
+@dataclass
+class SweepRecord:
+    """The outcome of one run of a sweep.
+    
+    ``status`` is ok, failed or timeout; the result is None unless the run succeeded, and the error then holds the
+    traceback or the reason the run was stopped.
+    """
+    index: int
+    config: MPESConfig
+    status: str
+    attempts: int
+    elapsed: float
+    result: Optional[ MPESResult ] = None
+    error: Optional[ str ] = None
+    # whether the run was completed by an earlier sweep and loaded from the store
+    stored: bool = False
+    
+    def summary( self ):
+        """The mean over the dimensions of the MSE and of the correlations of the run, NaN if it failed."""
+        if self.result is None:
+            return dict.fromkeys( ("mse", "pearson", "spearman", "kendall"), np.nan )
+        return { "mse": np.mean( self.result.mse ),
+                 "pearson": np.mean( self.result.pearson ),
+                 "spearman": np.mean( self.result.spearman ),
+                 "kendall": np.mean( self.result.kendall ) }
+
+
+def result_to_dict( result ):
+    """The fields of an `MPESResult` but for the data of its probes, which is too large for the store."""
+    return { f.name: getattr( result, f.name ) for f in fields( result ) if f.name != "arrays" }
+
+
+def result_from_dict( saved ):
+    """The `MPESResult` saved by `result_to_dict`, without the data of its probes."""
+    result = MPESResult( **saved )
+    if result.mse is not None:
+        result.mse = np.array( result.mse )
+    if result.mse_to_rho is not None:
+        result.mse_to_rho = np.array( result.mse_to_rho )
+    return result
+
+
+def sweep_seed( seed, *indices ):
+    """A seed for the run at ``indices`` of a sweep, which only depends on the base ``seed`` and on the indices.
+    
+    The seeds of different runs are independent, and a run gets the same seed however many workers share the sweep
+    and whether or not it was retried.
+    """
+    return int( np.random.SeedSequence( [ seed, *indices ] ).generate_state( 1 )[ 0 ] )
+
+
+def run_child( config, connection ):
+    """Run `run_mpes` in a worker process and send back the result, or the traceback of the exception."""
+    try:
+        connection.send( ("ok", run_mpes( config )) )
+    except BaseException:
+        connection.send( ("failed", traceback.format_exc()) )
+    finally:
+        connection.close()
+
+
+def run_sweep( configs, workers=None, timeout=None, retries=1, on_record=None, store=None ):
+    """Run `run_mpes` on each of ``configs`` on at most ``workers`` processes at a time.
+    
+    Each run has its own process, so that one that takes longer than ``timeout`` or crashes the interpreter can be
+    stopped without losing the others.  A run that fails is started again, with the same configuration, up to
+    ``retries`` times; a run that still fails is recorded as such instead of being dropped.
+    
+    With a ``store``, each run is saved in it as soon as it is over, and the runs whose configuration, seed included,
+    already completed in it are not run again, so an interrupted sweep can be started again, or given more repeats,
+    without losing or repeating work.
+    
+    Parameters
+    ----------
+    configs : list of `MPESConfig`
+        The runs of the sweep, which should already have their seeds, for example from `sweep_seed`.
+    workers : int, optional
+        The number of runs at the same time.  Default is the number of CPUs.
+    timeout : float, optional
+        The seconds after which a run is stopped.  Default is no limit.
+    retries : int
+        The number of times a failed run is started again.
+    on_record : callable, optional
+        Called with each `SweepRecord` as soon as its run is over, in the order the runs end, and first with the
+        records loaded from the store.
+    store : `memristor_nengo.store.ResultsStore`, optional
+        Where the runs are saved and the completed ones are looked up.
+    
+    Returns
+    -------
+    records : list of `SweepRecord`
+        The records of the runs, in the same order as ``configs``.
+    """
+    workers = workers or os.cpu_count()
+    # forked workers do not import the sweep script again, which has no main guard
+    context = multiprocessing.get_context( "fork" if "fork" in multiprocessing.get_all_start_methods() else None )
+    records = [ None ] * len( configs )
+    keys = [ config_key( config ) if store is not None else None for config in configs ]
+    pending = deque()
+    running = { }
+    
+    for index, key in enumerate( keys ):
+        if store is not None and store.completed( key ):
+            saved = store.get( key )
+            records[ index ] = SweepRecord( index, configs[ index ], saved[ "status" ], saved[ "attempts" ],
+                                            saved[ "elapsed" ], result_from_dict( saved[ "result" ] ), stored=True )
+            if on_record is not None:
+                on_record( records[ index ] )
+        else:
+            pending.append( (index, 1) )
+    
+    def finish( index, attempt, start_time, status, result=None, error=None ):
+        if status != "ok" and attempt <= retries:
+            pending.append( (index, attempt + 1) )
+            return
+        records[ index ] = SweepRecord( index, configs[ index ], status, attempt, time.monotonic() - start_time,
+                                        result, error )
+        if store is not None:
+            store.add( keys[ index ], { "config": asdict( configs[ index ] ), "status": status, "attempts": attempt,
+                                        "elapsed": records[ index ].elapsed, "error": error,
+                                        "result": result_to_dict( result ) if result is not None else None } )
+        if on_record is not None:
+            on_record( records[ index ] )
+    
+    while pending or running:
+        while pending and len( running ) < workers:
+            index, attempt = pending.popleft()
+            receiver, sender = context.Pipe( duplex=False )
+            process = context.Process( target=run_child, args=(configs[ index ], sender), daemon=True )
+            process.start()
+            sender.close()
+            running[ receiver ] = (index, attempt, process, time.monotonic())
+        
+        # wake up when a run sends its result, dies, or reaches its timeout
+        deadline = None
+        if timeout is not None:
+            deadline = max( 0.0, min( start + timeout for _, _, _, start in running.values() ) - time.monotonic() )
+        wait( list( running ) + [ process.sentinel for _, _, process, _ in running.values() ], timeout=deadline )
+        
+        for receiver, (index, attempt, process, start_time) in list( running.items() ):
+            if receiver.poll():
+                try:
+                    status, payload = receiver.recv()
+                except EOFError:
+                    status, payload = "failed", None
+                process.join()
+                if status == "ok":
+                    finish( index, attempt, start_time, status, result=payload )
+                else:
+                    finish( index, attempt, start_time, status,
+                            error=payload or f"Exited with code {process.exitcode}" )
+            elif not process.is_alive():
+                finish( index, attempt, start_time, "failed", error=f"Exited with code {process.exitcode}" )
+            elif timeout is not None and time.monotonic() - start_time > timeout:
+                process.terminate()
+                process.join()
+                finish( index, attempt, start_time, "timeout", error=f"Stopped after {timeout} s" )
+            else:
+                continue
+            receiver.close()
+            del running[ receiver ]
+    
+    return records
+
+
+def save_records( records, path ):
+    """Write one row per run to the CSV file at ``path``, with its configuration, its outcome and its statistics."""
+    rows = [ { **asdict( record.config ), "status": record.status, "attempts": record.attempts,
+               "elapsed": record.elapsed, "error": "".join( (record.error or "").strip().splitlines()[ -1: ] ),
+               **record.summary() }
+             for record in records ]
+    with open( path, "w", newline="" ) as f:
+        writer = csv.DictWriter( f, fieldnames=list( rows[ 0 ] ) if rows else [ ] )
+        writer.writeheader()
+        writer.writerows( rows )
@@ -0,0 +1,109 @@
+import nengo
+import numpy as np
+import pytest
+
+from memristor_nengo.extras import build_sine_network
+from memristor_nengo.learning_rules import checkpoint_signals, load_checkpoint, load_crossbar, save_checkpoint
+
+
+def read_state( sim ):
+    if hasattr( sim, "tensor_graph" ):
+        import tensorflow as tf
+        
+        def get( sig ):
+            return tf.keras.backend.get_value( sim.tensor_graph.get_tensor( sig ) )
+    else:
+        def get( sig ):
+            return np.array( sim.signals[ sig ] )[ np.newaxis ]
+    
+    return { f"{i}/{key}": get( sig )
+             for i, signals in enumerate( checkpoint_signals( sim.model ) ) for key, sig in signals.items() }
+
+
+@pytest.mark.parametrize( "pulse_state", [ False, True ] )
+def test_nengo_round_trip( tmp_path, pulse_state ):
+    path = str( tmp_path / "checkpoint.npz" )
+    model, probes = build_sine_network( 20, seed=0, weights_every=0.001, pulse_state=pulse_state )
+    with nengo.Simulator( model, seed=0, progress_bar=False ) as sim:
+        sim.run_steps( 100 )
+        save_checkpoint( sim, path )
+        saved = read_state( sim )
+        weights = sim.data[ probes[ "weights" ] ][ -1 ]
+    
+    with nengo.Simulator( model, seed=0, progress_bar=False ) as sim:
+        load_checkpoint( sim, path )
+        assert sim.n_steps == 100
+        assert sim.time == pytest.approx( 0.1 )
+        restored = read_state( sim )
+        assert restored.keys() == saved.keys()
+        assert ("0/pos_pulses" in restored) == pulse_state
+        for key in saved:
+            assert np.array_equal( restored[ key ], saved[ key ] ), key
+        assert np.array_equal( restored[ "0/weights" ][ 0 ], weights )
+        
+        # the resumed simulation carries on from the step it was saved at
+        sim.run_steps( 10 )
+        assert sim.n_steps == 110
+        assert sim.trange()[ -1 ] == pytest.approx( 0.11 )
+
+
+@pytest.mark.parametrize( "minibatch_size, pulse_state", [ (1, False), (1, True), (3, False) ] )
+def test_nengo_dl_round_trip( tmp_path, minibatch_size, pulse_state ):
+    nengo_dl = pytest.importorskip( "nengo_dl" )
+    
+    path = str( tmp_path / "checkpoint.npz" )
+    model, probes = build_sine_network( 20, seed=0, weights_every=0.001, pulse_state=pulse_state )
+    with nengo_dl.Simulator( model, seed=0, minibatch_size=minibatch_size, progress_bar=False ) as sim:
+        sim.run_steps( 100 )
+        save_checkpoint( sim, path )
+        saved = read_state( sim )
+        weights = sim.data[ probes[ "weights" ] ][ ..., -1, :, : ]
+    
+    with nengo_dl.Simulator( model, seed=0, minibatch_size=minibatch_size, progress_bar=False ) as sim:
+        load_checkpoint( sim, path )
+        assert sim.n_steps == 100
+        assert sim.time == pytest.approx( 0.1 )
+        restored = read_state( sim )
+        assert restored.keys() == saved.keys()
+        for key in saved:
+            assert np.array_equal( restored[ key ], saved[ key ] ), key
+        assert np.array_equal( restored[ "0/weights" ].reshape( weights.shape ), weights )
+        
+        # the resumed simulation carries on from the step it was saved at
+        sim.run_steps( 10 )
+        assert sim.n_steps == 110
+        assert sim.trange()[ -1 ] == pytest.approx( 0.11 )
+
+
+@pytest.mark.parametrize( "backend", [ "nengo", "nengo_dl" ] )
+@pytest.mark.parametrize( "pulse_state", [ False, True ] )
+def test_warm_start( tmp_path, backend, pulse_state ):
+    simulator = nengo.Simulator if backend == "nengo" else pytest.importorskip( "nengo_dl" ).Simulator
+    path = str( tmp_path / "checkpoint.npz" )
+    model, _ = build_sine_network( 20, seed=0, pulse_state=pulse_state )
+    with nengo.Simulator( model, seed=0, progress_bar=False ) as sim:
+        sim.run_steps( 100 )
+        save_checkpoint( sim, path )
+        saved = read_state( sim )
+    
+    # a new simulation starts from the saved crossbar, at time zero
+    crossbar = load_crossbar( path )
+    model, probes = build_sine_network( 20, seed=0, weights_every=0.001, pulse_state=pulse_state,
+                                        transform=crossbar[ "weights" ][ 0 ], initial_state=crossbar )
+    with simulator( model, seed=0, progress_bar=False ) as sim:
+        assert sim.n_steps == 0
+        started = read_state( sim )
+        assert started.keys() == saved.keys()
+        assert ("0/pos_pulses" in started) == pulse_state
+        for key in saved:
+            assert np.allclose( started[ key ], saved[ key ], rtol=1e-6, atol=0 ) if backend == "nengo_dl" \
+                else np.array_equal( started[ key ], saved[ key ] ), key
+        
+        # and learns from there
+        sim.run_steps( 10 )
+        weights = np.reshape( sim.data[ probes[ "weights" ] ], (10, 20, 20) )
+        assert np.allclose( weights[ 0 ], crossbar[ "weights" ][ 0 ], rtol=1e-3, atol=1e-6 )
+        assert np.any( weights[ -1 ] != weights[ 0 ] )
+    
+    with pytest.raises( ValueError, match="has no mPES connection 1" ):
+        load_crossbar( path, connection=1 )
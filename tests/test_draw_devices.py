@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from scipy.stats import truncnorm
+
+from memristor_nengo.learning_rules import draw_devices, truncated_normal
+
+
+@pytest.mark.parametrize( "size", [ 1000, (40, 25) ] )
+@pytest.mark.parametrize( "low, upp", [ (0, np.inf), (-1, 1), (1.5, 3) ] )
+def test_truncated_normal( size, low, upp ):
+    samples = truncated_normal( np.random.default_rng( 0 ), 0, 1, low, upp, size )
+    
+    assert samples.shape == np.empty( size ).shape
+    assert np.all( (samples >= low) & (samples <= upp) )
+    assert np.mean( samples ) == pytest.approx( truncnorm.mean( low, upp ), abs=0.1 )
+
+
+@pytest.mark.parametrize( "noise", [ 0.15, 0.5 ] )
+def test_draw_devices( noise ):
+    # at a noise of 0.5 some of the minimum resistances are rejected and redrawn
+    mpes = SimpleNamespace( r_min=200, r_max=2.3e8, exponent=-0.146, noise_percentage=[ noise ] * 4 )
+    devices = draw_devices( mpes, (30, 30), 0, block_size=100 )
+    
+    assert all( x.shape == (30, 30) for x in devices )
+    assert np.all( devices[ 0 ] >= 0 ) and np.all( devices[ 1 ] >= np.max( devices[ 0 ] ) )
+    # the draw doesn't depend on the number of threads filling the blocks
+    for x, y in zip( devices, draw_devices( mpes, (30, 30), 0, threads=4, block_size=100 ) ):
+        assert np.array_equal( x, y )
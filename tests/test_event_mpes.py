@@ -0,0 +1,50 @@
+import nengo
+import numpy as np
+import pytest
+from nengo.exceptions import ValidationError
+
+from memristor_nengo.learning_rules import EventmPES
+
+
+def build_network( neuron_type=nengo.LIF(), from_neurons=True ):
+    with nengo.Network( seed=0 ) as model:
+        input_node = nengo.Node( lambda t: [ np.sin( 2 * np.pi * t ), np.cos( 2 * np.pi * t ) ] )
+        pre = nengo.Ensemble( 20, 2, neuron_type=neuron_type )
+        post = nengo.Ensemble( 20, 2 )
+        error = nengo.Ensemble( 20, 2 )
+        nengo.Connection( input_node, pre )
+        learning_rule_type = EventmPES( noisy=[ 0.15 ] * 4, gain=1e4, seed=0 )
+        if from_neurons:
+            conn = nengo.Connection( pre.neurons, post.neurons, transform=np.zeros( (20, 20) ),
+                                     learning_rule_type=learning_rule_type )
+        else:
+            # the pre output of an ensemble is its decoded value even when the connection solves for weights
+            conn = nengo.Connection( pre, post, solver=nengo.solvers.LstsqL2( weights=True ),
+                                     learning_rule_type=learning_rule_type )
+        nengo.Connection( error, conn.learning_rule )
+        nengo.Connection( post, error )
+        nengo.Connection( pre, error, transform=-1 )
+        spikes_probe = nengo.Probe( pre.neurons, synapse=None )
+        memristors_probe = nengo.Probe( conn.learning_rule, "pos_memristors", synapse=None )
+    
+    return model, conn, spikes_probe, memristors_probe
+
+
+@pytest.mark.parametrize( "neuron_type, from_neurons", [ (nengo.LIF(), False), (nengo.LIFRate(), True),
+                                                         (nengo.RectifiedLinear(), True) ] )
+def test_spiking_neurons_only( neuron_type, from_neurons ):
+    model, *_ = build_network( neuron_type, from_neurons )
+    with pytest.raises( ValidationError, match="spiking neurons" ):
+        nengo.Simulator( model, progress_bar=False )
+
+
+def test_silent_neurons_not_pulsed():
+    model, conn, spikes_probe, memristors_probe = build_network()
+    with nengo.Simulator( model, progress_bar=False ) as sim:
+        initial = np.array( sim.signals[ sim.model.sig[ conn.learning_rule ][ "pos_memristors" ] ] )
+        sim.run_steps( 20 )
+    
+    # a device is only pulsed on the steps its pre neuron spikes
+    spiked = np.cumsum( sim.data[ spikes_probe ] > 0, axis=0 ) > 0
+    changed = np.any( sim.data[ memristors_probe ] != initial, axis=1 )
+    assert np.any( changed ) and not np.any( changed & ~spiked )
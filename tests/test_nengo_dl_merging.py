@@ -0,0 +1,61 @@
+import nengo
+import numpy as np
+import pytest
+
+from memristor_nengo.learning_rules import SimmPES, mPES
+
+nengo_dl = pytest.importorskip( "nengo_dl" )
+
+
+def build_network( post_sizes, pre_size=20 ):
+    """Learn the identity on independent neuron-to-neuron connections into posts of ``post_sizes`` neurons."""
+    with nengo.Network( seed=0 ) as model:
+        input_node = nengo.Node( lambda t: [ np.sin( 2 * np.pi * t ), np.cos( 2 * np.pi * t ) ] )
+        weight_probes = [ ]
+        for i, n_neurons in enumerate( post_sizes ):
+            pre = nengo.Ensemble( pre_size, 2 )
+            post = nengo.Ensemble( n_neurons, 2 )
+            error = nengo.Ensemble( 20, 2 )
+            nengo.Connection( input_node, pre )
+            conn = nengo.Connection( pre.neurons, post.neurons, transform=np.zeros( (n_neurons, pre_size) ),
+                                     learning_rule_type=mPES( noisy=[ 0.15 ] * 4, gain=1e4, seed=i ) )
+            nengo.Connection( error, conn.learning_rule )
+            nengo.Connection( post, error )
+            nengo.Connection( pre, error, transform=-1 )
+            weight_probes.append( nengo.Probe( conn, "weights", synapse=None, sample_every=0.01 ) )
+    
+    return model, weight_probes
+
+
+def run_nengo_dl( planner, post_sizes ):
+    model, weight_probes = build_network( post_sizes )
+    with model:
+        # in float64 NengoDL computes the same weights as Nengo, bit for bit
+        nengo_dl.configure_settings( planner=planner, dtype="float64" )
+    with nengo_dl.Simulator( model, progress_bar=False ) as sim:
+        groups = [ ops for ops in sim.tensor_graph.plan if isinstance( ops[ 0 ], SimmPES ) ]
+        sim.run_steps( 100 )
+        
+        return groups, [ sim.data[ p ] for p in weight_probes ]
+
+
+def test_padded_group():
+    from nengo_dl.graph_optimizer import greedy_planner, noop_planner
+    
+    post_sizes = [ 20, 30, 20, 30 ]
+    groups, merged_weights = run_nengo_dl( greedy_planner, post_sizes )
+    # the default tree_planner schedules the ops of each post size on their own, see `SimmPESBuilder`
+    assert len( groups ) == 1
+    assert sorted( op.weights.shape[ 0 ] for op in groups[ 0 ] ) == sorted( post_sizes )
+    
+    _, separate_weights = run_nengo_dl( noop_planner, post_sizes )
+    model, weight_probes = build_network( post_sizes )
+    with nengo.Simulator( model, progress_bar=False ) as sim:
+        sim.run_steps( 100 )
+        nengo_weights = [ sim.data[ p ] for p in weight_probes ]
+    
+    for merged, separate, reference in zip( merged_weights, separate_weights, nengo_weights ):
+        assert np.any( merged[ -1 ] != 0 )
+        # the padding rows are masked out of the update, so merging changes none of the real ones
+        assert np.array_equal( merged, separate )
+        assert np.array_equal( merged, reference )
@@ -0,0 +1,47 @@
+import json
+
+from memristor_nengo.experiment import MPESConfig
+from memristor_nengo.store import ResultsStore, config_key
+
+
+def test_config_key():
+    assert config_key( MPESConfig( seed=1 ) ) == config_key( MPESConfig( seed=1 ) )
+    assert config_key( MPESConfig( seed=1 ) ) != config_key( MPESConfig( seed=2 ) )
+    assert config_key( { "a": (1, 2), "b": 3 } ) == config_key( { "b": 3, "a": [ 1, 2 ] } )
+
+
+def test_last_record_wins( tmp_path ):
+    path = str( tmp_path / "runs.jsonl" )
+    store = ResultsStore( path )
+    store.add( "a", { "status": "failed" } )
+    store.add( "b", { "status": "ok" } )
+    store.add( "a", { "status": "ok", "attempts": 2 } )
+    
+    store = ResultsStore( path )
+    assert len( store ) == 2
+    assert store.get( "a" )[ "attempts" ] == 2
+    assert store.completed( "a" ) and store.completed( "b" ) and not store.completed( "c" )
+
+
+def test_cut_last_line( tmp_path ):
+    path = tmp_path / "runs.jsonl"
+    store = ResultsStore( str( path ) )
+    store.add( "a", { "status": "ok" } )
+    store.add( "b", { "status": "ok" } )
+    # the sweep was killed while writing the record of c
+    path.write_text( path.read_text() + json.dumps( { "key": "c", "status": "ok" } )[ :12 ] )
+    
+    store = ResultsStore( str( path ) )
+    assert len( store ) == 2 and "c" not in store
+    store.add( "c", { "status": "ok" } )
+    
+    store = ResultsStore( str( path ) )
+    assert len( store ) == 3 and store.completed( "c" )
+
+
+def test_lines_without_key( tmp_path ):
+    path = tmp_path / "runs.jsonl"
+    path.write_text( json.dumps( { "status": "ok" } ) + "\n12\n" + json.dumps( { "key": "a", "status": "ok" } ) + "\n" )
+    
+    store = ResultsStore( str( path ) )
+    assert len( store ) == 1 and store.completed( "a" )
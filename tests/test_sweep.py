@@ -0,0 +1,87 @@
+import os
+import time
+
+import pytest
+
+import memristor_nengo.sweep
+from memristor_nengo.experiment import MPESConfig, MPESResult
+from memristor_nengo.store import ResultsStore
+from memristor_nengo.sweep import run_sweep, sweep_seed
+
+
+@pytest.fixture
+def stub_run_mpes( monkeypatch, tmp_path ):
+    """Replace `run_mpes` in the forked workers by a stub whose behaviour is chosen by the function of the config.
+    
+    ``fail <n>`` fails the first ``n`` attempts, ``sleep`` never ends and ``crash`` kills the worker; every attempt is
+    counted in a file named after the seed of the run.
+    """
+    
+    def run_mpes( config ):
+        attempts_path = tmp_path / str( config.seed )
+        attempts = int( attempts_path.read_text() ) + 1 if attempts_path.exists() else 1
+        attempts_path.write_text( str( attempts ) )
+        if config.function.startswith( "fail" ) and attempts <= int( config.function.split()[ 1 ] ):
+            raise RuntimeError( f"attempt {attempts} failed" )
+        if config.function == "sleep":
+            time.sleep( 60 )
+        if config.function == "crash":
+            os._exit( 3 )
+        return MPESResult( n_steps=config.seed )
+    
+    monkeypatch.setattr( memristor_nengo.sweep, "run_mpes", run_mpes )
+    
+    return lambda seed: int( (tmp_path / str( seed )).read_text() )
+
+
+def test_sweep_seed():
+    assert sweep_seed( 0, 1, 2 ) == sweep_seed( 0, 1, 2 )
+    assert len( { sweep_seed( 0, i, j ) for i in range( 10 ) for j in range( 10 ) } ) == 100
+    assert sweep_seed( 0, 1 ) != sweep_seed( 1, 1 )
+
+
+@pytest.mark.parametrize( "workers", [ 1, 3 ] )
+def test_records_in_order( stub_run_mpes, workers ):
+    configs = [ MPESConfig( seed=sweep_seed( 0, i ) ) for i in range( 5 ) ]
+    records = run_sweep( configs, workers=workers )
+    
+    # the runs get the same seeds and their records the same order however many workers run them
+    assert [ r.index for r in records ] == list( range( 5 ) )
+    assert [ r.result.n_steps for r in records ] == [ c.seed for c in configs ]
+    assert all( r.status == "ok" and r.attempts == 1 for r in records )
+
+
+def test_retries( stub_run_mpes ):
+    configs = [ MPESConfig( function="fail 1", seed=1 ), MPESConfig( function="fail 5", seed=2 ),
+                MPESConfig( function="crash", seed=3 ) ]
+    records = run_sweep( configs, workers=2, retries=2 )
+    
+    assert records[ 0 ].status == "ok" and records[ 0 ].attempts == 2
+    assert records[ 1 ].status == "failed" and records[ 1 ].attempts == 3 and stub_run_mpes( 2 ) == 3
+    assert "attempt 3 failed" in records[ 1 ].error and records[ 1 ].result is None
+    assert records[ 2 ].status == "failed" and records[ 2 ].error == "Exited with code 3"
+
+
+def test_timeout( stub_run_mpes ):
+    start_time = time.monotonic()
+    records = run_sweep( [ MPESConfig( function="sleep", seed=1 ), MPESConfig( seed=2 ) ], workers=2, timeout=1,
+                         retries=1 )
+    
+    assert time.monotonic() - start_time < 30
+    assert records[ 0 ].status == "timeout" and records[ 0 ].attempts == 2 and stub_run_mpes( 1 ) == 2
+    assert records[ 1 ].status == "ok"
+
+
+def test_store_skips_completed( stub_run_mpes, tmp_path ):
+    store = ResultsStore( str( tmp_path / "runs.jsonl" ) )
+    configs = [ MPESConfig( function="fail 1", seed=1 ), MPESConfig( seed=2 ) ]
+    run_sweep( configs, workers=1, retries=0, store=store )
+    
+    # only the failed run is run again, by a sweep given one more repeat
+    store = ResultsStore( str( tmp_path / "runs.jsonl" ) )
+    records = run_sweep( configs + [ MPESConfig( seed=3 ) ], workers=1, retries=0, store=store )
+    
+    assert [ r.stored for r in records ] == [ False, True, False ]
+    assert all( r.status == "ok" for r in records )
+    assert records[ 1 ].result.n_steps == 2
+    assert [ stub_run_mpes( seed ) for seed in (1, 2, 3) ] == [ 2, 1, 1 ]